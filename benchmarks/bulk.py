@@ -0,0 +1,59 @@
+"""Compare tracking pre-collected events in a loop and with `track_many`.
+
+    python -m benchmarks.bulk [-n NUMBER]
+
+The consumers are stopped so that only enqueueing is measured.
+"""
+import argparse
+import gc
+import time
+
+from eventbridge.analytics.client import Client
+
+
+def events(number):
+    return [{'user_id': 'user-%d' % (i % 100), 'event': 'Order Completed',
+             'properties': {'revenue': 27.5, 'currency': 'USD'}}
+            for i in range(number)]
+
+
+def client(strict, number):
+    client = Client(source_id='benchmark', event_bus_name='benchmark',
+                    region_name='us-east-1', max_queue_size=number + 1,
+                    strict=strict)
+    client.pool.join()
+    return client
+
+
+def loop(client, rows):
+    for row in rows:
+        client.track(**row)
+
+
+def bulk(client, rows):
+    client.track_many(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=50000,
+                        help='events to track')
+    options = parser.parse_args()
+
+    print('%-8s %-12s %12s' % ('mode', 'api', 'events/sec'))
+    for strict in (True, False):
+        for name, fn in (('track', loop), ('track_many', bulk)):
+            rows = events(options.number)
+            target = client(strict, options.number)
+            gc.collect()
+            start = time.perf_counter()
+            fn(target, rows)
+            elapsed = time.perf_counter() - start
+            # don't let the queued events slow down the next measurement
+            target.queue.queue.clear()
+            print('%-8s %-12s %12.0f' % ('strict' if strict else 'fast',
+                                         name, options.number / elapsed))
+
+
+if __name__ == '__main__':
+    main()
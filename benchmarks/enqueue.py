@@ -0,0 +1,53 @@
+"""Measure the latency of `track()` on the calling thread.
+
+    python -m benchmarks.enqueue [-n NUMBER]
+
+The consumers are stopped so that only the enqueue itself is measured.
+"""
+from datetime import date
+import argparse
+import time
+
+from eventbridge.analytics.client import Client
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+def measure(strict, number):
+    client = Client(source_id='benchmark', event_bus_name='benchmark',
+                    region_name='us-east-1', access_key='benchmark',
+                    secret_access_key='benchmark',
+                    max_queue_size=number + 1,
+                    strict=strict)
+    client.pool.join()
+    properties = {'revenue': 27.5, 'currency': 'USD',
+                  'deliveryDate': date.today()}
+    timer = time.perf_counter
+    samples = []
+    for i in range(number):
+        start = timer()
+        client.track('user-%d' % (i % 100), 'Order Completed', properties)
+        samples.append(timer() - start)
+    samples.sort()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=100000,
+                        help='track calls per measurement')
+    options = parser.parse_args()
+
+    print('%-8s %10s %10s %10s' % ('mode', 'p50 us', 'p99 us', 'max us'))
+    for strict in (True, False):
+        samples = measure(strict, options.number)
+        print('%-8s %10.2f %10.2f %10.2f' % (
+            'strict' if strict else 'fast',
+            percentile(samples, 50) * 1e6, percentile(samples, 99) * 1e6,
+            samples[-1] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""An in-process stand-in for the EventBridge PutEvents API."""
+from threading import Lock
+import collections
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+
+class FakeEventBridge(object):
+    """Answers `put_events` like the boto client, without the network.
+
+    Every call sleeps `latency` seconds, plus or minus up to `jitter`. A
+    `throttle_rate` fraction of the calls fail with a ThrottlingException,
+    and a `failure_rate` fraction of the entries of the other calls are
+    rejected with an InternalFailure, like a partially failed batch.
+
+    With a `quota`, calls beyond `quota` per second are throttled as well,
+    like the account's PutEvents quota; a fake can be shared by several
+    clients to stand in for a fleet.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0,
+                 failure_rate=0.0, seed=None, quota=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.quota = quota
+        # when the calls of the last second were accepted
+        self.accepted = collections.deque()
+        self.lock = Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.bytes = 0
+
+    def put_events(self, Entries):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency + self.random.uniform(-self.jitter,
+                                                       self.jitter)
+            throttled = self.random.random() < self.throttle_rate
+            if self.quota is not None and not throttled:
+                now = time.monotonic()
+                while self.accepted and self.accepted[0] < now - 1.0:
+                    self.accepted.popleft()
+                throttled = len(self.accepted) >= self.quota
+                if not throttled:
+                    self.accepted.append(now)
+            failed = [self.random.random() < self.failure_rate
+                      for _ in Entries]
+        if delay > 0:
+            time.sleep(delay)
+
+        if throttled:
+            with self.lock:
+                self.throttled += 1
+            raise ClientError({'Error': {'Code': 'ThrottlingException',
+                                         'Message': 'Rate exceeded'}},
+                              'PutEvents')
+
+        results = []
+        for entry, fail in zip(Entries, failed):
+            if fail:
+                results.append({'ErrorCode': 'InternalFailure',
+                                'ErrorMessage': 'Internal failure'})
+            else:
+                results.append({'EventId': 'fake'})
+        size = sum(len(entry['Detail']) for entry in Entries)
+        with self.lock:
+            self.rejected += sum(failed)
+            self.delivered += len(Entries) - sum(failed)
+            self.bytes += size
+        return {'FailedEntryCount': sum(failed), 'Entries': results}
+
+
+def install(client, fake):
+    """Make `client` upload to `fake` instead of AWS."""
+    client.event_bridge.boto_client = fake
+    return fake
@@ -0,0 +1,65 @@
+"""Measure how long importing the library and creating a client take.
+
+    python -m benchmarks.import_time [-n NUMBER] [--max-ms MS]
+
+Every measurement runs in a fresh interpreter. Exits with an error if boto3
+is loaded before the first upload, or if the median import takes longer
+than `--max-ms`, so it can guard against regressions in CI.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import eventbridge.analytics
+imported = time.perf_counter()
+from eventbridge.analytics.client import Client
+client = Client(source_id='benchmark', event_bus_name='benchmark',
+                send=False)
+constructed = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'construct': constructed - imported,
+    'boto3': 'boto3' in sys.modules,
+}))
+'''
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, '-c', PROBE])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=10,
+                        help='interpreters to start')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail if the median import takes longer')
+    options = parser.parse_args()
+
+    runs = [measure() for _ in range(options.number)]
+    import_ms = median([run['import'] for run in runs]) * 1e3
+    construct_ms = median([run['construct'] for run in runs]) * 1e3
+    boto3 = any(run['boto3'] for run in runs)
+    print('%-24s %.1f' % ('import (ms)', import_ms))
+    print('%-24s %.1f' % ('Client(send=False) (ms)', construct_ms))
+    print('%-24s %s' % ('boto3 loaded', boto3))
+
+    if boto3:
+        sys.exit('boto3 was imported before the first upload')
+    if options.max_ms is not None and import_ms > options.max_ms:
+        sys.exit('import took %.1fms, more than %.1fms' % (
+            import_ms, options.max_ms))
+
+
+if __name__ == '__main__':
+    main()
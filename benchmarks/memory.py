@@ -0,0 +1,50 @@
+"""Measure the memory each queued event takes, with tracemalloc.
+
+    python -m benchmarks.memory [-n NUMBER]
+
+The consumers are stopped, so every tracked event stays on the queue.
+Reports the memory still allocated per queued event and the peak
+allocated while tracking them.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from eventbridge.analytics.client import Client
+
+
+def measure(strict, number):
+    client = Client(source_id='benchmark', event_bus_name='benchmark',
+                    region_name='us-east-1', max_queue_size=number + 1,
+                    strict=strict)
+    client.pool.join()
+    # warm up caches, eg. the serializer's, outside the measurement
+    client.track('user', 'Order Completed', {'revenue': 27.5})
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(number):
+        client.track('user-%d' % i, 'Order Completed',
+                     {'revenue': 27.5, 'currency': 'USD'})
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / float(number), (peak - before) / float(number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help='events to track')
+    options = parser.parse_args()
+
+    print('%-8s %16s %16s' % ('mode', 'retained B/event', 'peak B/event'))
+    for strict in (True, False):
+        retained, peak = measure(strict, options.number)
+        print('%-8s %16.0f %16.0f' % ('strict' if strict else 'fast',
+                                      retained, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Run several clients against one fake EventBridge with a PutEvents quota.
+
+    python -m benchmarks.quota [--clients N] [--quota CALLS] [options]
+
+Every client tracks events as fast as it can for `--duration` seconds,
+with and without adaptive concurrency. Reports the calls accepted and
+throttled per second; with adaptive concurrency the clients should settle
+just under the quota instead of spending calls on throttled requests.
+"""
+import argparse
+import threading
+import time
+
+from eventbridge.analytics.client import Client
+
+from benchmarks.fake import FakeEventBridge, install
+
+
+def run(options, adaptive):
+    fake = FakeEventBridge(latency=options.latency, jitter=options.latency / 3,
+                           quota=options.quota, seed=1)
+    clients = []
+    for _ in range(options.clients):
+        client = Client(source_id='benchmark', event_bus_name='benchmark',
+                        region_name='us-east-1', thread=options.thread,
+                        max_in_flight=options.max_in_flight,
+                        upload_interval=0.01, backpressure='block',
+                        adaptive_concurrency=adaptive)
+        install(client, fake)
+        clients.append(client)
+
+    stop = threading.Event()
+
+    def produce(client):
+        while not stop.is_set():
+            client.track('user', 'Order Completed', {'revenue': 27.5})
+
+    producers = [threading.Thread(target=produce, args=(client,))
+                 for client in clients]
+    for producer in producers:
+        producer.daemon = True
+        producer.start()
+    # let the clients settle before measuring
+    time.sleep(options.warmup)
+    calls, throttled = fake.calls, fake.throttled
+    time.sleep(options.duration)
+    calls, throttled = fake.calls - calls, fake.throttled - throttled
+    stop.set()
+    for client in clients:
+        client.queue.queue.clear()
+        client.pool.join()
+    accepted = calls - throttled
+    return accepted / options.duration, throttled / options.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--thread', type=int, default=2,
+                        help='consumer threads per client')
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--quota', type=int, default=200,
+                        help='PutEvents calls per second')
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    options = parser.parse_args()
+
+    print('%-10s %14s %14s' % ('mode', 'accepted/sec', 'throttled/sec'))
+    for adaptive in (False, True):
+        accepted, throttled = run(options, adaptive)
+        print('%-10s %14.0f %14.0f' % ('adaptive' if adaptive else 'fixed',
+                                       accepted, throttled))
+
+
+if __name__ == '__main__':
+    main()
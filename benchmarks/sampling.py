@@ -0,0 +1,41 @@
+"""Compare the cost of tracking an event that the sampling rules drop with
+one that is kept.
+
+    python -m benchmarks.sampling [-n NUMBER]
+
+The consumers are stopped so that only the calling thread is measured.
+"""
+import argparse
+import time
+
+from eventbridge.analytics.client import Client
+
+
+def measure(event, number):
+    client = Client(source_id='benchmark', event_bus_name='benchmark',
+                    region_name='us-east-1', max_queue_size=number + 1,
+                    sampling_rules=[{'event': 'Page Scrolled', 'rate': 0.0}])
+    client.pool.join()
+    properties = {'revenue': 27.5, 'currency': 'USD'}
+    start = time.perf_counter()
+    for i in range(number):
+        client.track('user-%d' % i, event, properties)
+    elapsed = time.perf_counter() - start
+    client.queue.queue.clear()
+    return elapsed / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=50000,
+                        help='events to track')
+    options = parser.parse_args()
+
+    print('%-10s %12s' % ('event', 'us/track'))
+    for name, event in (('kept', 'Order Completed'),
+                        ('dropped', 'Page Scrolled')):
+        print('%-10s %12.2f' % (name, measure(event, options.number) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Compare the serializer backends on realistic message payloads.
+
+    python -m benchmarks.serializers [-n NUMBER]
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import uuid4
+import argparse
+import timeit
+
+from dateutil.tz import tzutc
+
+from eventbridge.analytics.serializers import available, get_serializer
+from eventbridge.analytics.utils import clean
+
+
+def track_payload():
+    now = datetime.utcnow().replace(tzinfo=tzutc())
+    return {
+        'integrations': {},
+        'anonymousId': None,
+        'properties': {
+            'orderId': str(uuid4()),
+            'total': Decimal('27.50'),
+            'currency': 'USD',
+            'placedAt': now,
+            'deliveryDate': date.today(),
+            'products': [
+                {'sku': 'sku-%d' % i, 'price': Decimal('5.50'),
+                 'quantity': i, 'addedAt': now}
+                for i in range(5)
+            ],
+        },
+        'timestamp': now.isoformat(timespec='milliseconds'),
+        'context': {
+            'ip': '192.168.0.1',
+            'library': {'name': 'eventbridge-analytics-python',
+                        'version': '2.2.5'},
+        },
+        'userId': 'user-1234',
+        'type': 'track',
+        'event': 'Order Completed',
+        'messageId': str(uuid4()),
+    }
+
+
+def identify_payload():
+    return {
+        'integrations': {},
+        'anonymousId': None,
+        'traits': {
+            'email': 'user@example.com',
+            'name': 'Example User',
+            'createdAt': datetime(2020, 1, 1, 12, 0, 0),
+            'birthdate': date(1981, 2, 2),
+            'plan': 'premium',
+            'logins': 42,
+        },
+        'timestamp': datetime.utcnow().isoformat(),
+        'context': {},
+        'type': 'identify',
+        'userId': 'user-1234',
+        'messageId': str(uuid4()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help='serializations per measurement')
+    options = parser.parse_args()
+
+    payloads = {'track': track_payload(), 'identify': identify_payload()}
+    print('%-10s %-10s %12s %12s' % ('backend', 'payload', 'us/op',
+                                     'clean+us/op'))
+    for name in available():
+        serializer = get_serializer(name)
+        for kind, payload in payloads.items():
+            direct = timeit.timeit(lambda: serializer.dumps(payload),
+                                   number=options.number)
+            cleaned = timeit.timeit(
+                lambda: serializer.dumps(clean(payload)),
+                number=options.number)
+            print('%-10s %-10s %12.2f %12.2f' % (
+                name, kind, direct / options.number * 1e6,
+                cleaned / options.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Share a PutEvents budget between processes with `SharedTokenBucket`.
+
+    python -m benchmarks.shared_rate [--rate CALLS] [--threads 1,1,4,8]
+
+Starts one process per entry of `--threads`, each taking tokens from the
+same bucket as fast as that many threads can for `--duration` seconds.
+Reports the tokens each process got: the total should be the rate times
+the duration plus one burst, split evenly however many threads each
+process runs.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from eventbridge.analytics.ratelimit import SharedTokenBucket
+
+
+def work(path, rate, threads, duration, results):
+    bucket = SharedTokenBucket(path, rate)
+    counts = [0] * threads
+
+    def take(i):
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            wait = bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            counts[i] += 1
+
+    workers = [threading.Thread(target=take, args=(i,))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((os.getpid(), threads, sum(counts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=100,
+                        help='tokens per second')
+    parser.add_argument('--threads', default='1,1,4,8',
+                        help='threads of each process')
+    parser.add_argument('--duration', type=float, default=3.0)
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'rate')
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=work, args=(
+                path, options.rate, int(threads), options.duration, results))
+            for threads in options.threads.split(',')]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(directory)
+
+    print('%-8s %8s %8s' % ('pid', 'threads', 'tokens'))
+    for pid, threads, tokens in sorted(rows, key=lambda row: row[1]):
+        print('%-8d %8d %8d' % (pid, threads, tokens))
+    print('%-8s %8s %8d (expected about %d)' % (
+        'total', '', sum(row[2] for row in rows),
+        options.rate * (options.duration + 1)))
+
+
+if __name__ == '__main__':
+    main()
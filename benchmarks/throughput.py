@@ -0,0 +1,123 @@
+"""Measure end-to-end throughput against a fake EventBridge.
+
+    python -m benchmarks.throughput [--scenario NAME] [-n NUMBER] [options]
+
+Tracks `NUMBER` events as fast as possible, flushes, and reports the
+delivered events per second, the `track()` latency on the calling thread,
+how full the uploaded batches were and the memory used.
+"""
+from datetime import date
+import argparse
+import resource
+import time
+
+from eventbridge.analytics.client import Client
+
+from benchmarks.fake import FakeEventBridge, install
+
+# name: (latency, jitter, throttle_rate, failure_rate)
+SCENARIOS = {
+    'ideal': (0.0, 0.0, 0.0, 0.0),
+    'aws': (0.03, 0.01, 0.0, 0.0),
+    'throttled': (0.03, 0.01, 0.1, 0.0),
+    'flaky': (0.03, 0.01, 0.0, 0.02),
+}
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+def run(options):
+    latency, jitter, throttle_rate, failure_rate = SCENARIOS[options.scenario]
+    fake = FakeEventBridge(
+        latency=options.latency if options.latency is not None else latency,
+        jitter=options.jitter if options.jitter is not None else jitter,
+        throttle_rate=(options.throttle_rate
+                       if options.throttle_rate is not None
+                       else throttle_rate),
+        failure_rate=(options.failure_rate
+                      if options.failure_rate is not None
+                      else failure_rate),
+        seed=1)
+    failed = []
+    client = Client(source_id='benchmark', event_bus_name='benchmark',
+                    region_name='us-east-1', access_key='benchmark',
+                    secret_access_key='benchmark',
+                    max_queue_size=options.number + 1,
+                    thread=options.thread, max_in_flight=options.max_in_flight,
+                    strict=not options.fast,
+                    on_error=lambda e, msgs: failed.extend(msgs))
+    install(client, fake)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    properties = {'revenue': 27.5, 'currency': 'USD',
+                  'deliveryDate': date.today()}
+    timer = time.perf_counter
+    samples = []
+    start = timer()
+    for i in range(options.number):
+        call = timer()
+        client.track('user-%d' % (i % 100), 'Order Completed', properties)
+        samples.append(timer() - call)
+    enqueued = timer()
+    client.flush()
+    elapsed = timer() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = client.pool.stats()
+    client.join()
+
+    samples.sort()
+    batches = [c for c in stats['consumers'] if c['batches']]
+    fill_ratio = sum(c['fill_ratio'] for c in batches) / max(len(batches), 1)
+    size_fill_ratio = sum(c['size_fill_ratio']
+                          for c in batches) / max(len(batches), 1)
+    return [
+        ('scenario', options.scenario),
+        ('events', options.number),
+        ('delivered', fake.delivered),
+        ('failed', len(failed)),
+        ('events/sec', '%.0f' % (fake.delivered / elapsed)),
+        ('enqueue time (s)', '%.3f' % (enqueued - start)),
+        ('total time (s)', '%.3f' % elapsed),
+        ('track p50 (us)', '%.2f' % (percentile(samples, 50) * 1e6)),
+        ('track p99 (us)', '%.2f' % (percentile(samples, 99) * 1e6)),
+        ('put_events calls', fake.calls),
+        ('throttled calls', fake.throttled),
+        ('rejected entries', fake.rejected),
+        ('batch fill ratio', '%.2f' % fill_ratio),
+        ('batch size fill ratio', '%.3f' % size_fill_ratio),
+        # ru_maxrss is in kilobytes on Linux
+        ('peak rss growth (MB)', '%.1f' % ((rss_after - rss_before) / 1024.0)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS),
+                        default='ideal',
+                        help='preset latency, throttling and failures')
+    parser.add_argument('-n', '--number', type=int, default=20000,
+                        help='events to track')
+    parser.add_argument('--thread', type=int, default=1,
+                        help='consumer threads')
+    parser.add_argument('--max-in-flight', type=int, default=1,
+                        help='concurrent uploads per consumer')
+    parser.add_argument('--fast', action='store_true',
+                        help='use the fast enqueue path (strict=False)')
+    parser.add_argument('--latency', type=float,
+                        help='seconds per PutEvents call')
+    parser.add_argument('--jitter', type=float,
+                        help='random +/- seconds added to the latency')
+    parser.add_argument('--throttle-rate', type=float,
+                        help='fraction of calls that are throttled')
+    parser.add_argument('--failure-rate', type=float,
+                        help='fraction of entries that are rejected')
+    options = parser.parse_args()
+
+    for name, value in run(options):
+        print('%-24s %s' % (name, value))
+
+
+if __name__ == '__main__':
+    main()
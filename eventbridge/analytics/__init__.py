@@ -1,6 +1,7 @@
 
 from eventbridge.analytics.version import VERSION
 from eventbridge.analytics.client import Client
+from eventbridge.analytics.async_client import AsyncClient
 
 __version__ = VERSION
 
@@ -13,10 +14,20 @@ send = Client.DefaultConfig.send
 sync_mode = Client.DefaultConfig.sync_mode
 max_queue_size = Client.DefaultConfig.max_queue_size
 max_retries = Client.DefaultConfig.max_retries
+max_retry_backlog = Client.DefaultConfig.max_retry_backlog
 access_key = Client.DefaultConfig.access_key
 secret_access_key = Client.DefaultConfig.secret_access_key
 region_name = Client.DefaultConfig.region_name
 session_token = Client.DefaultConfig.session_token
+serializer = Client.DefaultConfig.serializer
+backpressure = Client.DefaultConfig.backpressure
+block_timeout = Client.DefaultConfig.block_timeout
+strict = Client.DefaultConfig.strict
+sampling_rules = Client.DefaultConfig.sampling_rules
+adaptive_concurrency = Client.DefaultConfig.adaptive_concurrency
+shared_upload_rate = Client.DefaultConfig.shared_upload_rate
+shared_upload_rate_path = Client.DefaultConfig.shared_upload_rate_path
+agent_socket = Client.DefaultConfig.agent_socket
 
 default_client = None
 
@@ -76,11 +87,22 @@ def _proxy(method, *args, **kwargs):
                                 max_queue_size=max_queue_size,
                                 send=send, on_error=on_error,
                                 max_retries=max_retries,
+                                max_retry_backlog=max_retry_backlog,
                                 sync_mode=sync_mode,
                                 access_key=access_key,
                                 secret_access_key=secret_access_key,
                                 region_name=region_name,
-                                session_token=session_token)
+                                session_token=session_token,
+                                serializer=serializer,
+                                backpressure=backpressure,
+                                block_timeout=block_timeout,
+                                strict=strict,
+                                sampling_rules=sampling_rules,
+                                adaptive_concurrency=adaptive_concurrency,
+                                shared_upload_rate=shared_upload_rate,
+                                shared_upload_rate_path=(
+                                    shared_upload_rate_path),
+                                agent_socket=agent_socket)
 
     fn = getattr(default_client, method)
     return fn(*args, **kwargs)
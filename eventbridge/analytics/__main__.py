@@ -0,0 +1,26 @@
+"""Run the agent or a backfill.
+
+    python -m eventbridge.analytics agent --socket PATH ...
+    python -m eventbridge.analytics backfill FILE ...
+"""
+import sys
+
+from eventbridge.analytics import agent, backfill
+
+COMMANDS = {
+    'agent': agent.main,
+    'backfill': backfill.main,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write('usage: python -m eventbridge.analytics {%s} ...\n'
+                         % ','.join(sorted(COMMANDS)))
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
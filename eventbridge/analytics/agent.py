@@ -0,0 +1,292 @@
+"""Upload the messages of every process on a host from one agent.
+
+    python -m eventbridge.analytics agent --socket PATH \\
+        --sourceId SOURCE --eventBusName BUS [--thread 4]
+
+Producers are clients created with `agent_socket=PATH`. They write every
+message to the agent's Unix socket, already encoded, as the UTF-8 `Detail`
+prefixed with its length like the spool's records. The agent batches the
+messages of all of them and uploads them. A producer that can't reach the
+agent uploads its messages itself.
+
+A message is sent once: either it was written whole to the socket and is
+the agent's to upload, or the producer uploads it. The agent drops a frame
+cut short by a failed write. Messages written to an agent that then
+crashes before reading them are lost.
+"""
+from threading import Thread, Event, Lock
+import argparse
+import bisect
+import errno
+import logging
+import os
+import signal
+import socket
+
+import monotonic
+
+from eventbridge.analytics.request import EncodedMessage, MAX_REQUEST_SIZE
+from eventbridge.analytics.spool import HEADER
+
+log = logging.getLogger('eventbridge.analytics')
+
+# Longer frames can't be messages, the stream is out of step.
+MAX_FRAME_SIZE = 2 * MAX_REQUEST_SIZE
+
+
+class Agent(object):
+    """Accepts messages on the Unix socket at `path` and puts them on the
+    queue of `client`, which uploads them.
+
+    Every connection is read by its own thread. When the client's queue is
+    full its backpressure policy applies; with 'block', producers are held
+    up until their writes time out and they upload their messages
+    themselves. Received messages and broken frames are counted in the
+    client's metrics as 'agent_received' and 'agent_bad_frames'.
+    """
+
+    def __init__(self, path, client):
+        self.path = path
+        self.client = client
+        self.server = None
+        self.stopped = Event()
+        self.lock = Lock()
+        self.connections = {}
+        self.acceptor = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            if _listening(self.path):
+                raise RuntimeError('an agent is already listening on %s'
+                                   % self.path)
+            # left over by an agent that didn't exit cleanly
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(128)
+        self.acceptor = Thread(target=self._accept,
+                               name='eventbridge-analytics-agent')
+        self.acceptor.daemon = True
+        self.acceptor.start()
+        log.info('agent listening on %s', self.path)
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                # the server socket was closed by `stop`
+                break
+            reader = Thread(target=self._read, args=(conn,))
+            reader.daemon = True
+            with self.lock:
+                self.connections[conn] = reader
+            reader.start()
+
+    def _read(self, conn):
+        client = self.client
+        metrics = client.metrics
+        try:
+            f = conn.makefile('rb')
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, = HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    log.error('dropping connection, frame of %d bytes',
+                              length)
+                    metrics.incr('agent_bad_frames')
+                    break
+                data = f.read(length)
+                if len(data) < length:
+                    # the producer gave up in the middle of a write
+                    metrics.incr('agent_bad_frames')
+                    break
+                try:
+                    item = EncodedMessage(None, data.decode('utf-8'))
+                except UnicodeDecodeError:
+                    metrics.incr('agent_bad_frames')
+                    continue
+                metrics.incr('agent_received')
+                client.backpressure.put(client.queue, item)
+        except OSError as e:
+            log.debug('agent connection closed: %s', e)
+        finally:
+            conn.close()
+            with self.lock:
+                self.connections.pop(conn, None)
+
+    def stop(self):
+        """Stop accepting messages, and wait for the connections to be
+        read to their end."""
+        self.stopped.set()
+        if self.acceptor is not None:
+            # closing the server socket doesn't wake up `accept`
+            _listening(self.path)
+            self.acceptor.join()
+            self.acceptor = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            os.unlink(self.path)
+        with self.lock:
+            connections = dict(self.connections)
+        for conn, reader in connections.items():
+            try:
+                conn.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+            reader.join()
+
+
+class AgentTransport(object):
+    """Writes encoded messages to the agent listening at `path`.
+
+    Writes that can't be completed within `timeout` seconds fail, and the
+    connection is dropped. After a failure no connection is attempted for
+    `retry_interval` seconds, so callers can fall back on uploading
+    messages themselves without paying for a connection attempt each time.
+    The connection is made again in the child of a fork.
+    """
+
+    def __init__(self, path, timeout=1.0, retry_interval=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.lock = Lock()
+        self.sock = None
+        self.pid = os.getpid()
+        self.failed_at = None
+
+    def send(self, items):
+        """Write the `EncodedMessage`s `items` in order, return how many of
+        them were written whole; the others are for the caller to upload."""
+        frames = []
+        ends = []
+        size = 0
+        for item in items:
+            data = item.detail.encode('utf-8')
+            frames.append(HEADER.pack(len(data)))
+            frames.append(data)
+            size += HEADER.size + len(data)
+            ends.append(size)
+        data = memoryview(b''.join(frames))
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.lock = Lock()
+            # the parent's connection, this process' copy of it is closed
+            # and the parent's stays open
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+        with self.lock:
+            if self.sock is None and not self._connect():
+                return 0
+            written = 0
+            try:
+                while written < size:
+                    written += self.sock.send(data[written:])
+                return len(items)
+            except OSError as e:
+                log.warning('lost the connection to the agent: %s', e)
+                self._fail()
+                return bisect.bisect_right(ends, written)
+
+    def _connect(self):
+        if self.failed_at is not None and \
+                monotonic.monotonic() - self.failed_at < self.retry_interval:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            log.warning('the agent is unavailable: %s', e)
+            sock.close()
+            self.failed_at = monotonic.monotonic()
+            return False
+        self.sock = sock
+        self.failed_at = None
+        return True
+
+    def _fail(self):
+        self.sock.close()
+        self.sock = None
+        self.failed_at = monotonic.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+
+def _listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError as e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return False
+        raise
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', required=True,
+                        help='the path of the Unix socket to listen on')
+    parser.add_argument('--sourceId', required=True,
+                        help='the source identifier')
+    parser.add_argument('--eventBusName', required=True,
+                        help='the event bus name')
+    parser.add_argument('--thread', type=int, default=1,
+                        help='the number of consumer threads')
+    parser.add_argument('--maxInFlight', type=int, default=1,
+                        help='the uploads each consumer runs at once')
+    parser.add_argument('--maxQueueSize', type=int, default=10000,
+                        help='the messages to hold before blocking producers')
+    parser.add_argument('--awsAccessKeyId',
+                        help='the aws access key id')
+    parser.add_argument('--awsSecretAccessKey',
+                        help='the aws secret key')
+    parser.add_argument('--awsSessionToken',
+                        help='the aws session token')
+    parser.add_argument('--awsRegionName',
+                        help='the aws region name')
+    parser.add_argument('--debug', action='store_true',
+                        help='log every request')
+    options = parser.parse_args(argv)
+
+    # the client imports this module for `AgentTransport`
+    from eventbridge.analytics.client import Client
+
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.DEBUG if options.debug else logging.INFO)
+
+    client = Client(options.sourceId, options.eventBusName,
+                    debug=options.debug, thread=options.thread,
+                    max_in_flight=options.maxInFlight,
+                    max_queue_size=options.maxQueueSize,
+                    backpressure='block',
+                    region_name=options.awsRegionName,
+                    access_key=options.awsAccessKeyId,
+                    secret_access_key=options.awsSecretAccessKey,
+                    session_token=options.awsSessionToken)
+    agent = Agent(options.socket, client)
+    stopping = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    agent.start()
+    while not stopping.wait(1):
+        pass
+    log.info('agent stopping')
+    agent.stop()
+    client.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+
+from eventbridge.analytics.client import Client
+from eventbridge.analytics.consumer import (
+    request, BATCH_SIZE_LIMIT, MAX_BATCH_COUNT)
+from eventbridge.analytics.metrics import LATENCY_BUCKETS
+from eventbridge.analytics.request import PartialFailureError
+
+
+class AsyncClient(Client):
+    """A client for asyncio applications.
+
+    `track`, `identify`, `group`, `alias`, `page` and `screen` never block:
+    messages are put on an `asyncio.Queue` and a task on the event loop
+    batches them. Uploads run in a thread pool around the boto client, with
+    up to `max_in_flight` batches at a time, so the loop is never blocked on
+    the network. Use `await client.flush()` to wait for the queue to drain
+    and `await client.aclose()` (or `async with`) to shut down.
+    """
+    log = logging.getLogger('eventbridge.analytics')
+
+    def __init__(self,
+                 source_id=Client.DefaultConfig.source_id,
+                 event_bus_name=Client.DefaultConfig.event_bus_name,
+                 debug=Client.DefaultConfig.debug,
+                 max_queue_size=Client.DefaultConfig.max_queue_size,
+                 send=Client.DefaultConfig.send,
+                 on_error=Client.DefaultConfig.on_error,
+                 max_retries=Client.DefaultConfig.max_retries,
+                 upload_size=Client.DefaultConfig.upload_size,
+                 upload_interval=Client.DefaultConfig.upload_interval,
+                 max_in_flight=4,
+                 region_name=Client.DefaultConfig.region_name,
+                 access_key=Client.DefaultConfig.access_key,
+                 secret_access_key=Client.DefaultConfig.secret_access_key,
+                 session_token=Client.DefaultConfig.session_token,
+                 serializer=Client.DefaultConfig.serializer,
+                 log_sample_rate=Client.DefaultConfig.log_sample_rate,
+                 log_max_length=Client.DefaultConfig.log_max_length,
+                 connect_timeout=Client.DefaultConfig.connect_timeout,
+                 read_timeout=Client.DefaultConfig.read_timeout,
+                 tcp_keepalive=Client.DefaultConfig.tcp_keepalive):
+        self._setup(source_id, event_bus_name, on_error=on_error,
+                    debug=debug, send=send, serializer=serializer,
+                    region_name=region_name, access_key=access_key,
+                    secret_access_key=secret_access_key,
+                    session_token=session_token,
+                    log_sample_rate=log_sample_rate,
+                    log_max_length=log_max_length,
+                    max_pool_connections=max(10, max_in_flight),
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout, tcp_keepalive=tcp_keepalive)
+
+        self.queue = asyncio.Queue(max_queue_size)
+        self.upload_size = min(upload_size, MAX_BATCH_COUNT)
+        self.upload_interval = upload_interval
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.metrics.histogram('put_events_latency', LATENCY_BUCKETS)
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_in_flight,
+            thread_name_prefix='eventbridge-analytics-upload')
+        self.in_flight = None
+        self.uploads = set()
+        self.worker = None
+        self.carry = None
+
+    def _enqueue(self, msg):
+        """Push a new `msg` onto the queue, return `(success, msg)`"""
+        encoded = self._prepare(msg)
+        msg = encoded.msg
+        encoded.release()
+
+        # if send is False, return msg as if it was successfully queued
+        if not self.send:
+            return True, msg
+
+        try:
+            self.queue.put_nowait(encoded)
+        except asyncio.QueueFull:
+            self.metrics.incr('dropped_newest')
+            self.log.warning('analytics-python queue is full')
+            return False, msg
+        self.metrics.incr('enqueued')
+
+        self.log.debug('enqueued %s.', msg['type'])
+        self._start()
+        return True, msg
+
+    def _put_many(self, items):
+        kept = []
+        for item in items:
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self.metrics.incr('dropped_newest')
+                kept.append(False)
+            else:
+                self.metrics.incr('enqueued')
+                kept.append(True)
+        if any(kept):
+            self._start()
+        return kept
+
+    def _start(self):
+        """Start the batching task if it isn't running."""
+        if self.worker is None or self.worker.done():
+            loop = asyncio.get_running_loop()
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+            self.worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = await self._next()
+            await self.in_flight.acquire()
+            upload = asyncio.get_running_loop().create_task(self._upload(batch))
+            self.uploads.add(upload)
+            upload.add_done_callback(self.uploads.discard)
+
+    async def _next(self):
+        """Wait for the next batch of items to upload."""
+        queue = self.queue
+        if self.carry is not None:
+            items, self.carry = [self.carry], None
+        else:
+            items = [await queue.get()]
+        total_size = self.event_bridge.entry_size(items[0])
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.upload_interval
+        while len(items) < self.upload_size:
+            timeout = deadline - loop.time()
+            try:
+                if timeout > 0:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                else:
+                    item = queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            size = self.event_bridge.entry_size(item)
+            if total_size + size > BATCH_SIZE_LIMIT:
+                # send it with the next batch
+                self.carry = item
+                break
+            items.append(item)
+            total_size += size
+
+        return items
+
+    async def _upload(self, batch):
+        loop = asyncio.get_running_loop()
+        failed = batch
+        try:
+            await loop.run_in_executor(self.executor, request,
+                                       self.event_bridge, batch,
+                                       self.max_retries, self.metrics)
+            failed = []
+        except Exception as e:
+            self.log.error('error uploading: %s', e)
+            if isinstance(e, PartialFailureError):
+                failed = e.entries
+            if self.on_error:
+                self.on_error(e, [item.msg for item in failed])
+        finally:
+            self.metrics.incr('batches_sent')
+            self.metrics.incr('entries_delivered', len(batch) - len(failed))
+            self.metrics.incr('entries_failed', len(failed))
+            self.in_flight.release()
+            for _ in batch:
+                self.queue.task_done()
+
+    async def flush(self):
+        """Wait until every queued message has been uploaded."""
+        size = self.queue.qsize()
+        await self.queue.join()
+        self.log.debug('successfully flushed about %s items.', size)
+
+    async def join(self):
+        """Stop the batching task and wait for the uploads in flight."""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        if self.uploads:
+            await asyncio.gather(*self.uploads, return_exceptions=True)
+
+    async def aclose(self):
+        """Flush all messages and cleanly shutdown the client"""
+        await self.flush()
+        await self.join()
+        self.executor.shutdown(wait=False)
+
+    shutdown = aclose
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
@@ -0,0 +1,291 @@
+"""Replay a JSONL file of events through the client.
+
+    python -m eventbridge.analytics.backfill events.jsonl.gz \\
+        --sourceId SOURCE --eventBusName BUS [--rate 500] [--thread 4] \\
+        [--checkpoint events.checkpoint] [--failed events.failed.jsonl]
+
+Every line of the file, which may be gzipped, is a message like the ones
+`track()`, `identify()`, etc. build, eg. `{"type": "track", "userId": "id",
+"event": "Signed Up", "timestamp": "2023-01-01T00:00:00Z"}`.
+
+Events that still fail to upload once retries are exhausted are appended to
+the `--failed` file (by default the checkpoint's path with '.failed.jsonl'
+added), in the same format, so they can be backfilled again.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+from threading import Lock
+import time
+
+from dateutil.parser import parse as parse_date
+import monotonic
+
+from eventbridge.analytics.client import Client, ENQUEUE_CHUNK_SIZE
+from eventbridge.analytics.serializers import default
+from eventbridge.analytics.utils import TokenBucket
+
+log = logging.getLogger('eventbridge.analytics')
+
+
+def open_events(path):
+    """Open the events file at `path` for reading bytes, decompressing it
+    if its name ends with '.gz'."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_lines(f, offset=0):
+    """Yield every line of `f` from `offset` on, with the offset it ends
+    at. Offsets count uncompressed bytes."""
+    f.seek(offset)
+    for line in f:
+        offset += len(line)
+        yield offset, line
+
+
+def parse_messages(lines, counts):
+    """Yield `(offset, msg)` for every line of `lines`, with `msg` None for
+    blank and invalid lines, which are counted in `counts`."""
+    for offset, line in lines:
+        line = line.strip()
+        if not line:
+            yield offset, None
+            continue
+        try:
+            msg = json.loads(line.decode('utf-8'))
+            if not isinstance(msg, dict):
+                raise ValueError('not an object')
+            if isinstance(msg.get('timestamp'), str):
+                msg['timestamp'] = parse_date(msg['timestamp'])
+        except ValueError as e:
+            log.error('invalid line ending at offset %d: %s', offset, e)
+            counts['invalid'] += 1
+            yield offset, None
+            continue
+        counts['read'] += 1
+        yield offset, msg
+
+
+def chunk_messages(messages, size):
+    """Yield `(offset, msgs)` lists of up to `size` messages, with the
+    offset of the line the last one was read from."""
+    chunk = []
+    offset = None
+    for offset, msg in messages:
+        if msg is not None:
+            chunk.append(msg)
+        if len(chunk) >= size:
+            yield offset, chunk
+            chunk = []
+    if offset is not None:
+        yield offset, chunk
+
+
+class Checkpoint(object):
+    """Persists how far into an events file a backfill has got.
+
+    The offset is only saved once everything before it has been flushed,
+    that is delivered or given up on, so a resumed backfill may send some
+    events again. Events given up on are not sent again by a resumed
+    backfill; see `FailedEvents` for replaying them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, events_path):
+        """Return the offset to resume `events_path` from."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, OSError):
+            return 0
+        if state['file'] != os.path.abspath(events_path):
+            raise ValueError('checkpoint %s is for %s' % (self.path,
+                                                          state['file']))
+        return state['offset']
+
+    def save(self, events_path, offset):
+        path = self.path + '.tmp'
+        with open(path, 'w') as f:
+            json.dump({'file': os.path.abspath(events_path),
+                       'offset': offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, self.path)
+
+
+class FailedEvents(object):
+    """Appends the events that failed to upload to the file at `path`, one
+    JSON message per line, so they can be backfilled again.
+
+    Pass it as the client's `on_error`; `count` is the number of events
+    written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.count = 0
+
+    def __call__(self, error, msgs):
+        lines = [json.dumps(msg, default=default) + '\n' for msg in msgs]
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+            self.count += len(lines)
+
+
+class Backfill(object):
+    """Streams the events in `path` through `client` with `enqueue_many`.
+
+    Sending is paced to `rate` events per second, if given, in chunks of
+    at most `rate` events. With a `checkpoint`, the client is flushed and
+    the offset saved every `checkpoint_interval` events, and a backfill
+    that was interrupted resumes where the last checkpoint left off.
+    """
+
+    def __init__(self, client, path, rate=None, checkpoint=None,
+                 checkpoint_interval=10000, chunk_size=ENQUEUE_CHUNK_SIZE):
+        self.client = client
+        self.path = path
+        self.bucket = TokenBucket(rate) if rate else None
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        if rate:
+            # no more than a second's worth at once, so that sending is
+            # paced rather than bursty
+            chunk_size = min(chunk_size, max(1, int(rate)))
+        self.chunk_size = chunk_size
+        self.sleep = time.sleep
+
+    def run(self):
+        """Send every event, flush the client and return a report of the
+        counts and throughput, see `format_report`."""
+        counts = dict.fromkeys(('read', 'invalid', 'enqueued', 'dropped'), 0)
+        start_offset = 0
+        if self.checkpoint is not None:
+            start_offset = self.checkpoint.load(self.path)
+            if start_offset:
+                log.info('resuming %s from offset %d', self.path,
+                         start_offset)
+        stats = self.client.stats()['counters']
+        start = monotonic.monotonic()
+
+        offset = start_offset
+        unsaved = 0
+        with open_events(self.path) as f:
+            messages = parse_messages(read_lines(f, start_offset), counts)
+            for offset, chunk in chunk_messages(messages, self.chunk_size):
+                if self.bucket is not None and chunk:
+                    self.sleep(self.bucket.reserve(len(chunk)))
+                for success, _ in self.client.enqueue_many(chunk):
+                    counts['enqueued' if success else 'dropped'] += 1
+                unsaved += len(chunk)
+                if (self.checkpoint is not None and
+                        unsaved >= self.checkpoint_interval):
+                    self._save(offset)
+                    unsaved = 0
+        self._save(offset)
+
+        elapsed = monotonic.monotonic() - start
+        delivered = self.client.stats()['counters']
+        for name in ('entries_delivered', 'entries_failed'):
+            counts[name[len('entries_'):]] = (
+                delivered.get(name, 0) - stats.get(name, 0))
+        counts.update(start_offset=start_offset, offset=offset,
+                      elapsed=elapsed,
+                      rate=counts['enqueued'] / max(elapsed, 0.001))
+        return counts
+
+    def _save(self, offset):
+        self.client.flush()
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.path, offset)
+
+
+def format_report(report):
+    return '\n'.join([
+        'offsets    %d-%d' % (report['start_offset'], report['offset']),
+        'read       %d' % report['read'],
+        'invalid    %d' % report['invalid'],
+        'enqueued   %d' % report['enqueued'],
+        'dropped    %d' % report['dropped'],
+        'delivered  %d' % report['delivered'],
+        'failed     %d' % report['failed'],
+        'elapsed    %.1fs' % report['elapsed'],
+        'throughput %.0f events/sec' % report['rate'],
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', help='the JSONL events file, may be gzipped')
+    parser.add_argument('--sourceId', required=True,
+                        help='the source identifier')
+    parser.add_argument('--eventBusName', required=True,
+                        help='the event bus name')
+    parser.add_argument('--rate', type=float,
+                        help='the most events to send per second')
+    parser.add_argument('--thread', type=int, default=1,
+                        help='the number of consumer threads')
+    parser.add_argument('--maxInFlight', type=int, default=1,
+                        help='the uploads each consumer runs at once')
+    parser.add_argument('--checkpoint',
+                        help='the file to save the offset to, for resuming')
+    parser.add_argument('--checkpointInterval', type=int, default=10000,
+                        help='the events to send between checkpoints')
+    parser.add_argument('--failed',
+                        help='the file to write events that failed to')
+    parser.add_argument('--awsAccessKeyId',
+                        help='the aws access key id')
+    parser.add_argument('--awsSecretAccessKey',
+                        help='the aws secret key')
+    parser.add_argument('--awsSessionToken',
+                        help='the aws session token')
+    parser.add_argument('--awsRegionName',
+                        help='the aws region name')
+    parser.add_argument('--debug', action='store_true',
+                        help='log every request')
+    options = parser.parse_args(argv)
+
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.DEBUG if options.debug else logging.INFO)
+
+    failed_path = options.failed
+    if failed_path is None and options.checkpoint:
+        failed_path = options.checkpoint + '.failed.jsonl'
+    failed = FailedEvents(failed_path) if failed_path else None
+
+    # Block rather than drop events when the consumers fall behind.
+    client = Client(options.sourceId, options.eventBusName,
+                    debug=options.debug, thread=options.thread,
+                    on_error=failed,
+                    max_in_flight=options.maxInFlight,
+                    backpressure='block',
+                    region_name=options.awsRegionName,
+                    access_key=options.awsAccessKeyId,
+                    secret_access_key=options.awsSecretAccessKey,
+                    session_token=options.awsSessionToken)
+    checkpoint = None
+    if options.checkpoint:
+        checkpoint = Checkpoint(options.checkpoint)
+    backfill = Backfill(client, options.file, rate=options.rate,
+                        checkpoint=checkpoint,
+                        checkpoint_interval=options.checkpointInterval)
+    try:
+        report = backfill.run()
+    finally:
+        client.join()
+    print(format_report(report))
+    if failed is not None and failed.count:
+        print('%d failed events written to %s' % (failed.count,
+                                                  failed.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import random
+import queue
+
+from eventbridge.analytics.metrics import Metrics
+from eventbridge.analytics.request import EncodedMessage, kind
+
+POLICIES = ('drop_newest', 'drop_oldest', 'block', 'sample', 'spill')
+
+# The outcomes counted for every message.
+OUTCOMES = ('enqueued', 'dropped_newest', 'dropped_oldest', 'blocked',
+            'timed_out', 'sampled_out', 'spilled', 'spill_failed')
+
+# Message types that the 'sample' policy always keeps by default.
+HIGH_VALUE_TYPES = {'identify': 1.0, 'alias': 1.0, 'group': 1.0}
+
+
+class Backpressure(object):
+    """Decides what happens to a message when the queue is full.
+
+    - 'drop_newest' drops the new message.
+    - 'drop_oldest' drops the oldest queued message to make room.
+    - 'block' waits up to `timeout` seconds for room (forever if None),
+      then drops the new message.
+    - 'sample' keeps the new message with the probability given for its
+      type, or for a track event's name, in `sample_rates` (identify, alias
+      and group are always kept by default), making room by dropping the
+      oldest queued message; otherwise it is dropped.
+    - 'spill' writes the new message to `spool`.
+
+    'drop_oldest' and 'sample' never drop a queued message that 'sample'
+    always keeps; if only such messages are queued, the new one is dropped.
+
+    Every outcome is counted in `metrics`, see `stats()`.
+    """
+    def __init__(self, policy='drop_newest', timeout=None, sample_rates=None,
+                 spool=None, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of %s' % (POLICIES,))
+        if policy == 'spill' and spool is None:
+            raise ValueError("the 'spill' policy needs a spool")
+        self.policy = policy
+        self.timeout = timeout
+        self.sample_rates = dict(HIGH_VALUE_TYPES)
+        self.sample_rates.update(sample_rates or {})
+        self.spool = spool
+        self.metrics = metrics or Metrics()
+
+    def _count(self, name):
+        self.metrics.incr(name)
+
+    def stats(self):
+        """Return how many messages met each outcome."""
+        return dict((name, self.metrics.counter(name)) for name in OUTCOMES)
+
+    def put(self, q, item, prepare=None):
+        """Put `item` on `q`, return whether it was kept.
+
+        The policies look at the `EncodedMessage` of `item`, which is
+        `prepare(item)` if `prepare` is given and `item` itself otherwise.
+        """
+        try:
+            q.put(item, block=False)
+            self._count('enqueued')
+            return True
+        except queue.Full:
+            pass
+
+        if prepare is not None:
+            item = prepare(item)
+
+        policy = self.policy
+        if policy == 'block':
+            self._count('blocked')
+            try:
+                q.put(item, block=True, timeout=self.timeout)
+                self._count('enqueued')
+                return True
+            except queue.Full:
+                self._count('timed_out')
+                return False
+
+        if policy == 'spill':
+            if self.spool.append(item):
+                self._count('spilled')
+                return True
+            self._count('spill_failed')
+            return False
+
+        if policy == 'sample':
+            if random.random() >= self._rate(*item.kind):
+                self._count('sampled_out')
+                return False
+            return self._replace_oldest(q, item)
+
+        if policy == 'drop_oldest':
+            return self._replace_oldest(q, item)
+
+        self._count('dropped_newest')
+        return False
+
+    def put_many(self, q, items, prepare=None):
+        """Put `items` on `q`, return whether each was kept.
+
+        As many items as there is room for are put under a single
+        acquisition of the queue's lock, the rest go through `put` one by
+        one.
+        """
+        with q.not_full:
+            room = len(items)
+            if q.maxsize > 0:
+                room = min(room, max(0, q.maxsize - q._qsize()))
+            for item in items[:room]:
+                q._put(item)
+            if room:
+                q.unfinished_tasks += room
+                q.not_empty.notify(room)
+        if room:
+            self.metrics.incr('enqueued', room)
+        return [True] * room + [self.put(q, item, prepare)
+                                for item in items[room:]]
+
+    def rate(self, msg):
+        """Return the probability of keeping `msg` under the 'sample'
+        policy."""
+        return self._rate(*kind(msg))
+
+    def _rate(self, type, event):
+        rates = self.sample_rates
+        if event is not None and event in rates:
+            return rates[event]
+        return rates.get(type, 0.0)
+
+    def _replace_oldest(self, q, item):
+        # Other threads may take the room we make, so give up after a few
+        # attempts rather than spinning.
+        for _ in range(3):
+            if not self._drop_oldest(q) and q.full():
+                # only high-value messages are queued, keep them
+                break
+            try:
+                q.put(item, block=False)
+                self._count('enqueued')
+                return True
+            except queue.Full:
+                continue
+        self._count('dropped_newest')
+        return False
+
+    def _drop_oldest(self, q):
+        """Drop the oldest queued message that isn't always kept (see
+        `rate`), return whether one was dropped."""
+        with q.mutex:
+            for i, queued in enumerate(q.queue):
+                # the type of an encoded message is kept on it, so the
+                # queue isn't decoded while its lock is held
+                if isinstance(queued, EncodedMessage):
+                    rate = self._rate(*queued.kind)
+                else:
+                    rate = self.rate(queued)
+                if rate < 1:
+                    del q.queue[i]
+                    break
+            else:
+                return False
+            # as `q.get()` and `q.task_done()` would
+            q.unfinished_tasks -= 1
+            if q.unfinished_tasks == 0:
+                q.all_tasks_done.notify_all()
+            q.not_full.notify()
+        self._count('dropped_oldest')
+        return True
@@ -1,21 +1,62 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from types import MappingProxyType
 from uuid import uuid4
 import logging
 import numbers
 import atexit
-import json
-
-from dateutil.tz import tzutc
-
-from eventbridge.analytics.utils import guess_timezone, clean
+import os
+import tempfile
+import time
+import weakref
+from threading import Lock
+
+from eventbridge.analytics.utils import guess_timezone, clean, PayloadLog
+from eventbridge.analytics.agent import AgentTransport
+from eventbridge.analytics.backpressure import Backpressure
+from eventbridge.analytics.concurrency import AdaptiveConcurrency
 from eventbridge.analytics.consumer import Consumer, MAX_MSG_SIZE
-from eventbridge.analytics.request import EventBridge, DatetimeSerializer
+from eventbridge.analytics.metrics import Metrics
+from eventbridge.analytics.pool import ConsumerPool
+from eventbridge.analytics.ratelimit import SharedTokenBucket
+from eventbridge.analytics.request import EventBridge, EncodedMessage
+from eventbridge.analytics.retry import RetryScheduler
+from eventbridge.analytics.sampling import Sampler
+from eventbridge.analytics.spool import Spool, SpoolFeeder
+from eventbridge.analytics.serializers import get_serializer
 from eventbridge.analytics.version import VERSION
 
 import queue
 
 ID_TYPES = (numbers.Number, str)
 
+# Added to the context of every message, as a copy since messages are
+# handed back to callers.
+LIBRARY = MappingProxyType({
+    'name': 'eventbridge-analytics-python',
+    'version': VERSION
+})
+
+# How many messages `enqueue_many` puts on the queue at a time.
+ENQUEUE_CHUNK_SIZE = 500
+
+# The dicts of a message that the fast path copies from the caller.
+MESSAGE_DICTS = ('properties', 'traits', 'context', 'integrations')
+
+# Raised by the validation of a message.
+INVALID_MESSAGE_ERRORS = (AssertionError, RuntimeError, TypeError, KeyError)
+
+# Every client, to restart them in the child after a fork.
+_clients = weakref.WeakSet()
+
+
+def _after_fork():
+    for client in list(_clients):
+        client._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
 
 class Client(object):
     class DefaultConfig(object):
@@ -27,13 +68,36 @@ class Client(object):
         sync_mode = False
         max_queue_size = 10000
         max_retries = 10
+        max_retry_backlog = 1000
         thread = 1
+        max_thread = None
         upload_interval = 0.5
-        upload_size = 100
+        upload_size = 10
+        max_upload_rate = None
+        max_in_flight = 1
+        adaptive_concurrency = False
+        shared_upload_rate = None
+        shared_upload_rate_path = None
         region_name = None
         access_key = None
         secret_access_key = None
         session_token = None
+        serializer = 'json'
+        spool_path = None
+        spool_max_bytes = 100 * 1024 * 1024
+        spool_fsync = 'interval'
+        backpressure = None
+        block_timeout = None
+        sample_rates = None
+        sampling_rules = None
+        strict = True
+        log_sample_rate = 1.0
+        log_max_length = None
+        max_pool_connections = None
+        connect_timeout = None
+        read_timeout = None
+        tcp_keepalive = True
+        agent_socket = None
 
     """Create a new Segment client."""
     log = logging.getLogger('eventbridge.analytics')
@@ -46,37 +110,129 @@ class Client(object):
                  send=DefaultConfig.send,
                  on_error=DefaultConfig.on_error,
                  max_retries=DefaultConfig.max_retries,
+                 max_retry_backlog=DefaultConfig.max_retry_backlog,
                  sync_mode=DefaultConfig.sync_mode,
                  thread=DefaultConfig.thread,
+                 max_thread=DefaultConfig.max_thread,
                  upload_size=DefaultConfig.upload_size,
                  upload_interval=DefaultConfig.upload_interval,
+                 max_in_flight=DefaultConfig.max_in_flight,
+                 max_upload_rate=DefaultConfig.max_upload_rate,
+                 adaptive_concurrency=DefaultConfig.adaptive_concurrency,
+                 shared_upload_rate=DefaultConfig.shared_upload_rate,
+                 shared_upload_rate_path=DefaultConfig.shared_upload_rate_path,
                  region_name=DefaultConfig.region_name,
                  access_key=DefaultConfig.access_key,
                  secret_access_key=DefaultConfig.secret_access_key,
-                 session_token=DefaultConfig.session_token):
-        require('source_id', source_id, str)
-        require('event_bus_name', event_bus_name, str)
+                 session_token=DefaultConfig.session_token,
+                 serializer=DefaultConfig.serializer,
+                 spool_path=DefaultConfig.spool_path,
+                 spool_max_bytes=DefaultConfig.spool_max_bytes,
+                 spool_fsync=DefaultConfig.spool_fsync,
+                 backpressure=DefaultConfig.backpressure,
+                 block_timeout=DefaultConfig.block_timeout,
+                 sample_rates=DefaultConfig.sample_rates,
+                 sampling_rules=DefaultConfig.sampling_rules,
+                 strict=DefaultConfig.strict,
+                 log_sample_rate=DefaultConfig.log_sample_rate,
+                 log_max_length=DefaultConfig.log_max_length,
+                 max_pool_connections=DefaultConfig.max_pool_connections,
+                 connect_timeout=DefaultConfig.connect_timeout,
+                 read_timeout=DefaultConfig.read_timeout,
+                 tcp_keepalive=DefaultConfig.tcp_keepalive,
+                 agent_socket=DefaultConfig.agent_socket):
+        if max_pool_connections is None:
+            # enough connections for every upload that can be in flight
+            max_pool_connections = max(
+                10, (max_thread or thread) * max_in_flight)
+        self._setup(source_id, event_bus_name, on_error=on_error,
+                    debug=debug, send=send, serializer=serializer,
+                    region_name=region_name, access_key=access_key,
+                    secret_access_key=secret_access_key,
+                    session_token=session_token,
+                    log_sample_rate=log_sample_rate,
+                    log_max_length=log_max_length,
+                    max_pool_connections=max_pool_connections,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout, tcp_keepalive=tcp_keepalive)
 
         self.queue = queue.Queue(max_queue_size)
-        self.on_error = on_error
-        self.debug = debug
-        self.send = send
         self.sync_mode = sync_mode
-
-        self.event_bridge = EventBridge(
-            source_id,
-            event_bus_name,
-            region_name=region_name,
-            access_key=access_key,
-            secret_access_key=secret_access_key,
-            session_token=session_token
-        )
-
-        if debug:
-            self.log.setLevel(logging.DEBUG)
+        # With strict=False messages are validated and encoded by the
+        # consumers instead of the calling thread. Only the message and its
+        # properties, traits, context and integrations are copied, so the
+        # values nested in those must not be changed once enqueued.
+        self.strict = strict
+
+        # Messages that don't fit in the queue are written to the spool, if
+        # there is one, and fed back to the consumers from there. Messages
+        # left on the spool are delivered after a restart.
+        self.spool = None
+        self.spool_feeder = None
+        if spool_path and not sync_mode:
+            self.spool = Spool(spool_path, max_bytes=spool_max_bytes,
+                               fsync=spool_fsync)
+            self.spool_feeder = SpoolFeeder(self.spool, self.queue)
+            self.metrics.gauge('spool_bytes', lambda: (
+                self.spool.size() if self.spool is not None else 0))
+
+        # Messages dropped by the sampling rules are never validated or
+        # encoded, see `Sampler`.
+        self.sampler = None
+        if sampling_rules:
+            self.sampler = Sampler(sampling_rules, metrics=self.metrics)
+
+        # What to do with messages when the queue is full; by default they
+        # are spilled to the spool if there is one, otherwise dropped.
+        if backpressure is None:
+            backpressure = 'spill' if self.spool is not None else 'drop_newest'
+        self.backpressure = Backpressure(backpressure, timeout=block_timeout,
+                                         sample_rates=sample_rates,
+                                         spool=self.spool,
+                                         metrics=self.metrics)
+
+        # Failed batches wait here for their next attempt instead of
+        # holding up a consumer; up to `max_retry_backlog` messages wait.
+        self.retry_scheduler = RetryScheduler(max_items=max_retry_backlog,
+                                              metrics=self.metrics)
+        self.metrics.gauge('retry_pending',
+                           lambda: self.retry_scheduler.stats()['items'])
+
+        # With adaptive_concurrency, uploads back off together when
+        # PutEvents throttles or slows down, and pick up again when it
+        # doesn't, see `AdaptiveConcurrency`.
+        self.concurrency = None
+        if adaptive_concurrency:
+            self.concurrency = AdaptiveConcurrency(
+                (max_thread or thread) * max_in_flight, metrics=self.metrics)
+            self.metrics.gauge('concurrency_limit',
+                               lambda: self.concurrency.stats()['limit'])
+            self.metrics.gauge('upload_rate',
+                               lambda: self.concurrency.stats()['rate'])
+
+        # With shared_upload_rate, the clients of every process on the host
+        # that use the same path share a budget of PutEvents calls per
+        # second; by default the path is per event bus.
+        self.rate_limiter = None
+        if shared_upload_rate:
+            if shared_upload_rate_path is None:
+                shared_upload_rate_path = os.path.join(
+                    tempfile.gettempdir(),
+                    'eventbridge-analytics-%s.rate' % event_bus_name)
+            self.rate_limiter = SharedTokenBucket(shared_upload_rate_path,
+                                                  shared_upload_rate)
+
+        # With agent_socket, messages are written to the agent listening
+        # there, which uploads the messages of every process on the host.
+        # If it can't be reached they are uploaded by this client's own
+        # consumers, which are only started then.
+        self.agent = None
+        if agent_socket and not sync_mode:
+            self.agent = AgentTransport(agent_socket)
+        self.pool_lock = Lock()
 
         if sync_mode:
-            self.consumers = None
+            self.pool = None
         else:
             # On program exit, allow the consumer thread to exit cleanly.
             # This prevents exceptions and a messy shutdown when the
@@ -86,19 +242,150 @@ class Client(object):
             # to call flush().
             if send:
                 atexit.register(self.join)
-            for _ in range(thread):
-                self.consumers = []
-                consumer = Consumer(
+
+            def consumer():
+                return Consumer(
                     self.queue,
                     event_bridge_client=self.event_bridge,
                     upload_size=upload_size, upload_interval=upload_interval,
-                    retries=max_retries, on_error=on_error
+                    retries=max_retries, on_error=on_error,
+                    max_in_flight=max_in_flight,
+                    max_upload_rate=max_upload_rate,
+                    prepare=self._complete,
+                    metrics=self.metrics,
+                    retry_scheduler=self.retry_scheduler,
+                    concurrency=self.concurrency,
+                    rate_limiter=self.rate_limiter
                 )
-                self.consumers.append(consumer)
 
-                # if we've disabled sending, just don't start the consumer
-                if send:
-                    consumer.start()
+            # `thread` consumers always run; with `max_thread` the pool adds
+            # more while the queue is backing up.
+            self.pool = ConsumerPool(self.queue, consumer,
+                                     min_workers=thread,
+                                     max_workers=max_thread)
+            self.metrics.gauge('workers', lambda: len(self.pool.workers()))
+
+            # if we've disabled sending, just don't start the consumers
+            if send:
+                if self.agent is None:
+                    self.pool.start()
+                    if self.spool_feeder is not None:
+                        self.spool_feeder.start()
+                elif self.spool is not None and not self.spool.empty():
+                    # the agent doesn't read the spool, what an earlier run
+                    # left on it is uploaded from this process
+                    self._start_pool('the spool holds undelivered messages')
+
+        _clients.add(self)
+
+    def _setup(self, source_id, event_bus_name, on_error, debug, send,
+               serializer, region_name, access_key, secret_access_key,
+               session_token, log_sample_rate, log_max_length,
+               max_pool_connections, connect_timeout, read_timeout,
+               tcp_keepalive):
+        """Set up what every client has, whatever its queue and uploads:
+        the EventBridge client, metrics and logging. Optional features are
+        left off, to be set up by the subclass."""
+        require('source_id', source_id, str)
+        require('event_bus_name', event_bus_name, str)
+
+        self.on_error = on_error
+        self.debug = debug
+        self.send = send
+        self.sync_mode = False
+        self.strict = True
+        self.serializer = get_serializer(serializer)
+        self.metrics = Metrics()
+        self.metrics.gauge('queue_depth', lambda: self.queue.qsize())
+        # With debug on, a `log_sample_rate` fraction of the messages and
+        # requests is logged, truncated to `log_max_length` characters.
+        self.payload_log = PayloadLog(self.log, log_sample_rate,
+                                      log_max_length)
+        self.event_bridge = EventBridge(
+            source_id,
+            event_bus_name,
+            region_name=region_name,
+            access_key=access_key,
+            secret_access_key=secret_access_key,
+            session_token=session_token,
+            payload_log=self.payload_log,
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=tcp_keepalive
+        )
+        if debug:
+            self.log.setLevel(logging.DEBUG)
+
+        self.pool = None
+        self.spool = self.spool_feeder = None
+        self.sampler = None
+        self.agent = None
+        self.retry_scheduler = None
+        self.concurrency = None
+        self.rate_limiter = None
+
+    def _after_fork(self):
+        """Give the child of a fork its own queue, consumers and
+        connections, since no thread survives the fork. Messages queued
+        before the fork are left to the parent to deliver."""
+        self.event_bridge.reset()
+        self.pool_lock = Lock()
+        if self.sampler is not None:
+            self.sampler.after_fork()
+        if self.pool is None:
+            return
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.metrics.reset()
+        self.retry_scheduler = RetryScheduler(
+            base_delay=self.retry_scheduler.base_delay,
+            max_delay=self.retry_scheduler.max_delay,
+            max_items=self.retry_scheduler.max_items,
+            metrics=self.metrics)
+        if self.concurrency is not None:
+            self.concurrency = AdaptiveConcurrency(
+                self.concurrency.max_limit, metrics=self.metrics)
+        if self.spool is not None:
+            # the spool files belong to the parent
+            self.log.warning('the spool is disabled in forked process %d',
+                             os.getpid())
+            self.spool = self.spool_feeder = None
+            self.backpressure.spool = None
+            if self.backpressure.policy == 'spill':
+                self.backpressure.policy = 'drop_newest'
+        pool = self.pool
+        self.pool = ConsumerPool(self.queue, pool.factory,
+                                 min_workers=pool.min_workers,
+                                 max_workers=pool.max_workers,
+                                 scale_interval=pool.scale_interval,
+                                 target_drain_time=pool.target_drain_time,
+                                 idle_ticks=pool.idle_ticks)
+        if pool.started:
+            self.pool.start()
+
+    def _start_pool(self, reason='the agent is unavailable'):
+        """Start the consumers, and the spool feeder, if they aren't
+        running yet, when falling back on uploading from this process."""
+        if self.agent is None or self.pool.started:
+            return
+        with self.pool_lock:
+            if not self.pool.started:
+                self.log.warning('%s, uploading from process %d', reason,
+                                 os.getpid())
+                self.pool.start()
+                if self.spool_feeder is not None:
+                    self.spool_feeder.start()
+
+    @property
+    def consumers(self):
+        """The consumer threads uploading from the queue."""
+        if self.pool is None:
+            return None
+        return self.pool.consumers
+
+    def stats(self):
+        """Return a snapshot of the client's metrics, see `Metrics`."""
+        return self.metrics.stats()
 
     def identify(self, user_id=None, traits=None, context=None, timestamp=None,
                  anonymous_id=None, integrations=None, message_id=None):
@@ -124,6 +411,14 @@ class Client(object):
     def track(self, user_id=None, event=None, properties=None, context=None,
               timestamp=None, anonymous_id=None, integrations=None,
               message_id=None):
+        return self._enqueue(self._track(
+            user_id, event, properties, context, timestamp, anonymous_id,
+            integrations, message_id))
+
+    def _track(self, user_id=None, event=None, properties=None, context=None,
+               timestamp=None, anonymous_id=None, integrations=None,
+               message_id=None):
+        """Validate the arguments of `track()`, return the message."""
         properties = properties or {}
         context = context or {}
         integrations = integrations or {}
@@ -143,7 +438,7 @@ class Client(object):
             'messageId': message_id,
         }
 
-        return self._enqueue(msg)
+        return msg
 
     def alias(self, previous_id=None, user_id=None, context=None,
               timestamp=None, integrations=None, message_id=None):
@@ -248,9 +543,159 @@ class Client(object):
 
     def _enqueue(self, msg):
         """Push a new `msg` onto the queue, return `(success, msg)`"""
+        if self.sampler is not None and not self.sampler.keep(msg):
+            return False, msg
+        item, msg = self._item(msg)
+
+        # if send is False, return msg as if it was successfully queued
+        if not self.send:
+            return True, msg
+
+        if self.sync_mode:
+            self.log.debug('enqueued with blocking %s.', msg['type'])
+            self.event_bridge.post(batch=[item])
+
+            return True, msg
+
+        if self.agent is not None and self.agent.send([item]):
+            self.metrics.incr('agent_sent')
+            self.log.debug('sent %s to the agent.', msg['type'])
+            return True, msg
+        self._start_pool()
+
+        if self.backpressure.put(self.queue, item, prepare=self._complete):
+            self.log.debug('enqueued %s.', msg['type'])
+            return True, msg
+        self.log.warning('analytics-python queue is full')
+        return False, msg
+
+    def _item(self, msg):
+        """Return the item to queue for `msg` and the completed `msg`."""
+        if self.strict or not self.send or self.sync_mode or \
+                self.agent is not None:
+            item = self._prepare(msg)
+            msg = item.msg
+            # only the encoded message is kept while it is queued
+            item.release()
+            return item, msg
+        # Fast path: only stamp the time, the consumer completes, validates
+        # and encodes the message (in place, unless it has to be cleaned).
+        # The caller keeps its own dicts, so copy the message and the dicts
+        # it holds; values nested deeper are still shared.
+        msg = dict(msg)
+        for key in MESSAGE_DICTS:
+            value = msg.get(key)
+            if isinstance(value, dict):
+                msg[key] = dict(value)
+        if msg['timestamp'] is None:
+            msg['timestamp'] = datetime.now(timezone.utc)
+        return msg, msg
+
+    def enqueue_many(self, messages):
+        """Enqueue pre-built messages in bulk, return a `(success, msg)`
+        for each, in order.
+
+        Each message is a dict like the ones `track()`, `identify()`, etc.
+        build, eg. `{'type': 'track', 'userId': 'id', 'event': 'Signed Up'}`;
+        missing optional fields are filled in place. Messages are validated
+        and encoded one by one, but put on the queue in chunks, taking the
+        queue's lock once per chunk. Invalid messages, and in `sync_mode`
+        messages that fail to upload, are logged and reported as
+        unsuccessful instead of raising.
+        """
+        return self._enqueue_many(messages, self._message)
+
+    def track_many(self, events):
+        """Track events in bulk, each a dict of `track()` arguments, eg.
+        `{'user_id': 'id', 'event': 'Signed Up'}`. See `enqueue_many`."""
+        return self._enqueue_many(events, lambda event: self._track(**event))
+
+    def _enqueue_many(self, items, build):
+        results = []
+        chunk = []
+        positions = []
+        for item in items:
+            try:
+                msg = build(item)
+                if self.sync_mode or not self.send:
+                    try:
+                        results.append(self._enqueue(msg))
+                    except INVALID_MESSAGE_ERRORS:
+                        raise
+                    except Exception as e:
+                        # in sync_mode, the upload failed
+                        self.log.error('error uploading: %s', e)
+                        results.append((False, msg))
+                    continue
+                if self.sampler is not None and not self.sampler.keep(msg):
+                    results.append((False, msg))
+                    continue
+                queued, msg = self._item(msg)
+            except INVALID_MESSAGE_ERRORS as e:
+                self.log.error('invalid message, not enqueued: %s', e)
+                results.append((False, item))
+                continue
+            positions.append(len(results))
+            results.append((True, msg))
+            chunk.append(queued)
+            if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+                self._put_chunk(chunk, positions, results)
+                chunk, positions = [], []
+        if chunk:
+            self._put_chunk(chunk, positions, results)
+        return results
+
+    def _put_chunk(self, chunk, positions, results):
+        kept = self._put_many(chunk)
+        for position, success in zip(positions, kept):
+            if not success:
+                results[position] = (False, results[position][1])
+        self.log.debug('enqueued %d of %d messages.', sum(kept), len(chunk))
+        if not all(kept):
+            self.log.warning('analytics-python queue is full')
+
+    def _put_many(self, items):
+        """Put `items` on the queue, return whether each was kept."""
+        sent = 0
+        if self.agent is not None:
+            sent = self.agent.send(items)
+            if sent:
+                self.metrics.incr('agent_sent', sent)
+            if sent == len(items):
+                return [True] * sent
+        self._start_pool()
+        # the items written to the agent are not uploaded again
+        return [True] * sent + self.backpressure.put_many(
+            self.queue, items[sent:], prepare=self._complete)
+
+    def _message(self, msg):
+        """Validate the fields of a pre-built `msg` that `track()`, etc.
+        would check, and fill in the missing optional ones."""
+        require('message', msg, dict)
+        require('type', msg.get('type'), str)
+        if msg['type'] == 'alias':
+            require('previous_id', msg.get('previousId'), ID_TYPES)
+            require('user_id', msg.get('userId'), ID_TYPES)
+        else:
+            require('user_id or anonymous_id',
+                    msg.get('userId') or msg.get('anonymousId'), ID_TYPES)
+        if msg['type'] == 'track':
+            require('event', msg.get('event'), str)
+        if msg['type'] == 'group':
+            require('group_id', msg.get('groupId'), ID_TYPES)
+        msg.setdefault('timestamp', None)
+        msg.setdefault('messageId', None)
+        if msg.get('context') is None:
+            msg['context'] = {}
+        if msg.get('integrations') is None:
+            msg['integrations'] = {}
+        return msg
+
+    def _prepare(self, msg):
+        """Validate and complete `msg`, return it as an `EncodedMessage`"""
         timestamp = msg['timestamp']
         if timestamp is None:
-            timestamp = datetime.utcnow().replace(tzinfo=tzutc())
+            timestamp = datetime.now(timezone.utc)
         message_id = msg.get('messageId')
         if message_id is None:
             message_id = uuid4()
@@ -264,46 +709,53 @@ class Client(object):
         timestamp = guess_timezone(timestamp)
         msg['timestamp'] = timestamp.isoformat(timespec='milliseconds')
         msg['messageId'] = stringify_id(message_id)
-        msg['context']['library'] = {
-            'name': 'eventbridge-analytics-python',
-            'version': VERSION
-        }
+        msg['context']['library'] = dict(LIBRARY)
 
         msg['userId'] = stringify_id(msg.get('userId', None))
         msg['anonymousId'] = stringify_id(msg.get('anonymousId', None))
 
-        msg = clean(msg)
-        self.log.debug('queueing: %s', msg)
+        # Encode once; the consumer and the request reuse the encoded form.
+        encoded = self._encode(msg)
+        msg = encoded.msg
+        self.payload_log.debug('queueing: %s', msg)
 
-        # Check message size.
-        msg_size = len(json.dumps(msg, cls=DatetimeSerializer).encode())
-        if msg_size > MAX_MSG_SIZE:
+        if self.event_bridge.entry_size(encoded) > MAX_MSG_SIZE:
             raise RuntimeError('Message exceeds %skb limit. (%s)',
                                str(int(MAX_MSG_SIZE / 1024)), str(msg))
 
-        # if send is False, return msg as if it was successfully queued
-        if not self.send:
-            return True, msg
+        return encoded
 
-        if self.sync_mode:
-            self.log.debug('enqueued with blocking %s.', msg['type'])
-            self.event_bridge.post(batch=[msg])
+    def _complete(self, item):
+        """Return a queued `item` as an `EncodedMessage`, preparing it if
+        it was enqueued on the fast path."""
+        if isinstance(item, EncodedMessage):
+            return item
+        encoded = self._prepare(item)
+        encoded.release()
+        return encoded
 
-            return True, msg
+    def _encode(self, msg):
+        """Serialize `msg`, only walking it with `clean()` when the
+        serializer can't handle one of its values natively.
 
+        The message returned by `track()` etc. is therefore the one passed
+        in: values such as `Decimal`, `Enum` or `set` are only converted in
+        the encoded form, not in the returned dict."""
         try:
-            self.queue.put(msg, block=False)
-            self.log.debug('enqueued %s.', msg['type'])
-            return True, msg
-        except queue.Full:
-            self.log.warning('analytics-python queue is full')
-            return False, msg
+            return EncodedMessage(msg, serializer=self.serializer)
+        except (TypeError, ValueError, OverflowError):
+            return EncodedMessage(clean(msg), serializer=self.serializer)
 
     def flush(self):
         """Forces a flush from the internal queue to the server"""
         queue = self.queue
         size = queue.qsize()
         queue.join()
+        if self.spool_feeder is not None and self.spool_feeder.is_alive():
+            # wait for the spool to be fed through the queue as well
+            while not self.spool.empty():
+                time.sleep(self.spool_feeder.interval)
+                queue.join()
         # Note that this message may not be precise, because of threading.
         self.log.debug('successfully flushed about %s items.', size)
 
@@ -311,13 +763,32 @@ class Client(object):
         """Ends the consumer thread once the queue is empty.
         Blocks execution until finished
         """
-        for consumer in self.consumers:
-            consumer.pause()
+        if self.pool is not None:
+            self.pool.join()
+        if self.spool is not None:
+            self._persist()
+
+    def _persist(self):
+        """Stop feeding from the spool and move whatever is still queued
+        onto it, to be delivered after a restart."""
+        self.spool_feeder.stop()
+        if self.spool_feeder.is_alive():
+            self.spool_feeder.join()
+        spooled = 0
+        while True:
+            try:
+                item = self.queue.get(block=False)
+            except queue.Empty:
+                break
             try:
-                consumer.join()
-            except RuntimeError:
-                # consumer thread has not started
-                pass
+                if self.spool.append(self._complete(item)):
+                    spooled += 1
+            except Exception as e:
+                self.log.error('dropping invalid message: %s', e)
+            self.queue.task_done()
+        if spooled:
+            self.log.debug('spooled %s undelivered items.', spooled)
+        self.spool.close()
 
     def shutdown(self):
         """Flush all messages and cleanly shutdown the client"""
@@ -0,0 +1,143 @@
+from threading import Condition
+import collections
+import time
+
+import monotonic
+
+from eventbridge.analytics.metrics import Metrics
+from eventbridge.analytics.utils import TokenBucket
+
+
+class AdaptiveConcurrency(object):
+    """Adapts how many uploads may be in flight, and how many may start per
+    second, to throttling and latency, increasing them additively and
+    decreasing them multiplicatively (AIMD).
+
+    The in-flight limit starts at `max_limit`. Every upload that isn't
+    throttled raises it by `increase / limit`, about `increase` per round
+    of uploads, up to `max_limit`. A throttled upload multiplies it by
+    `decrease`, and an upload finishing while the average latency is over
+    `latency_tolerance` times the baseline (the lowest latency seen lately)
+    by `latency_decrease`, down to `min_limit`.
+
+    Uploads aren't paced until the first throttling; the rate is then set
+    to `decrease` times the rate uploads were started at over the last
+    second, down to `min_rate`. It grows by `rate_increase` uploads per
+    second for every upload latency that passes without throttling, and is
+    cut again by the next throttling.
+
+    Decreases happen at most once per upload latency, so that a burst of
+    throttled uploads counts as a single signal.
+
+    Clients sharing a quota each back off when it is exceeded and probe
+    for more when it isn't, so together they settle just under it.
+    Decreases are counted in `metrics` as 'concurrency_decreases' and
+    'rate_decreases'; `stats()` returns the current limit and rate.
+    """
+
+    def __init__(self, max_limit, min_limit=1, increase=1.0, decrease=0.7,
+                 latency_decrease=0.9, latency_tolerance=2.0,
+                 rate_increase=1.0, min_rate=1.0, metrics=None):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError('min_limit must be between 1 and max_limit')
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_decrease = latency_decrease
+        self.latency_tolerance = latency_tolerance
+        self.rate_increase = rate_increase
+        self.min_rate = min_rate
+        self.metrics = metrics or Metrics()
+        self.condition = Condition()
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.bucket = None
+        self.rate_updated = None
+        # when the uploads of the last second started
+        self.starts = collections.deque()
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = None
+        self.sleep = time.sleep
+
+    def acquire(self):
+        """Block until another upload may start."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            now = monotonic.monotonic()
+            self.starts.append(now)
+            while self.starts[0] < now - 1.0:
+                self.starts.popleft()
+            wait = self.bucket.reserve() if self.bucket is not None else 0
+        if wait > 0:
+            self.sleep(wait)
+
+    def release(self, latency, throttled=False):
+        """Record that an upload finished after `latency` seconds, and
+        whether it was throttled."""
+        with self.condition:
+            self.in_flight -= 1
+            now = monotonic.monotonic()
+            if throttled:
+                if self._decrease(self.decrease, now):
+                    self._decrease_rate(now)
+            else:
+                self._observe(latency)
+                if self.latency > self.latency_tolerance * self.baseline:
+                    self._decrease(self.latency_decrease, now)
+                else:
+                    self.limit = min(self.max_limit,
+                                     self.limit + self.increase / self.limit)
+                self._increase_rate(now)
+            self.condition.notify_all()
+
+    def _observe(self, latency):
+        if self.latency is None:
+            self.latency = self.baseline = latency
+            return
+        self.latency = 0.8 * self.latency + 0.2 * latency
+        # the lowest latency seen, drifting up slowly so that it follows
+        # lasting changes
+        self.baseline = min(latency,
+                            self.baseline + 0.01 * (latency - self.baseline))
+
+    def _decrease(self, factor, now):
+        """Multiply the limit by `factor`, return whether it was done."""
+        if self.last_decrease is not None and \
+                now - self.last_decrease < (self.latency or 0):
+            return False
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.metrics.incr('concurrency_decreases')
+        return True
+
+    def _decrease_rate(self, now):
+        rate = len(self.starts)
+        if self.bucket is not None:
+            rate = min(rate, self.bucket.rate)
+        rate = max(self.min_rate, rate * self.decrease)
+        if self.bucket is None:
+            self.bucket = TokenBucket(rate, burst=1)
+        self.bucket.rate = rate
+        self.rate_updated = now
+        self.metrics.incr('rate_decreases')
+
+    def _increase_rate(self, now):
+        if self.bucket is None:
+            return
+        rounds = (now - self.rate_updated) / max(self.latency, 0.001)
+        self.bucket.rate += self.rate_increase * rounds
+        self.rate_updated = now
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'rate': self.bucket.rate if self.bucket is not None else None,
+                'latency': self.latency,
+                'baseline': self.baseline,
+            }
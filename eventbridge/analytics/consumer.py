@@ -1,58 +1,192 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from threading import Thread
+from threading import Thread, BoundedSemaphore, Lock
+import time
 import monotonic
 import backoff
-import json
 
+from eventbridge.analytics.metrics import (
+    Metrics, LATENCY_BUCKETS, ENTRIES_BUCKETS, BYTES_BUCKETS)
 from eventbridge.analytics.request import (
-    APIError, DatetimeSerializer)
+    APIError, PartialFailureError, RETRYABLE_ERROR_CODES,
+    THROTTLING_ERROR_CODES, MAX_REQUEST_SIZE, encode)
+from eventbridge.analytics.utils import truncate, TokenBucket
 
 from queue import Empty
 
+log = logging.getLogger('eventbridge.analytics')
+
 # https://docs.aws.amazon.com/eventbridge/latest/APIReference/API_PutEvents.html
 
-# EventBridge imposes a 256kb limit on a single event entry. Here limit is set
-# slightly lower to leave space for extra data that will be added later,
-# eg. "sentAt".
-MAX_MSG_SIZE = 243000
+# EventBridge imposes a 256kb limit on the whole PutEvents request, counted
+# over the Source, DetailType, Detail and bus name of every entry. Sizes
+# here are entry sizes as computed by `EventBridge.entry_size`.
+BATCH_SIZE_LIMIT = MAX_REQUEST_SIZE
 
-# EventBridge only accepts batches less than 1MB. Here limit is set slightly
-# lower to leave space for extra data that will be added later, eg. "sentAt".
-BATCH_SIZE_LIMIT = 950000
+# A single entry has to fit in a request on its own.
+MAX_MSG_SIZE = BATCH_SIZE_LIMIT
 
 # EventBridge imposes a 10 event entry limit per batch.
 MAX_BATCH_COUNT = 10
 
+# Items that didn't fit in a batch are held for the following one while the
+# batch is topped up with smaller items; this caps how many are held.
+MAX_CARRY_COUNT = MAX_BATCH_COUNT
+
+
+class Linger(object):
+    """Decides how long a consumer waits for a batch to fill.
+
+    The wait starts when the first item of a batch arrives and is sized from
+    the observed arrival rate: just long enough to expect a full batch, so
+    deep queues are sent straight away and sparse traffic is given time to
+    accumulate. It never exceeds `max_latency`, and never drops below
+    `1 / max_upload_rate` when a cap on uploads per second is set.
+    """
+
+    def __init__(self, max_latency=0.5, max_upload_rate=None):
+        self.max_latency = max_latency
+        self.min_linger = 0.0
+        if max_upload_rate:
+            self.min_linger = min(max_latency, 1.0 / max_upload_rate)
+        # moving average of the item arrival rate, per second
+        self.rate = None
+
+    def linger(self, missing, waiting):
+        """Return how long to wait for `missing` more items when `waiting`
+        are already queued."""
+        if waiting >= missing:
+            return self.min_linger
+        if not self.rate:
+            return self.max_latency
+        expected = (missing - waiting) / self.rate
+        return max(self.min_linger, min(self.max_latency, expected))
+
+    def observe(self, count, elapsed):
+        """Record that `count` items arrived in `elapsed` seconds."""
+        rate = count / max(elapsed, 0.001)
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate = 0.8 * self.rate + 0.2 * rate
+
 
 class Consumer(Thread):
     """Consumes the messages from the client's queue."""
     log = logging.getLogger('eventbridge.analytics')
 
     def __init__(self, queue, event_bridge_client,
-                 upload_size=100, on_error=None, upload_interval=0.5,
-                 retries=10):
-        """Create a consumer thread."""
+                 upload_size=10, on_error=None, upload_interval=0.5,
+                 retries=10, max_in_flight=1, max_upload_rate=None,
+                 prepare=encode, metrics=None, retry_scheduler=None,
+                 concurrency=None, rate_limiter=None):
+        """Create a consumer thread.
+
+        Batches are sent once they hold `upload_size` items (at most
+        MAX_BATCH_COUNT) or fill a request, or when the adaptive linger runs
+        out; `upload_interval` bounds the linger, see `Linger`.
+        `max_upload_rate` caps the batches this consumer uploads per second,
+        however deep the queue.
+
+        `max_in_flight` is the number of batches that may be uploading at the
+        same time. With the default of 1 batches are uploaded one after the
+        other on the consumer thread itself.
+
+        `prepare` turns a queued item into an `EncodedMessage`; messages
+        that fail it are dropped and reported to `on_error`.
+
+        Batches, uploads and failures are recorded in `metrics`, which is
+        usually shared by all of a client's consumers.
+
+        Without a `retry_scheduler` a failed batch is retried up to `retries`
+        times on the spot, see `request`. With one, each upload is a single
+        attempt and the retryable entries of a failed batch are handed to
+        the scheduler, to be uploaded again by whichever consumer is free
+        once they are due; they are only acknowledged on the queue once
+        delivered or given up on.
+
+        With an `AdaptiveConcurrency` as `concurrency`, every upload waits
+        for it before starting and reports its latency and throttling to it
+        afterwards; it is usually shared by all of a client's consumers.
+
+        A `rate_limiter`, eg. a `SharedTokenBucket`, is asked for a token
+        before every PutEvents call, and the call waits as long as it says.
+        """
         Thread.__init__(self)
         # Make consumer a daemon thread so that it doesn't block program exit
         self.daemon = True
         self.upload_size = upload_size
         self.upload_interval = upload_interval
+        self.linger = Linger(upload_interval, max_upload_rate)
+        self.upload_bucket = None
+        if max_upload_rate:
+            self.upload_bucket = TokenBucket(max_upload_rate, burst=1)
         self.on_error = on_error
         self.queue = queue
         self.event_bridge_client = event_bridge_client
+        self.prepare = prepare
         # It's important to set running in the constructor: if we are asked to
         # pause immediately after construction, we might set running to True in
         # run() *after* we set it to False in pause... and keep running
         # forever.
         self.running = True
         self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.in_flight = BoundedSemaphore(max_in_flight)
+        self.executor = None
+        # items taken off the queue that didn't fit in the previous batch
+        self.carry = []
+        # upload statistics, updated from the upload threads
+        self.stats_lock = Lock()
+        self.started_at = None
+        self.batches = 0
+        self.messages = 0
+        self.failed = 0
+        self.upload_time = 0.0
+        # totals over the batches assembled by `next`
+        self.batched = 0
+        self.batched_entries = 0
+        self.batched_bytes = 0
+        # moving average of the upload latency in seconds
+        self.latency = None
+        self.metrics = metrics or Metrics()
+        self.metrics.histogram('put_events_latency', LATENCY_BUCKETS)
+        self.metrics.histogram('batch_entries', ENTRIES_BUCKETS)
+        self.metrics.histogram('batch_bytes', BYTES_BUCKETS)
+        self.retry_scheduler = retry_scheduler
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
 
     def run(self):
         """Runs the consumer."""
         self.log.debug('consumer is running...')
+        self.started_at = monotonic.monotonic()
+        if self.max_in_flight > 1:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_in_flight,
+                thread_name_prefix='%s-upload' % self.name)
         while self.running:
             self.upload()
 
+        # upload what was held back from the last batch, since those items
+        # have already been taken off the queue
+        while self.carry:
+            self.upload()
+
+        if self.executor:
+            # wait for the batches that are still in flight
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        # the retries this consumer scheduled are still holding up `join`
+        # on the queue
+        scheduler = self.retry_scheduler
+        while scheduler is not None and scheduler.pending(self):
+            due = scheduler.pop_due()
+            if due is None:
+                time.sleep(min(scheduler.next_due() or 0, 0.1))
+                continue
+            self.send(*due)
         self.log.debug('consumer exited.')
 
     def pause(self):
@@ -60,83 +194,376 @@ class Consumer(Thread):
         self.running = False
 
     def upload(self):
-        """Upload the next batch of items, return whether successful."""
-        success = False
-        batch = self.next()
+        """Upload the next batch of items, return whether successful.
+
+        When batches are dispatched concurrently this returns as soon as the
+        batch has been handed to an upload thread.
+        """
+        if self.executor is None:
+            batch, attempt = self._next()
+            if len(batch) == 0:
+                return False
+            self._pace()
+            return self.send(batch, attempt)
+
+        # Wait for a free slot before pulling items off the queue, so that
+        # at most `max_in_flight` batches are ever taken out of it.
+        self.in_flight.acquire()
+        batch, attempt = self._next()
         if len(batch) == 0:
+            self.in_flight.release()
             return False
+        self._pace()
+        self.executor.submit(self._dispatch, batch, attempt)
+        return True
+
+    def _pace(self):
+        """Wait until `max_upload_rate` allows another upload."""
+        if self.upload_bucket is not None:
+            wait = self.upload_bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+
+    def _next(self):
+        """Return the next batch to upload, retries that are due first,
+        with the number of the attempt."""
+        if self.retry_scheduler is not None:
+            due = self.retry_scheduler.pop_due()
+            if due is not None:
+                return due
+        return self.next(), 0
 
+    def _dispatch(self, batch, attempt=0):
         try:
-            self.request(batch)
+            self.send(batch, attempt)
+        finally:
+            self.in_flight.release()
+
+    def send(self, batch, attempt=0):
+        """Upload `batch` and acknowledge its items, return whether
+        successful.
+
+        `attempt` is the number of times `batch` was uploaded before. With a
+        retry scheduler, retryable failures are scheduled for another
+        attempt rather than acknowledged.
+        """
+        success = False
+        failed = []
+        retried = []
+        throttled = False
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        start = monotonic.monotonic()
+        try:
+            if self.retry_scheduler is None:
+                self.request(batch)
+            else:
+                request(self.event_bridge_client, batch, 0, self.metrics,
+                        self.rate_limiter)
             success = True
         except Exception as e:
-            self.log.error('error uploading: %s', e)
             success = False
-            if self.on_error:
-                self.on_error(e, batch)
+            # only report the entries that weren't delivered
+            if isinstance(e, PartialFailureError):
+                failures = list(zip(e.failures, e.entries))
+            else:
+                code = getattr(e, 'code', type(e).__name__)
+                failures = [((position, code, str(e)), item)
+                            for position, item in enumerate(batch)]
+            throttled = any(code in THROTTLING_ERROR_CODES
+                            for (_, code, _), _ in failures)
+            if self.retry_scheduler is not None:
+                failures, retried = self._retry(e, failures, attempt)
+            failed = [item for _, item in failures]
+            if retried:
+                self.log.debug('error uploading, retrying %d entries: %s',
+                               len(retried), e)
+                if failed:
+                    # only report the errors of the entries given up on
+                    e = PartialFailureError([f for f, _ in failures],
+                                            failed)
+            if failed:
+                self.log.error('error uploading: %s', e)
+                for (_, code, _), _ in failures:
+                    self.metrics.incr('failed_entries.%s' % code)
+                if self.on_error:
+                    self.on_error(e, [item.msg for item in failed])
         finally:
-            # mark items as acknowledged from queue
-            for _ in batch:
+            duration = monotonic.monotonic() - start
+            if self.concurrency is not None:
+                self.concurrency.release(duration, throttled)
+            self._record(len(batch) - len(failed) - len(retried),
+                         len(failed), duration)
+            # mark items as acknowledged from queue, except the retried ones
+            for _ in range(len(batch) - len(retried)):
                 self.queue.task_done()
             return success
 
+    def _retry(self, e, failures, attempt):
+        """Schedule another attempt for the retryable `failures` of an
+        upload, return the failures left and the items scheduled."""
+        if attempt >= self.retries:
+            return failures, []
+        if isinstance(e, PartialFailureError):
+            retryable = [f for f in failures
+                         if f[0][1] in RETRYABLE_ERROR_CODES]
+        elif isinstance(e, APIError) and not e.retryable:
+            retryable = []
+        else:
+            # retry on all other errors (eg. network)
+            retryable = failures
+        items = [item for _, item in retryable]
+        if not items or not self.retry_scheduler.schedule(
+                items, attempt + 1, owner=self):
+            return failures, []
+        return [f for f in failures if f not in retryable], items
+
+    def _record(self, delivered, failed, duration):
+        self.metrics.incr('batches_sent')
+        self.metrics.incr('entries_delivered', delivered)
+        self.metrics.incr('entries_failed', failed)
+        with self.stats_lock:
+            self.batches += 1
+            self.messages += delivered
+            self.failed += failed
+            self.upload_time += duration
+            if self.latency is None:
+                self.latency = duration
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * duration
+
+    def _ratio(self, total, limit):
+        if not self.batched:
+            return 0.0
+        return total / float(self.batched * limit)
+
+    def stats(self):
+        """Return this consumer's upload statistics."""
+        with self.stats_lock:
+            elapsed = 0.0
+            if self.started_at is not None:
+                elapsed = monotonic.monotonic() - self.started_at
+            return {
+                'name': self.name,
+                'running': self.running,
+                'batches': self.batches,
+                'messages': self.messages,
+                'failed': self.failed,
+                'upload_time': self.upload_time,
+                'latency': self.latency,
+                'linger': self.linger.linger(MAX_BATCH_COUNT, 0),
+                # how full the batches were, by entry count and by size
+                'fill_ratio': self._ratio(self.batched_entries,
+                                          MAX_BATCH_COUNT),
+                'size_fill_ratio': self._ratio(self.batched_bytes,
+                                               BATCH_SIZE_LIMIT),
+                'throughput': self.messages / elapsed if elapsed else 0.0,
+            }
+
     def next(self):
-        """Return the next batch of items to upload."""
+        """Return the next batch of items to upload.
+
+        Batches are packed up to the PutEvents request size: an item that
+        doesn't fit in the current batch is held back for the next one and
+        the batch is topped up with the items that follow it.
+        """
         queue = self.queue
         items = []
-
-        start_time = monotonic.monotonic()
         total_size = 0
+        batch_count = min(self.upload_size, MAX_BATCH_COUNT)
 
-        while len(items) < self.upload_size:
-            elapsed = monotonic.monotonic() - start_time
-            if elapsed >= self.upload_interval:
-                break
+        # items held back from the previous batch go first
+        carry, self.carry = self.carry, []
+        for item in carry:
+            size = self.entry_size(item)
+            if len(items) < batch_count and \
+                    total_size + size <= BATCH_SIZE_LIMIT:
+                items.append(item)
+                total_size += size
+            else:
+                self.carry.append(item)
+
+        # Wait up to `upload_interval` for the first item, then linger for
+        # the rest of the batch.
+        start_time = called_at = monotonic.monotonic()
+        deadline = start_time + self.upload_interval
+        if self.retry_scheduler is not None:
+            # don't keep a due retry waiting on an empty queue
+            due = self.retry_scheduler.next_due()
+            if due is not None:
+                deadline = min(deadline, start_time + due)
+        if items:
+            deadline = start_time + self.linger.linger(
+                batch_count - len(items), queue.qsize())
+        lingering = bool(items)
+        received = 0
+
+        while len(items) < batch_count:
+            timeout = deadline - monotonic.monotonic()
             try:
-                item = queue.get(
-                    block=True, timeout=self.upload_interval - elapsed)
-                item_size = len(json.dumps(
-                    item, cls=DatetimeSerializer).encode())
-                if item_size > MAX_MSG_SIZE:
+                if timeout > 0:
+                    item = queue.get(block=True, timeout=timeout)
+                else:
+                    # out of time, but still take what is already queued
+                    item = queue.get(block=False)
+                received += 1
+                try:
+                    item = self.prepare(item)
+                except Exception as e:
+                    self.log.error('dropping invalid message: %s', e)
+                    self.metrics.incr('dropped_invalid')
+                    if self.on_error:
+                        self.on_error(e, [item])
+                    queue.task_done()
+                    continue
+                size = self.entry_size(item)
+                if size > MAX_MSG_SIZE:
                     self.log.error(
-                        'Item exceeds 256kb limit, dropping. (%s)', str(item))
+                        'Item exceeds 256kb limit, dropping. (%s)',
+                        truncate(item.detail, 200))
+                    self.metrics.incr('dropped_oversize')
+                    queue.task_done()
+                    continue
+                if total_size + size > BATCH_SIZE_LIMIT:
+                    self.carry.append(item)
+                    if len(self.carry) >= MAX_CARRY_COUNT:
+                        self.log.debug(
+                            'hit batch size limit (size: %d)', total_size)
+                        break
                     continue
                 items.append(item)
-                total_size += item_size
-                if total_size >= BATCH_SIZE_LIMIT:
+                total_size += size
+                if BATCH_SIZE_LIMIT - total_size <= self.min_entry_size:
                     self.log.debug(
                         'hit batch size limit (size: %d)', total_size)
                     break
-                if len(items) >= MAX_BATCH_COUNT:
-                    self.log.debug(
-                        'hit batch count limit (count: %d)', len(items))
-                    break
+                if not lingering:
+                    lingering = True
+                    start_time = monotonic.monotonic()
+                    # the time spent waiting for the first item
+                    self.metrics.incr('idle_time', start_time - called_at)
+                    deadline = start_time + self.linger.linger(
+                        batch_count - len(items), queue.qsize())
             except Empty:
                 break
             except Exception as e:
                 self.log.exception('Exception: %s', e)
 
+        if lingering:
+            self.linger.observe(received,
+                                monotonic.monotonic() - start_time)
+        else:
+            self.metrics.incr('idle_time', monotonic.monotonic() - called_at)
+        if len(items) >= MAX_BATCH_COUNT:
+            self.log.debug('hit batch count limit (count: %d)', len(items))
+        if items:
+            with self.stats_lock:
+                self.batched += 1
+                self.batched_entries += len(items)
+                self.batched_bytes += total_size
+            self.metrics.observe('batch_entries', len(items))
+            self.metrics.observe('batch_bytes', total_size)
         return items
 
+    def entry_size(self, item):
+        """Return the PutEvents entry size of `item`."""
+        return self.event_bridge_client.entry_size(item)
+
+    @property
+    def min_entry_size(self):
+        """The size of the smallest possible entry."""
+        return self.event_bridge_client.entry_overhead + len('{}')
+
     def request(self, batch):
-        """Attempt to upload the batch and retry before raising an error """
-
-        def fatal_exception(exc):
-            if isinstance(exc, APIError):
-                # retry on server errors and client errors
-                # with 429 status code (rate limited),
-                # don't retry on other client errors
-                return (400 <= int(exc.code) < 500) and int(exc.code) != 429
-            else:
-                # retry on all other errors (eg. network)
-                return False
+        """Attempt to upload the batch and retry before raising an error."""
+        request(self.event_bridge_client, batch, self.retries, self.metrics,
+                self.rate_limiter)
+
+
+def request(event_bridge_client, batch, retries=10, metrics=None,
+            rate_limiter=None):
+    """Upload `batch` with `event_bridge_client`, retrying up to `retries`
+    times before raising an error.
+
+    When PutEvents rejects only some entries, just those are retried, and
+    only if their error is retryable. If any entry is still undelivered at
+    the end a `PartialFailureError` listing them is raised.
 
-        @backoff.on_exception(
-            backoff.expo,
-            Exception,
-            max_tries=self.retries + 1,
-            giveup=fatal_exception)
-        def send_request():
-            self.event_bridge_client.post(batch=batch)
+    The latency of every PutEvents call and the number of retries are
+    recorded in `metrics`, if given. Every call first waits for a token from
+    `rate_limiter`, if given.
+    """
+    # (position in batch, item) of the entries not delivered yet
+    pending = list(enumerate(batch))
+    # (position in batch, code, message, item) of rejected entries
+    rejected = []
 
+    def fatal_exception(exc):
+        if isinstance(exc, APIError):
+            return not exc.retryable
+        else:
+            # retry on all other errors (eg. network)
+            return False
+
+    def on_backoff(details):
+        if metrics is not None:
+            metrics.incr('retries')
+
+    @backoff.on_exception(
+        backoff.expo,
+        Exception,
+        max_tries=retries + 1,
+        giveup=fatal_exception,
+        on_backoff=on_backoff,
+        # a single attempt is the caller's to log
+        logger='backoff' if retries else None)
+    def send_request():
+        if rate_limiter is not None:
+            wait = rate_limiter.reserve()
+            if wait > 0:
+                time.sleep(wait)
+        start = monotonic.monotonic()
+        try:
+            event_bridge_client.post(batch=[item for _, item in pending])
+        except PartialFailureError as e:
+            retry = []
+            for index, code, message in e.failures:
+                position, item = pending[index]
+                if code in RETRYABLE_ERROR_CODES:
+                    retry.append((position, code, message, item))
+                else:
+                    rejected.append((position, code, message, item))
+            pending[:] = [(position, item)
+                          for position, _, _, item in retry]
+            if retry:
+                log.debug('retrying %d failed entries', len(retry))
+                raise PartialFailureError(
+                    [failure[:3] for failure in retry],
+                    [item for _, _, _, item in retry])
+        else:
+            pending[:] = []
+        finally:
+            if metrics is not None:
+                metrics.observe('put_events_latency',
+                                monotonic.monotonic() - start)
+
+    try:
         send_request()
+    except PartialFailureError as e:
+        failed = rejected + [
+            failure + (item,) for failure, item in zip(e.failures,
+                                                       e.entries)]
+    except Exception as e:
+        if not rejected and len(pending) == len(batch):
+            raise
+        # part of the batch was delivered before the request failed
+        code = getattr(e, 'code', type(e).__name__)
+        failed = rejected + [(position, code, str(e), item)
+                             for position, item in pending]
+    else:
+        failed = rejected
+
+    if failed:
+        failed.sort(key=lambda failure: failure[0])
+        raise PartialFailureError([failure[:3] for failure in failed],
+                                  [failure[3] for failure in failed])
@@ -0,0 +1,110 @@
+from threading import Lock
+import bisect
+
+# Upper bounds of the default histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+ENTRIES_BUCKETS = tuple(range(1, 11))
+BYTES_BUCKETS = (1024, 4 * 1024, 16 * 1024, 64 * 1024, 128 * 1024,
+                 256 * 1024)
+
+
+class Histogram(object):
+    """Counts observations into buckets with fixed upper bounds, plus one
+    for everything above the last bound."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Return the count, sum and cumulative bucket counts, keyed by
+        upper bound like Prometheus' `le` label."""
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            buckets[bound] = total
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class Metrics(object):
+    """Counters, histograms and gauges describing a client.
+
+    Counters and histograms are updated under a single lock, so they are
+    cheap enough to keep on in production. Gauges are callables that are
+    only evaluated by `stats()`.
+
+    Exporters can either poll `stats()`, eg. from a Prometheus collector, or
+    register a hook with `add_hook(hook)` to have every update pushed to
+    them, eg. to StatsD. Hooks are called as `hook(kind, name, value)`
+    with `kind` 'counter' or 'histogram', on the thread that made the
+    update, so they must be quick and must not raise.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.hooks = []
+
+    def reset(self):
+        """Zero every counter and histogram, eg. in the child of a fork."""
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = dict(
+            (name, Histogram(histogram.buckets))
+            for name, histogram in self.histograms.items())
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def histogram(self, name, buckets):
+        """Declare the histogram `name` with the given bucket bounds."""
+        with self.lock:
+            self.histograms.setdefault(name, Histogram(buckets))
+
+    def gauge(self, name, fn):
+        """Report the value returned by `fn()` as `name`."""
+        self.gauges[name] = fn
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        for hook in self.hooks:
+            hook('counter', name, value)
+
+    def observe(self, name, value):
+        """Add `value` to the histogram `name`, which must be declared."""
+        with self.lock:
+            self.histograms[name].observe(value)
+        for hook in self.hooks:
+            hook('histogram', name, value)
+
+    def counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def stats(self):
+        """Return a snapshot of every metric."""
+        with self.lock:
+            stats = {
+                'counters': dict(self.counters),
+                'histograms': dict(
+                    (name, histogram.snapshot())
+                    for name, histogram in self.histograms.items()),
+            }
+        stats['gauges'] = dict((name, fn())
+                               for name, fn in list(self.gauges.items()))
+        return stats
@@ -0,0 +1,141 @@
+import logging
+from threading import Thread, Event, Lock
+
+from eventbridge.analytics.consumer import MAX_BATCH_COUNT
+
+
+class ConsumerPool(object):
+    """Runs the consumers that drain the client's queue.
+
+    The pool starts `min_workers` consumers. If `max_workers` is larger, a
+    supervisor thread adds consumers while the backlog would take longer than
+    `target_drain_time` seconds to upload at the current upload latency, and
+    retires them again once the queue has stayed empty for `idle_ticks`
+    checks.
+    """
+    log = logging.getLogger('eventbridge.analytics')
+
+    def __init__(self, queue, factory, min_workers=1, max_workers=None,
+                 scale_interval=1.0, target_drain_time=1.0, idle_ticks=5):
+        if max_workers is None:
+            max_workers = min_workers
+        if max_workers < min_workers:
+            raise ValueError('max_workers must be at least min_workers')
+        self.queue = queue
+        self.factory = factory
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_interval = scale_interval
+        self.target_drain_time = target_drain_time
+        self.idle_ticks = idle_ticks
+        self.consumers = []
+        self.started = False
+        self.lock = Lock()
+        self.stopped = Event()
+        self.supervisor = None
+        self._idle = 0
+        for _ in range(min_workers):
+            self.consumers.append(factory())
+
+    @property
+    def autoscale(self):
+        return self.max_workers > self.min_workers
+
+    def workers(self):
+        """Return the consumers that are currently running."""
+        with self.lock:
+            return [consumer for consumer in self.consumers
+                    if consumer.running]
+
+    def start(self):
+        """Start the consumers, and the supervisor when autoscaling."""
+        self.started = True
+        for consumer in self.consumers:
+            consumer.start()
+        if self.autoscale:
+            self.supervisor = Thread(target=self._supervise,
+                                     name='eventbridge-analytics-pool')
+            self.supervisor.daemon = True
+            self.supervisor.start()
+
+    def join(self):
+        """Stop every consumer and block until they have exited."""
+        self.stopped.set()
+        if self.supervisor is not None:
+            self.supervisor.join()
+        with self.lock:
+            consumers = list(self.consumers)
+        for consumer in consumers:
+            consumer.pause()
+        for consumer in consumers:
+            try:
+                consumer.join()
+            except RuntimeError:
+                # consumer thread has not started
+                pass
+
+    def scale_up(self):
+        """Start one more consumer, return whether one was started."""
+        with self.lock:
+            running = [c for c in self.consumers if c.running]
+            if len(running) >= self.max_workers or self.stopped.is_set():
+                return False
+            consumer = self.factory()
+            self.consumers.append(consumer)
+        if self.started:
+            consumer.start()
+        self.log.debug('scaled up to %d consumers', len(running) + 1)
+        return True
+
+    def scale_down(self):
+        """Retire the most recently started consumer, return whether one was
+        retired. The consumer finishes its current batch before exiting."""
+        with self.lock:
+            running = [c for c in self.consumers if c.running]
+            if len(running) <= self.min_workers:
+                return False
+            running[-1].pause()
+        self.log.debug('scaled down to %d consumers', len(running) - 1)
+        return True
+
+    def check(self):
+        """Scale the pool once according to queue depth and latency."""
+        with self.lock:
+            # forget retired consumers that have finished
+            self.consumers = [c for c in self.consumers
+                              if c.running or c.is_alive()]
+        workers = self.workers()
+        depth = self.queue.qsize()
+        if depth == 0:
+            self._idle += 1
+            if self._idle >= self.idle_ticks:
+                self._idle = 0
+                self.scale_down()
+            return
+        self._idle = 0
+
+        latencies = [c.latency for c in workers if c.latency is not None]
+        if not latencies:
+            return
+        latency = sum(latencies) / len(latencies)
+        per_round = sum(MAX_BATCH_COUNT * c.max_in_flight for c in workers)
+        drain_time = depth / float(per_round) * latency
+        if drain_time > self.target_drain_time:
+            self.scale_up()
+
+    def _supervise(self):
+        while not self.stopped.wait(self.scale_interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.log.exception('error scaling consumers: %s', e)
+
+    def stats(self):
+        """Return per-consumer upload statistics."""
+        with self.lock:
+            consumers = list(self.consumers)
+        return {
+            'workers': len([c for c in consumers if c.running]),
+            'queue_depth': self.queue.qsize(),
+            'consumers': [c.stats() for c in consumers],
+        }
@@ -0,0 +1,188 @@
+from threading import Lock
+import mmap
+import os
+import struct
+
+import monotonic
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+MAGIC = b'EBRATE01'
+
+# magic, rate, burst, tokens, when the tokens were last refilled
+HEADER = struct.Struct('=8sdddd')
+
+# pid, when it last took tokens, when its next tokens are due, tokens
+# taken, seconds waited
+SLOT = struct.Struct('=qddQd')
+
+
+class SharedTokenBucket(object):
+    """A token bucket shared by the processes of a host through a
+    memory-mapped file at `path`.
+
+    Tokens accrue at `rate` per second up to `burst` (one second's worth by
+    default). Like `TokenBucket`, `reserve(n)` takes `n` tokens, going into
+    debt if there aren't enough, and returns how many seconds to wait.
+    Updates are made under an exclusive `flock` on the file.
+
+    For fairness, each process that took tokens in the last `window`
+    seconds is also paced to its share of `rate`, with bursts of its share
+    of `burst`, so a busy process can't starve the others. Up to
+    `max_processes` processes are tracked; the slots of processes that have
+    exited, or failing that of the longest idle, are reused. `stats()`
+    returns the tokens taken and seconds waited by each of them.
+
+    The clock is `monotonic`, which is shared by the processes of a host.
+    It restarts when the host reboots, so times in the file that are ahead
+    of it are taken as now.
+    The `rate` and `burst` of the last process to open the file apply.
+    """
+
+    def __init__(self, path, rate, burst=None, window=1.0,
+                 max_processes=64):
+        if fcntl is None:
+            raise RuntimeError('a shared rate limit needs fcntl')
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.path = path
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.window = window
+        self.max_processes = max_processes
+        self.size = HEADER.size + SLOT.size * max_processes
+        self.pid = None
+        self._open()
+
+    def _open(self):
+        """Map the file and take a slot, again after a fork since the lock
+        and the file description must not be shared with the parent."""
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < self.size:
+                os.ftruncate(self.fd, self.size)
+            self.map = mmap.mmap(self.fd, self.size)
+            magic, _, _, tokens, last = HEADER.unpack_from(self.map, 0)
+            now = monotonic.monotonic()
+            if magic != MAGIC:
+                tokens, last = self.burst, now
+            HEADER.pack_into(self.map, 0, MAGIC, self.rate, self.burst,
+                             min(tokens, self.burst), min(last, now))
+            self.slot = self._claim_slot()
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _slot_offset(self, slot):
+        return HEADER.size + SLOT.size * slot
+
+    def _claim_slot(self):
+        """Return the slot of this process, taking over a free one."""
+        now = monotonic.monotonic()
+        free = None
+        for slot in range(self.max_processes):
+            pid, last_seen, _, _, _ = SLOT.unpack_from(
+                self.map, self._slot_offset(slot))
+            if pid == self.pid:
+                return slot
+            if free is None and (pid == 0 or not _alive(pid)):
+                free = slot
+        if free is None:
+            # take over the slot that has been idle the longest
+            free = min(range(self.max_processes), key=lambda slot: (
+                SLOT.unpack_from(self.map, self._slot_offset(slot))[1]))
+        SLOT.pack_into(self.map, self._slot_offset(free), self.pid, now, now,
+                       0, 0.0)
+        return free
+
+    def reserve(self, n=1):
+        if os.getpid() != self.pid:
+            self.close()
+            self._open()
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                return self._reserve(n)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _reserve(self, n):
+        now = monotonic.monotonic()
+        _, rate, burst, tokens, last = HEADER.unpack_from(self.map, 0)
+        # times written before a reboot are ahead of the restarted clock
+        last = min(last, now)
+        tokens = min(burst, tokens + (now - last) * rate) - n
+        HEADER.pack_into(self.map, 0, MAGIC, rate, burst, tokens, now)
+        wait = max(0.0, -tokens / rate)
+
+        active = 1
+        for slot in range(self.max_processes):
+            if slot == self.slot:
+                continue
+            pid, last_seen, _, _, _ = SLOT.unpack_from(
+                self.map, self._slot_offset(slot))
+            if pid and 0 <= now - last_seen < self.window:
+                active += 1
+        offset = self._slot_offset(self.slot)
+        pid, last_seen, due, taken, waited = SLOT.unpack_from(self.map, offset)
+        if pid != self.pid:
+            # the slot was taken over while this process was idle
+            self.slot = self._claim_slot()
+            offset = self._slot_offset(self.slot)
+            pid, last_seen, due, taken, waited = SLOT.unpack_from(
+                self.map, offset)
+        if last_seen > now:
+            # a pid reused after a reboot, its old tokens aren't owed
+            due = now
+        # this process' tokens are due one after the other at its share of
+        # the rate, and it may run ahead of them by its share of the burst
+        due = max(due, now)
+        wait = max(wait, due - now - burst / rate)
+        due += n / (rate / active)
+        SLOT.pack_into(self.map, offset, pid, now, due, taken + n,
+                       waited + wait)
+        return wait
+
+    def stats(self):
+        """Return the bucket's state and the tokens taken and seconds
+        waited by each process."""
+        with self.lock:
+            _, rate, burst, tokens, last = HEADER.unpack_from(self.map, 0)
+            now = monotonic.monotonic()
+            processes = []
+            for slot in range(self.max_processes):
+                pid, last_seen, _, taken, waited = SLOT.unpack_from(
+                    self.map, self._slot_offset(slot))
+                if pid:
+                    processes.append({
+                        'pid': pid,
+                        'taken': taken,
+                        'waited': waited,
+                        'active': 0 <= now - last_seen < self.window,
+                    })
+        return {
+            'rate': rate,
+            'burst': burst,
+            'tokens': min(burst, tokens + (now - last) * rate),
+            'processes': processes,
+        }
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,9 +1,184 @@
-from datetime import date, datetime
+from datetime import datetime
+from threading import Lock
 import logging
 import json
+import os
 from dateutil.tz import tzutc
-import boto3
-from botocore.exceptions import ClientError
+
+from eventbridge.analytics.serializers import (
+    DatetimeSerializer, DEFAULT_SERIALIZER)
+from eventbridge.analytics.utils import PayloadLog
+
+log = logging.getLogger('eventbridge.analytics')
+
+
+DETAIL_TYPE = 'eventbridge_analytics_python'
+
+# https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+# PutEvents rejects requests whose entries add up to more than 256KB.
+MAX_REQUEST_SIZE = 256 * 1024
+
+# Error codes, for the whole request or a single entry, that mean the
+# account's PutEvents quota was exceeded.
+THROTTLING_ERROR_CODES = frozenset([
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    '429',
+])
+
+# Error codes, for the whole request or a single entry, that are worth
+# retrying because they come from throttling or a transient service fault.
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | frozenset([
+    'InternalFailure',
+    'InternalException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+])
+
+
+class EncodedMessage(object):
+    """A message together with its serialized EventBridge `Detail`.
+
+    Messages are encoded once, when they are enqueued, and the encoded form is
+    reused for size accounting and for building the PutEvents entries.
+
+    Once `release()` is called only the encoded form is kept, which is all
+    that is needed to upload it; `msg` is then decoded from `detail` again
+    when it is asked for, eg. to report a failure.
+    """
+    __slots__ = ('_msg', 'detail', 'size', '_kind')
+
+    def __init__(self, msg, detail=None, serializer=DEFAULT_SERIALIZER):
+        if detail is None:
+            detail = serializer.dumps(msg)
+        self._msg = msg
+        self.detail = detail
+        self.size = len(detail.encode())
+        self._kind = None if msg is None else kind(msg)
+
+    @property
+    def msg(self):
+        if self._msg is None:
+            return json.loads(self.detail)
+        return self._msg
+
+    @property
+    def kind(self):
+        """The `(type, event)` of the message, kept after `release()`."""
+        if self._kind is None:
+            self._kind = kind(self.msg)
+        return self._kind
+
+    def release(self):
+        """Drop the message, keeping only its encoded form."""
+        self._msg = None
+
+    def __repr__(self):
+        return 'EncodedMessage(%s)' % self.detail
+
+
+def kind(msg):
+    """Return the `(type, event)` of `msg`, event being None unless it is a
+    track event; both are None if `msg` isn't a dict, which is invalid."""
+    if not isinstance(msg, dict):
+        return None, None
+    type = msg.get('type')
+    return type, msg.get('event') if type == 'track' else None
+
+
+def entry_size(detail_size, source, detail_type=DETAIL_TYPE,
+               event_bus_name=None):
+    """Return the size EventBridge counts for a PutEvents entry.
+
+    EventBridge adds up the UTF-8 lengths of `Source`, `DetailType` and
+    `Detail`; the bus name is counted as well to stay on the safe side.
+    """
+    size = detail_size + len(source.encode()) + len(detail_type.encode())
+    if event_bus_name:
+        size += len(event_bus_name.encode())
+    return size
+
+
+def encode(item):
+    """Return `item` as an `EncodedMessage`, encoding it if necessary."""
+    if isinstance(item, EncodedMessage):
+        return item
+    return EncodedMessage(item)
+
+
+# boto3 clients are thread-safe, so every EventBridge with the same
+# region, credentials and connection settings shares one.
+_boto_clients = {}
+_boto_clients_lock = Lock()
+
+
+def boto_config(max_pool_connections=10, connect_timeout=None,
+                read_timeout=None, tcp_keepalive=True):
+    """Return the botocore `Config` of the EventBridge clients."""
+    from botocore.config import Config
+
+    options = {
+        'max_pool_connections': max_pool_connections,
+        'retries': {'total_max_attempts': 1},
+    }
+    if connect_timeout is not None:
+        options['connect_timeout'] = connect_timeout
+    if read_timeout is not None:
+        options['read_timeout'] = read_timeout
+    # older botocore releases, eg. the 1.20 ones boto3 1.17 pulls in,
+    # reject tcp_keepalive
+    if tcp_keepalive and 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+        options['tcp_keepalive'] = True
+    return Config(**options)
+
+
+def boto_client(region_name=None, access_key=None, secret_access_key=None,
+                session_token=None, max_pool_connections=10,
+                connect_timeout=None, read_timeout=None, tcp_keepalive=True):
+    """Return a shared boto3 EventBridge client.
+
+    Consumers upload concurrently, so `max_pool_connections` should be at
+    least the number of uploads in flight. Timeouts left as None use
+    botocore's defaults. botocore's own retries are disabled, retrying is
+    left to `consumer.request`, which only retries the rejected entries.
+    """
+    if access_key is None or secret_access_key is None:
+        # use the default credential chain
+        access_key = secret_access_key = session_token = None
+    key = (region_name, access_key, secret_access_key, session_token,
+           max_pool_connections, connect_timeout, read_timeout,
+           tcp_keepalive)
+    with _boto_clients_lock:
+        client = _boto_clients.get(key)
+        if client is None:
+            # boto3 takes long to import, so it is only loaded once a
+            # client is needed
+            import boto3
+
+            # sessions aren't thread-safe, so each client gets its own
+            client = boto3.session.Session().client(
+                'events',
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_access_key,
+                aws_session_token=session_token,
+                region_name=region_name,
+                config=boto_config(max_pool_connections, connect_timeout,
+                                   read_timeout, tcp_keepalive))
+            _boto_clients[key] = client
+        return client
+
+
+def _reset_boto_clients():
+    # A forked child must not share the parent's connections.
+    global _boto_clients_lock
+    _boto_clients.clear()
+    _boto_clients_lock = Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_boto_clients)
 
 
 class EventBridge(object):
@@ -14,62 +189,92 @@ class EventBridge(object):
                  region_name=None,
                  access_key=None,
                  secret_access_key=None,
-                 session_token=None):
+                 session_token=None,
+                 payload_log=None,
+                 max_pool_connections=10,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 tcp_keepalive=True):
 
         self.source_id = source_id
+        # logs the entries of every request when debugging
+        self.payload_log = payload_log or PayloadLog(log)
         self.event_bus_name = event_bus_name
+        # the part of every entry's size that doesn't depend on the message
+        self.entry_overhead = entry_size(0, source_id, DETAIL_TYPE,
+                                         event_bus_name)
 
-        if access_key is not None and secret_access_key is not None:
-            self.boto_client = boto3.client('events',
-                                            aws_access_key_id=access_key,
-                                            aws_secret_access_key=secret_access_key,
-                                            aws_session_token=session_token,
-                                            region_name=region_name)
-        else:
-            self.boto_client = boto3.client('events')
+        # the boto client is created on first use, see `boto_client`
+        self._boto_client = None
+        self.boto_options = dict(
+            region_name=region_name,
+            access_key=access_key,
+            secret_access_key=secret_access_key,
+            session_token=session_token,
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=tcp_keepalive)
 
-    def post(self, **kwargs):
-        log = logging.getLogger('eventbridge.analytics')
-        body = kwargs
-        body["sentAt"] = datetime.utcnow().replace(tzinfo=tzutc()).isoformat()
+    @property
+    def boto_client(self):
+        """The boto3 client, created on first use."""
+        if self._boto_client is None:
+            self._boto_client = boto_client(**self.boto_options)
+        return self._boto_client
 
-        data = json.dumps(body, cls=DatetimeSerializer)
-        log.debug('making request: %s', data)
+    @boto_client.setter
+    def boto_client(self, client):
+        self._boto_client = client
 
+    def reset(self):
+        """Forget the boto client, eg. after a fork, so that a new one is
+        created on next use."""
+        self._boto_client = None
+
+    def entry_size(self, item):
+        """Return the size of the PutEvents entry for `item`."""
+        return self.entry_overhead + encode(item).size
+
+    def post(self, **kwargs):
         entries = []
-        for detail_data in body['batch']:
-            detail_data_str = json.dumps(detail_data, cls=DatetimeSerializer)
+        for item in kwargs['batch']:
             entries.append({
                     'Source': self.source_id,
-                    'DetailType': 'eventbridge_analytics_python',
-                    'Detail': detail_data_str,
+                    'DetailType': DETAIL_TYPE,
+                    'Detail': encode(item).detail,
                     'EventBusName': self.event_bus_name
             })
-            log.debug('entry: %s', entries[-1])
+        if self.payload_log.enabled():
+            sent_at = datetime.utcnow().replace(tzinfo=tzutc()).isoformat()
+            self.payload_log.debug('making request (sentAt: %s): %s',
+                                   sent_at, entries)
 
+        boto_client = self.boto_client
+        from botocore.exceptions import ClientError
         try:
-            res = self.boto_client.put_events(
+            res = boto_client.put_events(
                 Entries=entries
             )
         except ClientError as e:
-            log.debug('ClientError:  %s,  %s' % (e.response['Error']['Code'],
-                                                 e.response['Error']['Message']))
-            raise APIError(e.response['Error']['Code'], e.response['Error']['Message'])
+            log.debug('ClientError:  %s,  %s', e.response['Error']['Code'],
+                      e.response['Error']['Message'])
+            raise APIError(len(entries), e.response['Error']['Code'],
+                           e.response['Error']['Message'])
 
         if res['FailedEntryCount'] == 0:
             log.debug('data uploaded successfully')
             return res
 
-        try:
-            log.debug('failed %s entries', res['FailedEntryCount'])
-            for entry in res["Entries"]:
-                if "ErrorCode" in entry and "ErrorMessage" in entry:
-                    raise APIError(res['FailedEntryCount'],
-                                   entry['ErrorCode'],
-                                   entry['ErrorMessage'])
-
-        except ValueError:
-            raise APIError(res.status_code, 'unknown', res.text)
+        log.debug('failed %s entries', res['FailedEntryCount'])
+        # PutEvents returns one result per entry, in request order.
+        failures = []
+        for index, entry in enumerate(res['Entries']):
+            if 'ErrorCode' in entry:
+                failures.append((index, entry['ErrorCode'],
+                                 entry.get('ErrorMessage', '')))
+        raise PartialFailureError(
+            failures, [kwargs['batch'][index] for index, _, _ in failures])
 
 
 class APIError(Exception):
@@ -83,10 +288,30 @@ class APIError(Exception):
         msg = "[EventBridge] {0}: {1} ({2})"
         return msg.format(self.code, self.message, self.failed_count)
 
+    @property
+    def retryable(self):
+        """Whether the request may succeed if it is sent again."""
+        if self.code in RETRYABLE_ERROR_CODES:
+            return True
+        try:
+            status = int(self.code)
+        except (TypeError, ValueError):
+            # any other named AWS error is a client error
+            return False
+        # retry on server errors and client errors with 429 status code
+        # (rate limited), don't retry on other client errors
+        return not (400 <= status < 500) or status == 429
+
+
+class PartialFailureError(APIError):
+    """Some entries of a PutEvents request were rejected.
 
-class DatetimeSerializer(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (date, datetime)):
-            return obj.isoformat()
+    `failures` holds an `(index, code, message)` tuple per rejected entry,
+    `entries` the corresponding items of the batch.
+    """
 
-        return json.JSONEncoder.default(self, obj)
+    def __init__(self, failures, entries):
+        _, code, message = failures[0]
+        APIError.__init__(self, len(failures), code, message)
+        self.failures = failures
+        self.entries = entries
@@ -0,0 +1,88 @@
+from threading import Lock
+import heapq
+import itertools
+import random
+
+import monotonic
+
+from eventbridge.analytics.metrics import Metrics
+
+
+class RetryScheduler(object):
+    """Holds failed batches until their next attempt is due.
+
+    Consumers `schedule` the retryable part of a batch after a failed
+    attempt and pick up the batches that are due with `pop_due()` between
+    uploads, so no thread sleeps through a backoff. Batches are kept in a
+    heap ordered by due time.
+
+    The delay before attempt `n` is drawn between half and all of
+    `base_delay * 2 ** (n - 1)`, capped at `max_delay`. At most
+    `max_items` items are held; `schedule` refuses batches beyond that.
+    Scheduled batches are counted in `metrics` as 'retries', like the
+    retries of `consumer.request`, and refused items as 'retry_overflow'.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, max_items=1000,
+                 metrics=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_items = max_items
+        self.metrics = metrics or Metrics()
+        self.lock = Lock()
+        # (due, sequence, items, attempt, owner)
+        self.heap = []
+        self.items = 0
+        self.sequence = itertools.count()
+
+    def delay(self, attempt):
+        """Return how long to wait before attempt number `attempt`."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def schedule(self, items, attempt, owner=None):
+        """Schedule attempt number `attempt` of `items`, return whether
+        there was room for them."""
+        with self.lock:
+            if self.items + len(items) > self.max_items:
+                refused = True
+            else:
+                refused = False
+                due = monotonic.monotonic() + self.delay(attempt)
+                heapq.heappush(self.heap, (due, next(self.sequence), items,
+                                           attempt, owner))
+                self.items += len(items)
+        if refused:
+            self.metrics.incr('retry_overflow', len(items))
+        else:
+            self.metrics.incr('retries')
+        return not refused
+
+    def pop_due(self):
+        """Remove and return the `(items, attempt)` that is due first, or
+        None if none is due yet."""
+        with self.lock:
+            if not self.heap or self.heap[0][0] > monotonic.monotonic():
+                return None
+            _, _, items, attempt, _ = heapq.heappop(self.heap)
+            self.items -= len(items)
+            return items, attempt
+
+    def next_due(self):
+        """Return the seconds until the next batch is due, or None."""
+        with self.lock:
+            if not self.heap:
+                return None
+            return max(0.0, self.heap[0][0] - monotonic.monotonic())
+
+    def pending(self, owner=None):
+        """Return how many batches are waiting, only counting those
+        scheduled by `owner` if given."""
+        with self.lock:
+            if owner is None:
+                return len(self.heap)
+            return len([entry for entry in self.heap if entry[4] is owner])
+
+    def stats(self):
+        with self.lock:
+            return {'batches': len(self.heap), 'items': self.items}
@@ -0,0 +1,92 @@
+from hashlib import blake2b
+from threading import Lock
+
+from eventbridge.analytics.metrics import Metrics
+from eventbridge.analytics.utils import TokenBucket
+
+# The largest value of a 64 bit hash, plus one.
+HASH_RANGE = float(2 ** 64)
+
+
+class Rule(object):
+    """A sampling rule, see `Sampler`."""
+
+    def __init__(self, event=None, type=None, rate=1.0, limit=None,
+                 burst=None):
+        if (event is None) == (type is None):
+            raise ValueError('a rule matches either an event or a type')
+        if not 0 <= rate <= 1:
+            raise ValueError('rate must be between 0 and 1')
+        self.event = event
+        self.type = type
+        self.rate = rate
+        self.bucket = TokenBucket(limit, burst) if limit else None
+
+
+class Sampler(object):
+    """Drops messages by declarative rules, before they are validated or
+    encoded.
+
+    Each rule is a dict matching either track events by `event` name or
+    messages by `type`, eg. `{'event': 'Page Scrolled', 'rate': 0.01}` or
+    `{'type': 'page', 'limit': 100}`. A track event is matched by the rule
+    for its name, if there is one, rather than the one for 'track'.
+
+    - `rate` keeps that fraction of the messages. Which ones is decided by
+      a hash of the userId, or the anonymousId, so all the messages of a
+      user are either kept or dropped; a user kept at some rate is kept at
+      every higher rate as well.
+    - `limit` keeps at most that many messages per second, with bursts of
+      up to `burst` (one second's worth by default).
+
+    Dropped messages are counted in `metrics` as 'dropped_sampled' and
+    'dropped_rate_limited'.
+    """
+
+    def __init__(self, rules, metrics=None):
+        self.events = {}
+        self.types = {}
+        for rule in rules:
+            rule = Rule(**rule)
+            if rule.event is not None:
+                self.events[rule.event] = rule
+            else:
+                self.types[rule.type] = rule
+        self.metrics = metrics or Metrics()
+
+    def after_fork(self):
+        """Give the rules' buckets new locks in the child of a fork, in
+        case another thread held one when the process forked."""
+        for rule in list(self.events.values()) + list(self.types.values()):
+            if rule.bucket is not None:
+                rule.bucket.lock = Lock()
+
+    def rule(self, msg):
+        """Return the rule for `msg`, or None."""
+        if msg.get('type') == 'track' and msg.get('event') in self.events:
+            return self.events[msg['event']]
+        return self.types.get(msg.get('type'))
+
+    def keep(self, msg):
+        """Return whether to keep `msg`."""
+        rule = self.rule(msg)
+        if rule is None:
+            return True
+        if rule.rate < 1 and (rule.rate <= 0 or
+                              user_hash(msg) >= rule.rate):
+            self.metrics.incr('dropped_sampled')
+            return False
+        if rule.bucket is not None and not rule.bucket.take():
+            self.metrics.incr('dropped_rate_limited')
+            return False
+        return True
+
+
+def user_hash(msg):
+    """Return a number in [0, 1) that is the same for every message of
+    the user `msg` is about."""
+    user = msg.get('userId')
+    if user is None:
+        user = msg.get('anonymousId')
+    digest = blake2b(str(user).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / HASH_RANGE
@@ -0,0 +1,138 @@
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def default(obj):
+    """Convert the types `clean()` knows about into JSON native values."""
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', 'strict')
+    raise TypeError('Object of type %s is not JSON serializable'
+                    % type(obj).__name__)
+
+
+class DatetimeSerializer(json.JSONEncoder):
+    def default(self, obj):
+        try:
+            return default(obj)
+        except TypeError:
+            return json.JSONEncoder.default(self, obj)
+
+
+class JSONSerializer(object):
+    """Serializer backed by the standard library `json` module."""
+    name = 'json'
+
+    def __init__(self):
+        # encoders keep no state between calls, so one is shared rather
+        # than building one per message like `json.dumps(cls=...)` does
+        self.encoder = DatetimeSerializer()
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+
+class OrjsonSerializer(object):
+    """Serializer backed by `orjson`, which handles datetimes, enums and
+    UUIDs natively.
+
+    Messages `orjson` can't encode, such as ones holding integers beyond 64
+    bits, are encoded with the `json` backend instead.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('orjson is not installed')
+        self.option = orjson.OPT_NON_STR_KEYS
+        self.fallback = JSONSerializer()
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj, default=default,
+                                option=self.option).decode()
+        except orjson.JSONEncodeError:
+            return self.fallback.dumps(obj)
+
+
+class UjsonSerializer(object):
+    """Serializer backed by `ujson`.
+
+    NaN and infinities are written like the `json` backend writes them.
+    Values `ujson` can't encode, such as integers beyond its range, are
+    encoded with the `json` backend instead.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError('ujson is not installed')
+        self.fallback = JSONSerializer()
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj, default=default, ensure_ascii=False,
+                               allow_nan=True)
+        except OverflowError:
+            return self.fallback.dumps(obj)
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'orjson': OrjsonSerializer,
+    'ujson': UjsonSerializer,
+}
+
+
+def available():
+    """Return the names of the serializers that can be used here."""
+    names = []
+    if orjson is not None:
+        names.append('orjson')
+    if ujson is not None:
+        names.append('ujson')
+    names.append('json')
+    return names
+
+
+def get_serializer(serializer=None):
+    """Resolve `serializer` to an object with a `dumps(obj) -> str` method.
+
+    `serializer` may be the name of a backend ('json', 'orjson', 'ujson'),
+    'auto' to pick the fastest installed backend, an object that already
+    provides `dumps`, or None for the standard library backend.
+    """
+    if serializer is None:
+        return JSONSerializer()
+    if hasattr(serializer, 'dumps'):
+        return serializer
+    if serializer == 'auto':
+        serializer = available()[0]
+    if serializer not in SERIALIZERS:
+        raise ValueError('unknown serializer: %s' % serializer)
+    return SERIALIZERS[serializer]()
+
+
+DEFAULT_SERIALIZER = JSONSerializer()
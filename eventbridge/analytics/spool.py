@@ -0,0 +1,262 @@
+from threading import Thread, Event, Lock
+from queue import Full
+import logging
+import mmap
+import os
+import struct
+
+import monotonic
+
+from eventbridge.analytics.request import EncodedMessage
+
+# Every record is the UTF-8 `Detail` of a message prefixed with its length.
+HEADER = struct.Struct('>I')
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class Spool(object):
+    """An append-only, on-disk buffer of encoded messages.
+
+    Messages are appended to numbered segment files in `path`. Reading
+    starts from a cursor that is persisted with `commit()`, so messages that
+    were written but not committed are read again after a restart. Segments
+    are removed once they have been read past, and `append` refuses messages
+    once the unread segments take up `max_bytes`.
+
+    `fsync` is one of 'always' (sync after every append), 'interval' (at
+    most every `fsync_interval` seconds) or 'never' (leave it to the OS).
+    """
+    log = logging.getLogger('eventbridge.analytics')
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024,
+                 segment_bytes=4 * 1024 * 1024, fsync='interval',
+                 fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of %s' % (FSYNC_POLICIES,))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.lock = Lock()
+        self.last_sync = monotonic.monotonic()
+
+        self.segments = sorted(
+            int(name[:-len('.seg')]) for name in os.listdir(path)
+            if name.endswith('.seg'))
+        # where reading resumes, as (segment, offset)
+        self.cursor = self._load_cursor()
+        self.segments = [s for s in self.segments if s >= self.cursor[0]]
+        # where each record handed out by `read` since the last commit ends
+        self.positions = []
+        self.writer = None
+        if not self.segments:
+            self.segments.append(self.cursor[0])
+        self._open_writer()
+        self._remove_read_segments()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, '%010d.seg' % segment)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.path, 'cursor')) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (IOError, OSError, ValueError):
+            first = self.segments[0] if self.segments else 0
+            return first, 0
+
+    def _open_writer(self):
+        if self.writer is not None:
+            self._sync()
+            self.writer.close()
+        self.writer = open(self._segment_path(self.segments[-1]), 'ab')
+
+    def _remove_read_segments(self):
+        for path in os.listdir(self.path):
+            if path.endswith('.seg') and \
+                    int(path[:-len('.seg')]) < self.cursor[0]:
+                os.remove(os.path.join(self.path, path))
+
+    def _sync(self):
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.last_sync = monotonic.monotonic()
+
+    def size(self):
+        """Return the number of bytes in segments that aren't fully read."""
+        with self.lock:
+            return self._size()
+
+    def _size(self):
+        total = 0
+        for segment in self.segments:
+            try:
+                total += os.path.getsize(self._segment_path(segment))
+            except OSError:
+                pass
+        return total - self.cursor[1]
+
+    def empty(self):
+        """Whether every appended message has been read and committed."""
+        with self.lock:
+            return self._size() <= 0
+
+    def append(self, encoded):
+        """Append an `EncodedMessage`, return whether there was room."""
+        data = encoded.detail.encode()
+        with self.lock:
+            if self.writer is None:
+                return False
+            if self._size() + HEADER.size + len(data) > self.max_bytes:
+                return False
+            if self.writer.tell() >= self.segment_bytes:
+                self.segments.append(self.segments[-1] + 1)
+                self._open_writer()
+            self.writer.write(HEADER.pack(len(data)))
+            self.writer.write(data)
+            if self.fsync == 'always' or (
+                    self.fsync == 'interval' and
+                    monotonic.monotonic() - self.last_sync >=
+                    self.fsync_interval):
+                self._sync()
+            else:
+                self.writer.flush()
+            return True
+
+    def read(self, count):
+        """Return up to `count` messages that follow the last read.
+
+        The messages are read again after a restart unless `commit()` is
+        called once they have been handed on.
+        """
+        items = []
+        with self.lock:
+            self.writer.flush()
+            if self.positions:
+                segment, offset = self.positions[-1]
+            else:
+                segment, offset = self.cursor
+            while len(items) < count:
+                offset = self._read_segment(segment, offset, count, items)
+                if len(items) >= count or segment == self.segments[-1]:
+                    break
+                segment, offset = segment + 1, 0
+        return [EncodedMessage(None, detail) for detail in items]
+
+    def _read_segment(self, segment, offset, count, items):
+        """Read the records of `segment` from `offset` into `items`, return
+        where reading stopped."""
+        with open(self._segment_path(segment), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return offset
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                while len(items) < count and offset + HEADER.size <= size:
+                    length, = HEADER.unpack_from(data, offset)
+                    end = offset + HEADER.size + length
+                    if end > size:
+                        # a partly written record, eg. after a crash
+                        break
+                    items.append(
+                        data[offset + HEADER.size:end].decode('utf-8'))
+                    self.positions.append((segment, end))
+                    offset = end
+            finally:
+                data.close()
+        return offset
+
+    def commit(self, count=None):
+        """Mark the first `count` messages returned by `read` since the last
+        commit (all of them by default) as consumed. The rest are returned
+        by the next `read` again."""
+        with self.lock:
+            if count is None:
+                count = len(self.positions)
+            if count:
+                self.cursor = self.positions[count - 1]
+            self.positions = []
+            self._write_cursor()
+
+            if self.cursor[0] == self.segments[-1] and \
+                    self.cursor[1] >= self.segment_bytes:
+                # everything is read, carry on in a fresh segment
+                self.segments.append(self.segments[-1] + 1)
+                self._open_writer()
+            if self.cursor[0] < self.segments[-1] and \
+                    self.cursor[1] >= os.path.getsize(
+                        self._segment_path(self.cursor[0])):
+                # the segment is read to its end
+                self.cursor = self.cursor[0] + 1, 0
+                self._write_cursor()
+            self.segments = [s for s in self.segments
+                             if s >= self.cursor[0]]
+            self._remove_read_segments()
+
+    def _write_cursor(self):
+        path = os.path.join(self.path, 'cursor')
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % self.cursor)
+            f.flush()
+            if self.fsync != 'never':
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self._sync()
+                self.writer.close()
+                self.writer = None
+
+
+class SpoolFeeder(Thread):
+    """Moves spooled messages back onto the client's queue whenever it has
+    room, so the consumers drain the spool."""
+    log = logging.getLogger('eventbridge.analytics')
+
+    def __init__(self, spool, queue, interval=0.1):
+        Thread.__init__(self)
+        self.daemon = True
+        self.spool = spool
+        self.queue = queue
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                fed = self.feed()
+            except Exception as e:
+                self.log.exception('error reading spool: %s', e)
+                fed = 0
+            if not fed:
+                self.stopped.wait(self.interval)
+
+    def feed(self):
+        """Move as many messages as fit onto the queue, return how many."""
+        room = self.queue.maxsize - self.queue.qsize()
+        if self.queue.maxsize <= 0:
+            room = 1000
+        if room <= 0:
+            return 0
+        items = self.spool.read(room)
+        fed = 0
+        try:
+            for item in items:
+                self.queue.put(item, block=False)
+                fed += 1
+        except Full:
+            # the client took the room, the rest is read again next time
+            pass
+        if items:
+            self.spool.commit(fed)
+        return fed
+
+    def stop(self):
+        self.stopped.set()
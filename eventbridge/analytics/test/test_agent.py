@@ -0,0 +1,264 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import mock
+
+from eventbridge.analytics.agent import Agent, AgentTransport, MAX_FRAME_SIZE
+from eventbridge.analytics.client import Client
+from eventbridge.analytics.request import EncodedMessage
+from eventbridge.analytics.spool import HEADER
+
+
+def item(i):
+    return EncodedMessage({'type': 'track', 'event': 'python event %d' % i})
+
+
+class TestAgent(unittest.TestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.path = os.path.join(path, 'agent.sock')
+        self.client = Client('testsecret', 'testsecret', send=False)
+        self.agent = Agent(self.path, self.client)
+
+    def start(self):
+        self.agent.start()
+        self.addCleanup(self.agent.stop)
+
+    def received(self, n, timeout=5):
+        deadline = time.time() + timeout
+        while self.client.queue.qsize() < n and time.time() < deadline:
+            time.sleep(0.01)
+        items = []
+        while not self.client.queue.empty():
+            items.append(self.client.queue.get())
+        return items
+
+    def test_receive(self):
+        self.start()
+        transport = AgentTransport(self.path)
+        self.addCleanup(transport.close)
+        self.assertTrue(transport.send([item(0), item(1)]))
+        self.assertTrue(transport.send([item(2)]))
+        items = self.received(3)
+        self.assertEqual([i.detail for i in items],
+                         [item(i).detail for i in range(3)])
+        # received already encoded
+        self.assertIsNone(items[0]._msg)
+        self.assertEqual(
+            self.client.stats()['counters']['agent_received'], 3)
+
+    def test_many_producers(self):
+        self.start()
+        transports = [AgentTransport(self.path) for _ in range(4)]
+        for transport in transports:
+            self.addCleanup(transport.close)
+            for i in range(10):
+                self.assertTrue(transport.send([item(i)]))
+        self.assertEqual(len(self.received(40)), 40)
+
+    def test_stop_reads_pending_messages(self):
+        self.start()
+        transport = AgentTransport(self.path)
+        self.assertTrue(transport.send([item(i) for i in range(100)]))
+        transport.close()
+        self.agent.stop()
+        self.assertEqual(self.client.queue.qsize(), 100)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_oversized_frame(self):
+        self.start()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.connect(self.path)
+        sock.sendall(HEADER.pack(MAX_FRAME_SIZE + 1))
+        # the agent hangs up
+        sock.settimeout(5)
+        self.assertEqual(sock.recv(1), b'')
+        self.assertEqual(
+            self.client.stats()['counters']['agent_bad_frames'], 1)
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        self.start()
+        self.assertTrue(AgentTransport(self.path).send([item(0)]))
+        self.assertEqual(len(self.received(1)), 1)
+
+    def test_already_listening(self):
+        self.start()
+        with self.assertRaises(RuntimeError):
+            Agent(self.path, self.client).start()
+
+
+class TestAgentTransport(unittest.TestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.path = os.path.join(path, 'agent.sock')
+        self.client = Client('testsecret', 'testsecret', send=False)
+
+    def test_unavailable(self):
+        transport = AgentTransport(self.path, retry_interval=60)
+        self.assertFalse(transport.send([item(0)]))
+        agent = Agent(self.path, self.client)
+        agent.start()
+        self.addCleanup(agent.stop)
+        # not retried until `retry_interval` has passed
+        self.assertFalse(transport.send([item(0)]))
+        transport.failed_at -= 60
+        self.assertTrue(transport.send([item(0)]))
+        transport.close()
+
+    def test_agent_restart(self):
+        agent = Agent(self.path, self.client)
+        agent.start()
+        transport = AgentTransport(self.path, retry_interval=0)
+        self.assertTrue(transport.send([item(0)]))
+        agent.stop()
+        for _ in range(10):
+            # the broken connection is only noticed by a later write
+            if not transport.send([item(0)]):
+                break
+        else:
+            self.fail('writes to a stopped agent succeeded')
+        agent = Agent(self.path, self.client)
+        agent.start()
+        self.addCleanup(agent.stop)
+        self.assertTrue(transport.send([item(0)]))
+        transport.close()
+
+    def test_fork(self):
+        agent = Agent(self.path, self.client)
+        agent.start()
+        self.addCleanup(agent.stop)
+        transport = AgentTransport(self.path)
+        self.addCleanup(transport.close)
+        self.assertTrue(transport.send([item(0)]))
+        parent = transport.sock
+        with mock.patch('os.getpid', return_value=transport.pid + 1):
+            self.assertTrue(transport.send([item(1)]))
+        # the child doesn't write to the parent's connection, and closes
+        # its copy of it
+        self.assertIsNot(transport.sock, parent)
+        self.assertEqual(parent.fileno(), -1)
+
+    def test_partial_write(self):
+        transport = AgentTransport(self.path)
+        frame = HEADER.size + len(item(0).detail.encode('utf-8'))
+        transport.sock = sock = mock.Mock()
+        # the connection breaks in the middle of the second frame
+        sock.send.side_effect = [frame + 3, OSError('broken pipe')]
+        self.assertEqual(transport.send([item(i) for i in range(3)]), 1)
+        sock.close.assert_called_once_with()
+        self.assertIsNone(transport.sock)
+
+
+class TestClientAgent(unittest.TestCase):
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.path = os.path.join(path, 'agent.sock')
+        self.upstream = Client('testsecret', 'testsecret', send=False)
+
+    def test_send_to_agent(self):
+        agent = Agent(self.path, self.upstream)
+        agent.start()
+        self.addCleanup(agent.stop)
+        client = Client('testsecret', 'testsecret', agent_socket=self.path,
+                        strict=False)
+        self.assertTrue(client.track('userId', 'python event')[0])
+        results = client.track_many([{'user_id': 'userId',
+                                      'event': 'python event'}] * 3)
+        self.assertTrue(all(success for success, _ in results))
+        self.assertEqual(client.stats()['counters']['agent_sent'], 4)
+        # nothing is uploaded from this process
+        self.assertFalse(client.pool.started)
+        self.assertTrue(client.queue.empty())
+        deadline = time.time() + 5
+        while self.upstream.queue.qsize() < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.upstream.queue.qsize(), 4)
+        client.agent.close()
+        client.shutdown()
+
+    def test_fallback_after_partial_write(self):
+        client = Client('testsecret', 'testsecret', agent_socket=self.path)
+        with mock.patch.object(client.agent, 'send', return_value=1), \
+                mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            results = client.track_many([{'user_id': 'userId',
+                                          'event': 'python event %d' % i}
+                                         for i in range(3)])
+            self.assertTrue(all(success for success, _ in results))
+            client.flush()
+            client.shutdown()
+        # the message written to the agent isn't uploaded again
+        batch = mock_post.call_args[1]['batch']
+        self.assertEqual([item.msg['event'] for item in batch],
+                         ['python event 1', 'python event 2'])
+        self.assertEqual(client.stats()['counters']['agent_sent'], 1)
+
+    def test_fallback(self):
+        client = Client('testsecret', 'testsecret', agent_socket=self.path)
+        self.assertFalse(client.pool.started)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            self.assertTrue(client.track('userId', 'python event')[0])
+            self.assertTrue(client.pool.started)
+            client.flush()
+            self.assertEqual(len(mock_post.call_args[1]['batch']), 1)
+            client.shutdown()
+        self.assertNotIn('agent_sent', client.stats()['counters'])
+
+    def test_spool_left_by_earlier_run(self):
+        agent = Agent(self.path, self.upstream)
+        agent.start()
+        self.addCleanup(agent.stop)
+        spool_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_path)
+        client = Client('testsecret', 'testsecret', spool_path=spool_path,
+                        send=False)
+        # queued but never uploaded, eg. the process is stopping
+        client.send = True
+        for _ in range(3):
+            client.identify('userId')
+        client.join()
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            client = Client('testsecret', 'testsecret', agent_socket=self.path,
+                            spool_path=spool_path)
+            # the agent doesn't read the spool, so this process uploads it
+            self.assertTrue(client.pool.started)
+            client.shutdown()
+        uploaded = sum(len(call[1]['batch'])
+                       for call in mock_post.call_args_list)
+        self.assertEqual(uploaded, 3)
+
+    def test_spool_unused_with_agent(self):
+        agent = Agent(self.path, self.upstream)
+        agent.start()
+        self.addCleanup(agent.stop)
+        spool_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_path)
+        client = Client('testsecret', 'testsecret', agent_socket=self.path,
+                        spool_path=spool_path)
+        self.assertTrue(client.track('userId', 'python event')[0])
+        self.assertFalse(client.pool.started)
+        self.assertFalse(client.spool_feeder.is_alive())
+        client.agent.close()
+        client.shutdown()
+
+    def test_sync_mode_ignores_agent(self):
+        client = Client('testsecret', 'testsecret', agent_socket=self.path,
+                        sync_mode=True)
+        self.assertIsNone(client.agent)
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+import unittest
+import mock
+
+from eventbridge.analytics.async_client import AsyncClient
+from eventbridge.analytics.request import PartialFailureError
+
+
+class TestAsyncClient(unittest.IsolatedAsyncioTestCase):
+
+    def client(self, **kwargs):
+        self.failed = []
+        kwargs.setdefault('on_error',
+                          lambda e, batch: self.failed.append(batch))
+        return AsyncClient(source_id='test_source_id',
+                           event_bus_name='test_bus_name',
+                           access_key='key', secret_access_key='secret',
+                           region_name='eu-west-1', **kwargs)
+
+    async def test_track(self):
+        client = self.client()
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            success, msg = client.track('userId', 'python test event')
+            await client.aclose()
+        self.assertTrue(success)
+        self.assertEqual(msg['event'], 'python test event')
+        self.assertEqual(msg['type'], 'track')
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(self.failed, [])
+
+    async def test_all_methods(self):
+        client = self.client()
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            client.identify('userId', {'trait': 'value'})
+            client.group('userId', 'groupId')
+            client.alias('previousId', 'userId')
+            client.page('userId', name='name')
+            client.screen('userId', name='name')
+            await client.flush()
+            batch = mock_post.call_args[1]['batch']
+            await client.aclose()
+        self.assertEqual([item.msg['type'] for item in batch],
+                         ['identify', 'group', 'alias', 'page', 'screen'])
+
+    async def test_batches(self):
+        client = self.client(upload_interval=0.1)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            for _ in range(25):
+                client.track('userId', 'python test event')
+            await client.flush()
+            await client.aclose()
+        sizes = [len(call[1]['batch']) for call in mock_post.call_args_list]
+        self.assertEqual(sizes, [10, 10, 5])
+
+    async def test_shares_client_setup(self):
+        client = self.client()
+        # set up like every Client, with the optional features off
+        for name in ('sampler', 'agent', 'spool', 'retry_scheduler',
+                     'concurrency', 'rate_limiter'):
+            self.assertIsNone(getattr(client, name))
+        self.assertEqual(client.event_bridge.boto_client.meta.region_name,
+                         'eu-west-1')
+        self.assertEqual(client.stats()['gauges']['queue_depth'], 0)
+
+    async def test_enqueue_many(self):
+        client = self.client()
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            results = client.track_many([
+                {'user_id': 'userId', 'event': 'python test event'},
+                {'event': 'no user'}])
+            results += client.enqueue_many([
+                {'type': 'identify', 'userId': 'userId'}])
+            await client.flush()
+            await client.aclose()
+        self.assertEqual([success for success, _ in results],
+                         [True, False, True])
+        batch = [item for call in mock_post.call_args_list
+                 for item in call[1]['batch']]
+        self.assertEqual([item.msg['type'] for item in batch],
+                         ['track', 'identify'])
+
+    async def test_concurrent_uploads(self):
+        client = self.client(upload_interval=0.1, max_in_flight=3)
+        state = {'in_flight': 0, 'max_in_flight': 0}
+        lock = threading.Lock()
+
+        def mock_post(**kwargs):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'],
+                                             state['in_flight'])
+            time.sleep(0.2)
+            with lock:
+                state['in_flight'] -= 1
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            for _ in range(60):
+                client.track('userId', 'python test event')
+            # the event loop stays responsive while uploading
+            await asyncio.sleep(0.05)
+            await client.aclose()
+        self.assertEqual(state['max_in_flight'], 3)
+
+    async def test_on_error(self):
+        client = self.client(max_retries=0)
+
+        def mock_post(batch):
+            raise PartialFailureError([(0, 'MalformedDetail', 'bad')],
+                                      [batch[0]])
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            client.track('userId', 'first event')
+            client.track('userId', 'second event')
+            await client.aclose()
+        self.assertEqual(len(self.failed), 1)
+        self.assertEqual([msg['event'] for msg in self.failed[0]],
+                         ['first event'])
+
+    async def test_overflow(self):
+        client = self.client(max_queue_size=1)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post'):
+            success, _ = client.identify('userId')
+            self.assertTrue(success)
+            success, _ = client.identify('userId')
+            self.assertFalse(success)
+            await client.aclose()
+
+    async def test_no_send(self):
+        client = self.client(send=False)
+        success, _ = client.identify('userId')
+        self.assertTrue(success)
+        self.assertTrue(client.queue.empty())
+        await client.aclose()
+
+    async def test_context_manager(self):
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            async with self.client() as client:
+                client.track('userId', 'python test event')
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertTrue(client.queue.empty())
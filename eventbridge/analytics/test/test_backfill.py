@@ -0,0 +1,155 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from eventbridge.analytics.backfill import (
+    Backfill, Checkpoint, FailedEvents, format_report, parse_messages,
+    read_lines)
+from eventbridge.analytics.client import Client
+from eventbridge.analytics.request import APIError
+
+
+def event(i):
+    return {'type': 'track', 'userId': 'user-%d' % i,
+            'event': 'python event %d' % i,
+            'timestamp': '2023-01-01T00:00:00Z'}
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.client = Client('testsecret', 'testsecret', send=False)
+        self.sent = []
+
+        def enqueue_many(messages):
+            self.sent.extend(msg['event'] for msg in messages)
+            return [(True, msg) for msg in messages]
+        self.client.enqueue_many = enqueue_many
+
+    def write(self, lines, name='events.jsonl'):
+        path = os.path.join(self.path, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt') as f:
+            for line in lines:
+                f.write(line + '\n')
+        return path
+
+    def test_read_lines(self):
+        path = self.write(['{"a": 1}', '{"b": 2}'])
+        with open(path, 'rb') as f:
+            self.assertEqual(list(read_lines(f)),
+                             [(9, b'{"a": 1}\n'), (18, b'{"b": 2}\n')])
+        with open(path, 'rb') as f:
+            self.assertEqual(list(read_lines(f, 9)), [(18, b'{"b": 2}\n')])
+
+    def test_parse_messages(self):
+        counts = {'read': 0, 'invalid': 0}
+        lines = [(1, b'\n'), (2, b'not json\n'), (3, b'[1]\n'),
+                 (4, json.dumps(event(0)).encode('utf-8'))]
+        messages = list(parse_messages(lines, counts))
+        self.assertEqual([offset for offset, _ in messages], [1, 2, 3, 4])
+        self.assertEqual([msg for _, msg in messages[:3]], [None] * 3)
+        self.assertEqual(messages[3][1]['timestamp'].year, 2023)
+        self.assertEqual(counts, {'read': 1, 'invalid': 2})
+
+    def test_backfill(self):
+        path = self.write([json.dumps(event(i)) for i in range(5)] +
+                          ['not json'])
+        report = Backfill(self.client, path, chunk_size=2).run()
+        self.assertEqual(self.sent, ['python event %d' % i for i in range(5)])
+        self.assertEqual(report['read'], 5)
+        self.assertEqual(report['invalid'], 1)
+        self.assertEqual(report['enqueued'], 5)
+        self.assertEqual(report['offset'], os.path.getsize(path))
+        self.assertIn('enqueued   5', format_report(report))
+
+    def test_gzip(self):
+        path = self.write([json.dumps(event(i)) for i in range(3)],
+                          name='events.jsonl.gz')
+        report = Backfill(self.client, path).run()
+        self.assertEqual(report['enqueued'], 3)
+        self.assertEqual(len(self.sent), 3)
+
+    def test_enqueues_through_client(self):
+        client = Client('testsecret', 'testsecret', send=False)
+        path = self.write([json.dumps(event(0))])
+        report = Backfill(client, path).run()
+        self.assertEqual(report['enqueued'], 1)
+
+    def test_checkpoint_resume(self):
+        lines = [json.dumps(event(i)) for i in range(5)]
+        path = self.write(lines)
+        checkpoint = Checkpoint(os.path.join(self.path, 'checkpoint'))
+        # saved every 2 events, and at the end
+        saved = []
+        save = checkpoint.save
+        checkpoint.save = lambda *args: (saved.append(args[1]), save(*args))
+        Backfill(self.client, path, checkpoint=checkpoint,
+                 checkpoint_interval=2, chunk_size=2).run()
+        line = len(lines[0]) + 1
+        self.assertEqual(saved, [2 * line, 4 * line, 5 * line])
+
+        # resume after the first checkpoint
+        save(path, 2 * line)
+        self.sent = []
+        report = Backfill(self.client, path, checkpoint=checkpoint).run()
+        self.assertEqual(self.sent, ['python event %d' % i
+                                     for i in range(2, 5)])
+        self.assertEqual(report['start_offset'], 2 * line)
+
+    def test_failed_events(self):
+        failed = FailedEvents(os.path.join(self.path, 'failed.jsonl'))
+        client = Client('testsecret', 'testsecret', on_error=failed,
+                        max_retries=0)
+        path = self.write([json.dumps(event(i)) for i in range(3)])
+        error = APIError(3, 'ValidationException', 'bad')
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        side_effect=error):
+            report = Backfill(client, path).run()
+        client.join()
+        self.assertEqual(report['failed'], 3)
+        self.assertEqual(failed.count, 3)
+
+        # the failed events can be backfilled again
+        report = Backfill(self.client, failed.path).run()
+        self.assertEqual(report['invalid'], 0)
+        self.assertEqual(self.sent, ['python event %d' % i
+                                     for i in range(3)])
+
+    def test_checkpoint_other_file(self):
+        checkpoint = Checkpoint(os.path.join(self.path, 'checkpoint'))
+        self.assertEqual(checkpoint.load('events.jsonl'), 0)
+        checkpoint.save('events.jsonl', 10)
+        self.assertEqual(checkpoint.load('events.jsonl'), 10)
+        self.assertRaises(ValueError, checkpoint.load, 'other.jsonl')
+
+    def test_rate(self):
+        path = self.write([json.dumps(event(i)) for i in range(30)])
+        backfill = Backfill(self.client, path, rate=10, chunk_size=10)
+        backfill.sleep = mock.Mock()
+        backfill.run()
+        waits = [call[0][0] for call in backfill.sleep.call_args_list]
+        self.assertEqual(len(waits), 3)
+        # the first second's worth is a burst, the rest is paced
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 1, places=1)
+        self.assertAlmostEqual(waits[2], 2, places=1)
+
+    def test_rate_below_chunk_size(self):
+        path = self.write([json.dumps(event(i)) for i in range(30)])
+        backfill = Backfill(self.client, path, rate=5)
+        self.assertEqual(backfill.chunk_size, 5)
+        backfill.sleep = mock.Mock()
+        backfill.run()
+        waits = [call[0][0] for call in backfill.sleep.call_args_list]
+        # a chunk a second, not the whole file at once
+        self.assertEqual(len(waits), 6)
+        self.assertAlmostEqual(waits[-1], 5, places=1)
+        self.assertEqual(len(self.sent), 30)
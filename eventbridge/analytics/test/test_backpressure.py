@@ -0,0 +1,180 @@
+from threading import Timer
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from eventbridge.analytics.backpressure import Backpressure
+from eventbridge.analytics.request import EncodedMessage
+from eventbridge.analytics.spool import Spool
+
+
+def message(i, type='track'):
+    return EncodedMessage({'type': type, 'event': 'python event %d' % i})
+
+
+def events(q):
+    return [item.msg['event'] for item in list(q.queue)]
+
+
+class TestBackpressure(unittest.TestCase):
+
+    def full_queue(self, size=2):
+        q = Queue(size)
+        for i in range(size):
+            q.put(message(i))
+        return q
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, Backpressure, 'drop_everything')
+        self.assertRaises(ValueError, Backpressure, 'spill')
+
+    def test_room(self):
+        backpressure = Backpressure()
+        q = Queue(1)
+        self.assertTrue(backpressure.put(q, message(0)))
+        self.assertEqual(backpressure.stats()['enqueued'], 1)
+
+    def test_put_many(self):
+        backpressure = Backpressure('drop_oldest')
+        q = Queue(3)
+        q.put(message(0))
+        kept = backpressure.put_many(q, [message(i) for i in range(1, 5)])
+        self.assertEqual(kept, [True, True, True, True])
+        self.assertEqual(events(q), ['python event 2', 'python event 3',
+                                     'python event 4'])
+        stats = backpressure.stats()
+        self.assertEqual(stats['enqueued'], 4)
+        self.assertEqual(stats['dropped_oldest'], 2)
+        self.assertEqual(q.unfinished_tasks, 3)
+
+    def test_drop_newest(self):
+        backpressure = Backpressure('drop_newest')
+        q = self.full_queue()
+        self.assertFalse(backpressure.put(q, message(2)))
+        self.assertEqual(events(q), ['python event 0', 'python event 1'])
+        self.assertEqual(backpressure.stats()['dropped_newest'], 1)
+
+    def test_drop_oldest(self):
+        backpressure = Backpressure('drop_oldest')
+        q = self.full_queue()
+        self.assertTrue(backpressure.put(q, message(2)))
+        self.assertEqual(events(q), ['python event 1', 'python event 2'])
+        stats = backpressure.stats()
+        self.assertEqual(stats['dropped_oldest'], 1)
+        self.assertEqual(stats['enqueued'], 1)
+        # the dropped message no longer holds up `join`
+        q.get()
+        q.task_done()
+        q.get()
+        q.task_done()
+        q.join()
+
+    def test_drop_oldest_keeps_high_value(self):
+        backpressure = Backpressure('drop_oldest')
+        q = Queue(2)
+        q.put(message(0, type='identify'))
+        q.put(message(1))
+        self.assertTrue(backpressure.put(q, message(2)))
+        self.assertTrue(backpressure.put(q, message(3)))
+        self.assertEqual(events(q), ['python event 0', 'python event 3'])
+        self.assertEqual(q.unfinished_tasks, 2)
+        # when only high-value messages are queued the new one is dropped
+        q = Queue(1)
+        q.put({'type': 'alias', 'event': 'python event 0'})
+        self.assertFalse(backpressure.put(q, message(1)))
+        self.assertEqual(q.queue[0]['type'], 'alias')
+        self.assertEqual(backpressure.stats()['dropped_newest'], 1)
+
+    def test_drop_oldest_does_not_decode_queue(self):
+        backpressure = Backpressure('drop_oldest')
+        q = Queue(100)
+        for i in range(100):
+            item = message(i, type='identify')
+            # only the encoded form is kept while queued
+            item.release()
+            q.put(item)
+        with mock.patch('json.loads') as loads:
+            self.assertFalse(backpressure.put(q, message(100)))
+            self.assertFalse(backpressure.put(q, message(101)))
+        self.assertFalse(loads.called)
+        # messages read back from a spool or an agent are decoded once
+        q = Queue(1)
+        q.put(EncodedMessage(None, message(0, type='identify').detail))
+        for i in range(2):
+            self.assertFalse(backpressure.put(q, message(1)))
+        self.assertEqual(q.queue[0].kind, ('identify', None))
+
+    def test_block_times_out(self):
+        backpressure = Backpressure('block', timeout=0.05)
+        q = self.full_queue()
+        self.assertFalse(backpressure.put(q, message(2)))
+        stats = backpressure.stats()
+        self.assertEqual(stats['blocked'], 1)
+        self.assertEqual(stats['timed_out'], 1)
+
+    def test_block_until_room(self):
+        backpressure = Backpressure('block', timeout=5)
+        q = self.full_queue()
+        timer = Timer(0.05, q.get)
+        timer.start()
+        self.assertTrue(backpressure.put(q, message(2)))
+        timer.join()
+        self.assertEqual(backpressure.stats()['timed_out'], 0)
+
+    def test_sample(self):
+        backpressure = Backpressure('sample', sample_rates={
+            'python event 3': 1.0})
+        q = self.full_queue()
+        self.assertTrue(backpressure.put(q, message(2, type='identify')))
+        self.assertFalse(backpressure.put(q, message(4)))
+        self.assertTrue(backpressure.put(q, message(3)))
+        self.assertEqual(events(q), ['python event 2', 'python event 3'])
+        stats = backpressure.stats()
+        self.assertEqual(stats['sampled_out'], 1)
+        self.assertEqual(stats['dropped_oldest'], 2)
+
+    def test_sample_keeps_high_value(self):
+        backpressure = Backpressure('sample', sample_rates={'track': 1.0,
+                                                            'page': 0.0})
+        q = Queue(2)
+        q.put(message(0, type='group'))
+        q.put(message(1, type='page'))
+        self.assertTrue(backpressure.put(q, message(2)))
+        self.assertEqual([item.msg['type'] for item in q.queue],
+                         ['group', 'track'])
+        # the track event is always kept as well
+        self.assertFalse(backpressure.put(q, message(3)))
+
+    def test_rate(self):
+        backpressure = Backpressure('sample', sample_rates={
+            'page': 0.5, 'Order Completed': 0.9})
+        self.assertEqual(backpressure.rate({'type': 'alias'}), 1.0)
+        self.assertEqual(backpressure.rate({'type': 'page'}), 0.5)
+        self.assertEqual(backpressure.rate({'type': 'screen'}), 0.0)
+        self.assertEqual(backpressure.rate(
+            {'type': 'track', 'event': 'Order Completed'}), 0.9)
+        self.assertEqual(backpressure.rate(
+            {'type': 'track', 'event': 'Clicked'}), 0.0)
+
+    def test_spill(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spool = Spool(path)
+        self.addCleanup(spool.close)
+        backpressure = Backpressure('spill', spool=spool)
+        q = self.full_queue()
+        self.assertTrue(backpressure.put(q, message(2)))
+        self.assertEqual([item.msg['event'] for item in spool.read(10)],
+                         ['python event 2'])
+        self.assertEqual(backpressure.stats()['spilled'], 1)
+
+        spool.close()
+        self.assertFalse(backpressure.put(q, message(3)))
+        self.assertEqual(backpressure.stats()['spill_failed'], 1)
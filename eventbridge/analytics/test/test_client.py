@@ -1,4 +1,9 @@
 from datetime import date, datetime
+from decimal import Decimal
+import os
+import shutil
+import signal
+import tempfile
 import unittest
 import time
 import mock
@@ -7,7 +12,8 @@ import boto3
 import json
 
 from eventbridge.analytics.version import VERSION
-from eventbridge.analytics.client import Client
+from eventbridge.analytics.client import Client, LIBRARY
+from eventbridge.analytics.request import APIError, PartialFailureError
 
 
 @mock_iam
@@ -61,6 +67,11 @@ class test_client(unittest.TestCase):
                              region_name=self._region_name,
                              on_error=self.mark_fail)
 
+    def tearDown(self):
+        # Deliver anything still queued while the AWS mocks are active, so
+        # that no consumer keeps retrying into later tests.
+        self.client.shutdown()
+
     def test_requires_write_key(self):
         self.assertRaises(AssertionError, Client)
 
@@ -130,6 +141,65 @@ class test_client(unittest.TestCase):
         self.assertEqual(msg['userId'], 'userId')
         self.assertEqual(msg['type'], 'track')
 
+    def test_queued_msg_is_encoded_only(self):
+        client = self.client
+        client.join()
+        success, msg = client.track('userId', 'python test event')
+        item = client.queue.get()
+        client.queue.task_done()
+        self.assertIsNone(item._msg)
+        self.assertEqual(item.msg['messageId'], msg['messageId'])
+
+    def test_enqueue_many(self):
+        client = self.client
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            results = client.enqueue_many([
+                {'type': 'track', 'userId': 'userId', 'event': 'first'},
+                {'type': 'track', 'userId': 'userId'},
+                {'type': 'identify', 'anonymousId': 'anonymousId',
+                 'traits': {'trait': 'value'}},
+                {'type': 'alias', 'previousId': 'previousId'},
+            ])
+            client.flush()
+        self.assertEqual([success for success, _ in results],
+                         [True, False, True, False])
+        msg = results[0][1]
+        self.assertEqual(msg['event'], 'first')
+        self.assertTrue(isinstance(msg['timestamp'], str))
+        self.assertTrue(isinstance(msg['messageId'], str))
+        sent = [item.msg for call in mock_post.call_args_list
+                for item in call[1]['batch']]
+        self.assertEqual([m['type'] for m in sent], ['track', 'identify'])
+
+    def test_track_many(self):
+        client = self.client
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            results = client.track_many(
+                {'user_id': 'userId', 'event': 'python event %d' % i,
+                 'properties': {'index': i}}
+                for i in range(1200))
+            client.flush()
+        self.assertTrue(all(success for success, _ in results))
+        sent = [item.msg for call in mock_post.call_args_list
+                for item in call[1]['batch']]
+        self.assertEqual(sorted(m['properties']['index'] for m in sent),
+                         list(range(1200)))
+
+    def test_track_many_overflow(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        max_queue_size=3)
+        client.join()
+        results = client.track_many({'user_id': 'userId', 'event': 'event'}
+                                    for _ in range(5))
+        self.assertEqual([success for success, _ in results],
+                         [True, True, True, False, False])
+
     def test_basic_identify(self):
         client = self.client
         success, msg = client.identify('userId', {'trait': 'value'})
@@ -302,6 +372,88 @@ class test_client(unittest.TestCase):
         for consumer in client.consumers:
             self.assertFalse(consumer.is_alive())
 
+    def test_adaptive_concurrency(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        region_name=self._region_name, send=False,
+                        thread=2, max_in_flight=3, adaptive_concurrency=True)
+        self.assertEqual(client.concurrency.max_limit, 6)
+        for consumer in client.consumers:
+            self.assertIs(consumer.concurrency, client.concurrency)
+        gauges = client.stats()['gauges']
+        self.assertEqual(gauges['concurrency_limit'], 6)
+        self.assertIsNone(gauges['upload_rate'])
+        self.assertIsNone(self.client.concurrency)
+
+    def test_shared_upload_rate(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        region_name=self._region_name, send=False,
+                        shared_upload_rate=50,
+                        shared_upload_rate_path=os.path.join(path, 'rate'))
+        self.addCleanup(client.rate_limiter.close)
+        for consumer in client.consumers:
+            self.assertIs(consumer.rate_limiter, client.rate_limiter)
+        self.assertEqual(client.rate_limiter.stats()['rate'], 50)
+        self.assertIsNone(self.client.rate_limiter)
+
+    def test_sampling_rules(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        region_name=self._region_name, send=False,
+                        sampling_rules=[{'event': 'Heartbeat', 'rate': 0},
+                                        {'type': 'page', 'limit': 1}])
+        with mock.patch.object(client, '_prepare',
+                               wraps=client._prepare) as prepare:
+            success, msg = client.track('userId', 'Heartbeat')
+            self.assertFalse(success)
+            self.assertEqual(msg['event'], 'Heartbeat')
+            # dropped before it is validated or encoded
+            self.assertFalse(prepare.called)
+            self.assertTrue(client.track('userId', 'Clicked')[0])
+            self.assertTrue(client.page('userId')[0])
+            self.assertFalse(client.page('userId')[0])
+        self.assertEqual(prepare.call_count, 2)
+        results = client.track_many([{'user_id': 'userId',
+                                      'event': 'Heartbeat'}])
+        self.assertFalse(results[0][0])
+        counters = client.stats()['counters']
+        self.assertEqual(counters['dropped_sampled'], 2)
+        self.assertEqual(counters['dropped_rate_limited'], 1)
+
+    def test_multiple_consumers(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        thread=3)
+        self.assertEqual(len(client.consumers), 3)
+        for _ in range(100):
+            client.identify('userId', {'trait': 'value'})
+        client.shutdown()
+        self.assertTrue(client.queue.empty())
+        for consumer in client.consumers:
+            self.assertFalse(consumer.is_alive())
+        stats = client.pool.stats()
+        self.assertEqual(
+            sum(c['messages'] for c in stats['consumers']), 100)
+
+        stats = client.stats()
+        self.assertEqual(stats['counters']['enqueued'], 100)
+        self.assertEqual(stats['counters']['entries_delivered'], 100)
+        self.assertEqual(stats['gauges']['queue_depth'], 0)
+        self.assertEqual(stats['gauges']['workers'], 0)
+        self.assertEqual(stats['gauges']['retry_pending'], 0)
+        for consumer in client.consumers:
+            self.assertIs(consumer.retry_scheduler, client.retry_scheduler)
+        histograms = stats['histograms']
+        self.assertEqual(histograms['batch_entries']['sum'], 100)
+        self.assertEqual(histograms['put_events_latency']['count'],
+                         stats['counters']['batches_sent'])
+
     def test_synchronous(self):
         client = Client(source_id=self._source_id,
                         event_bus_name=self._bus_name,
@@ -315,6 +467,25 @@ class test_client(unittest.TestCase):
         self.assertTrue(client.queue.empty())
         self.assertTrue(success)
 
+    def test_synchronous_enqueue_many(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        region_name=self._region_name,
+                        sync_mode=True)
+        errors = [None, APIError(1, 'ThrottlingException', 'slow down'),
+                  PartialFailureError([(0, 'ValidationException', 'bad')],
+                                      [None]),
+                  None]
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        side_effect=errors) as mock_post:
+            results = client.track_many(
+                [{'user_id': 'userId', 'event': 'python event %d' % i}
+                 for i in range(4)] + [{'event': 'no user'}])
+        self.assertEqual(mock_post.call_count, 4)
+        self.assertEqual([success for success, _ in results],
+                         [True, False, False, True, False])
+        self.assertEqual(results[1][1]['event'], 'python event 1')
+
     def test_overflow(self):
         client = Client(source_id=self._source_id,
                         event_bus_name=self._bus_name,
@@ -331,6 +502,168 @@ class test_client(unittest.TestCase):
         success, _ = client.identify('userId')
         # Make sure we are informed that the queue is at capacity
         self.assertFalse(success)
+        self.assertEqual(client.backpressure.stats()['dropped_newest'], 10)
+
+    def test_overflow_drop_oldest(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        max_queue_size=1, backpressure='drop_oldest')
+        client.join()
+
+        client.track('userId', 'first')
+        success, _ = client.track('userId', 'second')
+        self.assertTrue(success)
+        self.assertEqual(client.queue.get().msg['event'], 'second')
+
+    def test_overflow_to_spool(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        max_queue_size=1, spool_path=path)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            for _ in range(20):
+                success, _ = client.identify('userId')
+                self.assertTrue(success)
+            client.shutdown()
+        uploaded = sum(len(call[1]['batch'])
+                       for call in mock_post.call_args_list)
+        self.assertEqual(uploaded, 20)
+        self.assertTrue(client.spool.empty())
+
+    def test_spool_survives_restart(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        spool_path=path, send=False)
+        # queued but never uploaded, eg. the process is stopping
+        client.send = True
+        for _ in range(5):
+            client.identify('userId')
+        client.join()
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            client = Client(source_id=self._source_id,
+                            event_bus_name=self._bus_name,
+                            access_key=self.user["AccessKeyId"],
+                            secret_access_key=self.user["SecretAccessKey"],
+                            region_name=self._region_name,
+                            spool_path=path)
+            client.shutdown()
+        uploaded = sum(len(call[1]['batch'])
+                       for call in mock_post.call_args_list)
+        self.assertEqual(uploaded, 5)
+
+    def test_fast_path(self):
+        errors = []
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        on_error=lambda e, msgs: errors.extend(msgs),
+                        strict=False)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            success, msg = client.track('userId', 'python event',
+                                        {'date': date(2014, 9, 3)})
+            self.assertTrue(success)
+            # invalid, but only found out by the consumer
+            success, _ = client.track('userId', 'python event',
+                                      timestamp='yesterday')
+            self.assertTrue(success)
+            client.shutdown()
+
+        batches = [call[1]['batch'] for call in mock_post.call_args_list]
+        sent = [json.loads(item.detail) for batch in batches
+                for item in batch]
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0]['properties'], {'date': '2014-09-03'})
+        self.assertEqual(sent[0]['context']['library']['version'], VERSION)
+        self.assertTrue(sent[0]['messageId'])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]['timestamp'], 'yesterday')
+
+    def test_library_is_not_shared(self):
+        _, msg = self.client.track('userId', 'python event')
+        msg['context']['library']['name'] = 'changed'
+        _, msg = self.client.track('userId', 'python event')
+        self.assertEqual(msg['context']['library'],
+                         {'name': 'eventbridge-analytics-python',
+                          'version': VERSION})
+        with self.assertRaises(TypeError):
+            LIBRARY['name'] = 'changed'
+
+    def test_fast_path_copies_caller_dicts(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        region_name=self._region_name, strict=False)
+        queued = []
+        properties = {'plan': 'free'}
+        context = {'ip': '127.0.0.1'}
+        msg = {'type': 'track', 'userId': 'userId', 'event': 'python event',
+               'properties': properties, 'context': context}
+        backpressure = client.backpressure
+        with mock.patch.object(backpressure, 'put',
+                               side_effect=lambda q, item, prepare:
+                               queued.append(item) or True), \
+                mock.patch.object(backpressure, 'put_many',
+                                  side_effect=lambda q, items, prepare:
+                                  queued.extend(items) or [True]):
+            client.track('userId', 'python event', properties,
+                         context=context)
+            client.enqueue_many([msg])
+        self.assertEqual(len(queued), 2)
+        # the caller reuses its dicts once the calls return
+        properties['plan'] = 'paid'
+        context.clear()
+        msg['event'] = 'changed'
+        for item in queued:
+            self.assertEqual(item['properties'], {'plan': 'free'})
+            self.assertEqual(item['context'], {'ip': '127.0.0.1'})
+            self.assertEqual(item['event'], 'python event')
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'requires fork')
+    def test_fork(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post') \
+                as mock_post:
+            client.track('userId', 'python event')
+            client.flush()
+            pid = os.fork()
+            if pid == 0:
+                # the child must get consumers of its own
+                status = 1
+                try:
+                    signal.alarm(10)
+                    mock_post.reset_mock()
+                    client.track('userId', 'python event')
+                    client.flush()
+                    uploaded = sum(len(call[1]['batch'])
+                                   for call in mock_post.call_args_list)
+                    if uploaded == 1 and client.pool.workers():
+                        status = 0
+                finally:
+                    os._exit(status)
+            _, status = os.waitpid(pid, 0)
+            self.assertEqual(os.WEXITSTATUS(status), 0)
+            client.shutdown()
 
     def test_numeric_user_id(self):
         self.client.track(1234, 'python event')
@@ -351,6 +684,34 @@ class test_client(unittest.TestCase):
 
         self.assertEqual(msg['traits'], {'birthdate': date(1981, 2, 2)})
 
+    def test_unserializable_property_is_cleaned(self):
+        client = self.client
+        success, msg = client.track(
+            'userId', 'python test event', {'fn': lambda x: x, 'number': 4})
+        client.flush()
+        self.assertTrue(success)
+        self.assertFalse(self.failed)
+        self.assertEqual(msg['properties'], {'number': 4})
+
+    def test_serializer(self):
+        client = Client(source_id=self._source_id,
+                        event_bus_name=self._bus_name,
+                        access_key=self.user["AccessKeyId"],
+                        secret_access_key=self.user["SecretAccessKey"],
+                        region_name=self._region_name,
+                        on_error=self.mark_fail,
+                        serializer='auto')
+        success, msg = client.track(
+            'userId', 'python test event', {'price': Decimal('1.5'),
+                                            'created': datetime.now(),
+                                            'ratio': float('nan'),
+                                            'large': 2 ** 70})
+        client.flush()
+        self.assertTrue(success)
+        self.assertFalse(self.failed)
+        # values are only converted in the encoded message
+        self.assertEqual(msg['properties']['price'], Decimal('1.5'))
+
     def test_user_defined_upload_size(self):
         client = Client(source_id=self._source_id,
                         event_bus_name=self._bus_name,
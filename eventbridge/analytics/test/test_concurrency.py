@@ -0,0 +1,104 @@
+import threading
+import unittest
+
+import mock
+
+from eventbridge.analytics.concurrency import AdaptiveConcurrency
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('monotonic.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def concurrency(self, *args, **kwargs):
+        concurrency = AdaptiveConcurrency(*args, **kwargs)
+        concurrency.sleep = mock.Mock()
+        return concurrency
+
+    def upload(self, concurrency, latency=0.1, throttled=False):
+        concurrency.acquire()
+        self.now += latency
+        concurrency.release(latency, throttled)
+
+    def test_invalid_limits(self):
+        self.assertRaises(ValueError, AdaptiveConcurrency, 0)
+        self.assertRaises(ValueError, AdaptiveConcurrency, 2, min_limit=3)
+
+    def test_throttling_decreases_limit(self):
+        concurrency = self.concurrency(8, decrease=0.5)
+        self.upload(concurrency)
+        self.upload(concurrency, throttled=True)
+        self.assertEqual(concurrency.stats()['limit'], 4)
+        # throttling within one upload latency counts once
+        self.upload(concurrency, latency=0.01, throttled=True)
+        self.assertEqual(concurrency.stats()['limit'], 4)
+        self.upload(concurrency, throttled=True)
+        self.assertEqual(concurrency.stats()['limit'], 2)
+        self.upload(concurrency, latency=0.2, throttled=True)
+        self.upload(concurrency, latency=0.2, throttled=True)
+        self.assertEqual(concurrency.stats()['limit'], 1)
+        self.assertEqual(concurrency.metrics.counter('concurrency_decreases'),
+                         4)
+
+    def test_additive_increase(self):
+        concurrency = self.concurrency(8, decrease=0.5)
+        self.upload(concurrency, throttled=True)
+        self.assertEqual(concurrency.stats()['limit'], 4)
+        # about one more per round of `limit` uploads
+        for _ in range(4):
+            self.upload(concurrency)
+        self.assertAlmostEqual(concurrency.stats()['limit'], 4.9, places=1)
+        for _ in range(100):
+            self.upload(concurrency)
+        self.assertEqual(concurrency.stats()['limit'], 8)
+
+    def test_latency_decreases_limit(self):
+        concurrency = self.concurrency(8, latency_decrease=0.5)
+        self.upload(concurrency, latency=0.1)
+        for _ in range(5):
+            self.upload(concurrency, latency=1.0)
+        self.assertLess(concurrency.stats()['limit'], 8)
+        # the baseline only drifts up slowly
+        self.assertLess(concurrency.stats()['baseline'], 0.2)
+
+    def test_limit_blocks_uploads(self):
+        concurrency = self.concurrency(1)
+        concurrency.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            concurrency.acquire()
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        concurrency.release(0.1)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+    def test_rate(self):
+        concurrency = self.concurrency(32, decrease=0.5, rate_increase=1.0)
+        self.assertIsNone(concurrency.stats()['rate'])
+        # 20 uploads started in the last second, then throttled
+        for _ in range(20):
+            concurrency.acquire()
+        for _ in range(20):
+            concurrency.release(0.1)
+        self.now += 0.1
+        concurrency.acquire()
+        concurrency.release(0.1, throttled=True)
+        self.assertEqual(concurrency.stats()['rate'], 10.5)
+        self.assertEqual(concurrency.metrics.counter('rate_decreases'), 1)
+        # one upload latency later the rate has grown by one
+        self.now += 0.1
+        concurrency.acquire()
+        concurrency.release(0.1)
+        self.assertAlmostEqual(concurrency.stats()['rate'], 11.5)
+        # uploads beyond the rate wait
+        concurrency.acquire()
+        concurrency.acquire()
+        self.assertTrue(concurrency.sleep.called)
@@ -1,7 +1,9 @@
 import unittest
+import threading
 import mock
 import time
 import json
+import monotonic
 from moto import mock_iam, mock_events
 import boto3
 
@@ -10,8 +12,11 @@ try:
 except ImportError:
     from Queue import Queue
 
-from eventbridge.analytics.consumer import Consumer, MAX_MSG_SIZE
-from eventbridge.analytics.request import EventBridge, APIError
+from eventbridge.analytics.consumer import (
+    Consumer, Linger, MAX_MSG_SIZE, BATCH_SIZE_LIMIT)
+from eventbridge.analytics.request import (
+    EventBridge, APIError, EncodedMessage, PartialFailureError)
+from eventbridge.analytics.retry import RetryScheduler
 
 
 @mock_iam
@@ -66,7 +71,7 @@ class TestConsumer(unittest.TestCase):
         consumer = Consumer(q, self._event_bridge_client)
         q.put(1)
         next = consumer.next()
-        self.assertEqual(next, [1])
+        self.assertEqual([item.msg for item in next], [1])
 
     def test_next_limit(self):
         q = Queue()
@@ -75,7 +80,69 @@ class TestConsumer(unittest.TestCase):
         for i in range(10000):
             q.put(i)
         next = consumer.next()
-        self.assertEqual(next, list(range(upload_size)))
+        self.assertEqual([item.msg for item in next], list(range(upload_size)))
+
+    def test_next_upload_size(self):
+        q = Queue()
+        consumer = Consumer(q, self._event_bridge_client, upload_size=3)
+        for i in range(10):
+            q.put(i)
+        next = consumer.next()
+        self.assertEqual([item.msg for item in next], [0, 1, 2])
+
+    def test_linger(self):
+        linger = Linger(max_latency=0.5)
+        # nothing known about the traffic yet
+        self.assertEqual(linger.linger(10, 0), 0.5)
+        # the batch can be filled from the queue right away
+        self.assertEqual(linger.linger(10, 10), 0.0)
+        # 100 items per second fill the 5 missing items in 50ms
+        linger.observe(100, 1.0)
+        self.assertAlmostEqual(linger.linger(10, 5), 0.05)
+        # sparse traffic waits up to the latency target
+        linger = Linger(max_latency=0.5)
+        linger.observe(1, 1.0)
+        self.assertEqual(linger.linger(10, 0), 0.5)
+
+    def test_linger_max_upload_rate(self):
+        linger = Linger(max_latency=0.5, max_upload_rate=5)
+        self.assertEqual(linger.linger(10, 10), 0.2)
+        linger.observe(1000, 1.0)
+        self.assertEqual(linger.linger(10, 0), 0.2)
+
+    def test_max_upload_rate_with_deep_queue(self):
+        for max_in_flight in (1, 4):
+            q = Queue()
+            for i in range(5000):
+                q.put({'event': 'python event %d' % i})
+            consumer = Consumer(q, self._event_bridge_client,
+                                max_upload_rate=5,
+                                max_in_flight=max_in_flight)
+            calls = []
+            post = mock.Mock(side_effect=lambda batch: calls.append(
+                monotonic.monotonic()))
+            with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                            post):
+                consumer.start()
+                time.sleep(1.0)
+                consumer.pause()
+                consumer.join()
+            # one upload straight away, then one every 0.2s
+            self.assertLessEqual(len(calls), 7)
+            self.assertGreaterEqual(len(calls), 4)
+            gaps = [b - a for a, b in zip(calls, calls[1:])]
+            self.assertGreater(min(gaps), 0.15)
+
+    def test_fill_ratio(self):
+        q = Queue()
+        consumer = Consumer(q, self._event_bridge_client,
+                            upload_interval=0.1)
+        for i in range(5):
+            q.put(i)
+        consumer.next()
+        stats = consumer.stats()
+        self.assertEqual(stats['fill_ratio'], 0.5)
+        self.assertGreater(stats['size_fill_ratio'], 0)
 
     def test_dropping_oversize_msg(self):
         q = Queue()
@@ -86,6 +153,35 @@ class TestConsumer(unittest.TestCase):
         self.assertEqual(next, [])
         self.assertTrue(q.empty())
 
+    def test_next_reuses_encoded_msg(self):
+        q = Queue()
+        consumer = Consumer(q, self._event_bridge_client)
+        encoded = EncodedMessage({'type': 'track', 'event': 'python event'})
+        q.put(encoded)
+        next = consumer.next()
+        self.assertIs(next[0], encoded)
+
+    def test_next_drops_invalid_msg(self):
+        q = Queue()
+        errors = []
+
+        def prepare(item):
+            if item == 1:
+                raise AssertionError('invalid')
+            return EncodedMessage(item)
+
+        consumer = Consumer(q, self._event_bridge_client, prepare=prepare,
+                            on_error=lambda e, msgs: errors.extend(msgs),
+                            upload_interval=0.1)
+        for i in range(3):
+            q.put(i)
+        next = consumer.next()
+        self.assertEqual([item.msg for item in next], [0, 2])
+        self.assertEqual(errors, [1])
+        for _ in next:
+            q.task_done()
+        q.join()
+
     def test_upload(self):
         q = Queue()
         consumer = Consumer(q, self._event_bridge_client)
@@ -144,6 +240,35 @@ class TestConsumer(unittest.TestCase):
             time.sleep(upload_interval * 1.1)
             self.assertEqual(mock_post.call_count, 2)
 
+    def test_concurrent_uploads(self):
+        q = Queue()
+        consumer = Consumer(q, self._event_bridge_client, upload_size=10,
+                            upload_interval=0.1, max_in_flight=3)
+        state = {'in_flight': 0, 'max_in_flight': 0, 'calls': 0}
+        lock = threading.Lock()
+
+        def mock_post(*args, **kwargs):
+            with lock:
+                state['calls'] += 1
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'],
+                                             state['in_flight'])
+            time.sleep(0.2)
+            with lock:
+                state['in_flight'] -= 1
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            for i in range(60):
+                q.put({'type': 'track', 'event': 'python event %d' % i})
+            consumer.start()
+            q.join()
+            consumer.pause()
+            consumer.join()
+
+        self.assertEqual(state['calls'], 6)
+        self.assertEqual(state['max_in_flight'], 3)
+
     def test_request(self):
         consumer = Consumer(None, self._event_bridge_client)
         track = {
@@ -221,6 +346,212 @@ class TestConsumer(unittest.TestCase):
         self._test_request_retry(consumer, APIError(
             3, '500', 'Internal Server Error'), 3)
 
+    def test_request_retries_failed_entries_only(self):
+        consumer = Consumer(None, self._event_bridge_client)
+        batch = [{'event': 'python event %d' % i} for i in range(3)]
+        calls = []
+
+        def mock_post(batch):
+            calls.append([item['event'] for item in batch])
+            if len(calls) == 1:
+                raise PartialFailureError(
+                    [(1, 'ThrottlingException', 'Rate exceeded')], [batch[1]])
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            consumer.request(batch)
+        self.assertEqual(calls, [
+            ['python event 0', 'python event 1', 'python event 2'],
+            ['python event 1'],
+        ])
+
+    def test_request_reports_rejected_entries(self):
+        consumer = Consumer(None, self._event_bridge_client, retries=2)
+        batch = [{'event': 'python event %d' % i} for i in range(3)]
+        calls = []
+
+        def mock_post(batch):
+            calls.append([item['event'] for item in batch])
+            if len(calls) == 1:
+                raise PartialFailureError(
+                    [(0, 'MalformedDetail', 'bad'),
+                     (2, 'InternalFailure', 'oops')], [batch[0], batch[2]])
+            raise PartialFailureError(
+                [(0, 'InternalFailure', 'oops')], [batch[0]])
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            with self.assertRaises(PartialFailureError) as cm:
+                consumer.request(batch)
+        # the malformed entry is never retried, the failing one is retried
+        # until the retries are exhausted
+        self.assertEqual(calls, [
+            ['python event 0', 'python event 1', 'python event 2'],
+            ['python event 2'], ['python event 2'],
+        ])
+        self.assertEqual(cm.exception.failures, [
+            (0, 'MalformedDetail', 'bad'), (2, 'InternalFailure', 'oops')])
+        self.assertEqual(cm.exception.entries, [batch[0], batch[2]])
+
+    def test_on_error_receives_failed_entries(self):
+        q = Queue()
+        errors = []
+        consumer = Consumer(q, self._event_bridge_client,
+                            on_error=lambda e, batch: errors.append(batch))
+        batch = [{'event': 'python event %d' % i} for i in range(3)]
+
+        def mock_post(batch):
+            raise PartialFailureError(
+                [(1, 'MalformedDetail', 'bad')], [batch[1]])
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            for item in batch:
+                q.put(item)
+            self.assertFalse(consumer.upload())
+        self.assertEqual(errors, [[batch[1]]])
+        self.assertEqual(consumer.stats()['messages'], 2)
+        self.assertEqual(consumer.stats()['failed'], 1)
+        counters = consumer.metrics.stats()['counters']
+        self.assertEqual(counters['failed_entries.MalformedDetail'], 1)
+        self.assertEqual(counters['entries_delivered'], 2)
+        self.assertEqual(counters['batches_sent'], 1)
+
+    def test_request_retries_throttling(self):
+        consumer = Consumer(None, self._event_bridge_client)
+        self._test_request_retry(consumer, APIError(
+            1, 'ThrottlingException', 'Rate exceeded'), 2)
+        self.assertEqual(consumer.metrics.counter('retries'), 2)
+        self.assertEqual(consumer.metrics.stats()['histograms'][
+            'put_events_latency']['count'], 3)
+
+    def test_send_schedules_retry(self):
+        q = Queue()
+        errors = []
+        exceptions = []
+
+        def on_error(e, batch):
+            exceptions.append(e)
+            errors.append(batch)
+
+        scheduler = RetryScheduler()
+        consumer = Consumer(q, self._event_bridge_client, on_error=on_error,
+                            retry_scheduler=scheduler)
+        batch = [{'event': 'python event %d' % i} for i in range(3)]
+
+        def mock_post(batch):
+            raise PartialFailureError(
+                [(0, 'ThrottlingException', 'Rate exceeded'),
+                 (1, 'MalformedDetail', 'bad')], batch[:2])
+
+        for item in batch:
+            q.put(item)
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            self.assertFalse(consumer.upload())
+        # the throttled entry waits for its retry, still unacknowledged
+        self.assertEqual(errors, [[batch[1]]])
+        # the error is the one of the entry given up on, not the retried one
+        self.assertEqual(exceptions[0].code, 'MalformedDetail')
+        self.assertEqual(exceptions[0].failures, [(1, 'MalformedDetail',
+                                                   'bad')])
+        self.assertEqual(scheduler.stats(), {'batches': 1, 'items': 1})
+        self.assertEqual(q.unfinished_tasks, 1)
+        self.assertEqual(consumer.metrics.counter('entries_delivered'), 1)
+        self.assertEqual(scheduler.metrics.counter('retries'), 1)
+
+    def test_retry_does_not_block_fresh_batches(self):
+        q = Queue()
+        scheduler = RetryScheduler(base_delay=0.4)
+        consumer = Consumer(q, self._event_bridge_client,
+                            upload_interval=0.05, retry_scheduler=scheduler)
+        calls = []
+
+        def mock_post(batch):
+            calls.append([item.msg['event'] for item in batch])
+            if len(calls) == 1:
+                raise APIError(1, 'ThrottlingException', 'Rate exceeded')
+
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        mock.Mock(side_effect=mock_post)):
+            consumer.start()
+            q.put({'event': 'first'})
+            time.sleep(0.1)
+            q.put({'event': 'second'})
+            q.join()
+            consumer.pause()
+            consumer.join()
+        self.assertEqual(calls, [['first'], ['second'], ['first']])
+
+    def test_retry_gives_up(self):
+        q = Queue()
+        errors = []
+        consumer = Consumer(q, self._event_bridge_client, retries=2,
+                            upload_interval=0.05,
+                            on_error=lambda e, batch: errors.append(batch),
+                            retry_scheduler=RetryScheduler(base_delay=0.01))
+        post = mock.Mock(side_effect=APIError(1, '500', 'Internal Error'))
+        with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                        post):
+            consumer.start()
+            q.put({'event': 'python event'})
+            q.join()
+            consumer.pause()
+            consumer.join()
+        self.assertEqual(post.call_count, 3)
+        self.assertEqual(errors, [[{'event': 'python event'}]])
+
+    def test_retry_not_scheduled(self):
+        q = Queue()
+        errors = []
+        scheduler = RetryScheduler(max_items=1)
+        consumer = Consumer(q, self._event_bridge_client,
+                            on_error=lambda e, batch: errors.append(batch),
+                            retry_scheduler=scheduler)
+        for error in (APIError(1, '400', 'Bad Request'),
+                      Exception('connection reset')):
+            q.put({'event': 'a'})
+            q.put({'event': 'b'})
+            with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                            mock.Mock(side_effect=error)):
+                consumer.upload()
+        # client errors aren't retried, and there is only room for one
+        # retried item
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(scheduler.pending(), 0)
+        self.assertEqual(scheduler.metrics.counter('retry_overflow'), 2)
+        q.join()
+
+    def test_send_reports_throttling(self):
+        q = Queue()
+        concurrency = mock.Mock()
+        consumer = Consumer(q, self._event_bridge_client,
+                            retry_scheduler=RetryScheduler(),
+                            concurrency=concurrency)
+        errors = [None, APIError(1, '500', 'Internal Error'),
+                  PartialFailureError(
+                      [(0, 'ThrottlingException', 'Rate exceeded')],
+                      [{'event': 'python event'}])]
+        for error in errors:
+            q.put({'event': 'python event'})
+            with mock.patch('eventbridge.analytics.request.EventBridge.post',
+                            mock.Mock(side_effect=error)):
+                consumer.upload()
+        self.assertEqual(concurrency.acquire.call_count, 3)
+        self.assertEqual([call[0][1] for call in
+                          concurrency.release.call_args_list],
+                         [False, False, True])
+
+    def test_request_waits_for_rate_limiter(self):
+        limiter = mock.Mock()
+        limiter.reserve.side_effect = [0, 0.01]
+        consumer = Consumer(None, self._event_bridge_client,
+                            rate_limiter=limiter)
+        self._test_request_retry(consumer, APIError(
+            1, 'ThrottlingException', 'Rate exceeded'), 1)
+        # every call, retries included, takes a token
+        self.assertEqual(limiter.reserve.call_count, 2)
+
     def test_pause(self):
         consumer = Consumer(None, self._event_bridge_client)
         consumer.pause()
@@ -229,24 +560,45 @@ class TestConsumer(unittest.TestCase):
     def test_max_batch_size(self):
         q = Queue()
         consumer = Consumer(
-            q, self._event_bridge_client, upload_size=950000,
+            q, self._event_bridge_client, upload_size=10,
             upload_interval=3)
         track = {
             'type': 'track',
             'event': 'python event',
-            'userId': 'userId'
+            'userId': 'userId',
+            'properties': {'m': 'x' * 100000}
         }
-        msg_size = len(json.dumps(track).encode())
+        entry_size = self._event_bridge_client.entry_size(track)
         # number of messages in a maximum-size batch
-        n_msgs = int(950000 / msg_size)
+        n_msgs = int(BATCH_SIZE_LIMIT / entry_size)
+        self.assertEqual(n_msgs, 2)
+        sizes = []
 
-        def mock_post_fn(_, data, **kwargs):
-            pass
+        def mock_post_fn(**kwargs):
+            sizes.append(sum(self._event_bridge_client.entry_size(item)
+                             for item in kwargs['batch']))
 
         with mock.patch('eventbridge.analytics.request.EventBridge.post',
                         side_effect=mock_post_fn) as mock_post:
             consumer.start()
-            for _ in range(0, n_msgs + 2):
+            for _ in range(0, n_msgs * 2 + 1):
                 q.put(track)
             q.join()
-            self.assertEqual(mock_post.call_count, 1533)
+            self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(sizes, [entry_size * 2, entry_size * 2, entry_size])
+
+    def test_next_packs_batches(self):
+        q = Queue()
+        consumer = Consumer(q, self._event_bridge_client, upload_interval=0.1)
+        large = {'m': 'x' * 150000}
+        small = {'m': 'x' * 50000}
+        for msg in (large, large, small):
+            q.put(msg)
+        # the second large message doesn't fit next to the first one, the
+        # small one does
+        batch = consumer.next()
+        self.assertEqual([item.msg for item in batch], [large, small])
+        self.assertEqual([item.msg for item in consumer.carry], [large])
+        batch = consumer.next()
+        self.assertEqual([item.msg for item in batch], [large])
+        self.assertEqual(consumer.carry, [])
@@ -0,0 +1,61 @@
+import unittest
+
+from eventbridge.analytics.metrics import Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters(self):
+        metrics = Metrics()
+        metrics.incr('batches_sent')
+        metrics.incr('entries_delivered', 10)
+        metrics.incr('entries_delivered', 5)
+        self.assertEqual(metrics.counter('batches_sent'), 1)
+        self.assertEqual(metrics.counter('entries_delivered'), 15)
+        self.assertEqual(metrics.counter('retries'), 0)
+        self.assertEqual(metrics.stats()['counters'],
+                         {'batches_sent': 1, 'entries_delivered': 15})
+
+    def test_histogram(self):
+        histogram = Histogram((1, 5, 10))
+        for value in (0.5, 1, 3, 7, 20):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['sum'], 31.5)
+        self.assertEqual(snapshot['buckets'],
+                         {1: 2, 5: 3, 10: 4, float('inf'): 5})
+
+    def test_observe(self):
+        metrics = Metrics()
+        metrics.histogram('batch_entries', range(1, 11))
+        metrics.observe('batch_entries', 10)
+        histogram = metrics.stats()['histograms']['batch_entries']
+        self.assertEqual(histogram['count'], 1)
+        self.assertEqual(histogram['buckets'][9], 0)
+        self.assertEqual(histogram['buckets'][10], 1)
+        self.assertRaises(KeyError, metrics.observe, 'undeclared', 1)
+
+    def test_gauges(self):
+        metrics = Metrics()
+        depth = [3]
+        metrics.gauge('queue_depth', lambda: depth[0])
+        self.assertEqual(metrics.stats()['gauges'], {'queue_depth': 3})
+        depth[0] = 0
+        self.assertEqual(metrics.stats()['gauges'], {'queue_depth': 0})
+
+    def test_hooks(self):
+        metrics = Metrics()
+        metrics.histogram('put_events_latency', (0.1, 1))
+        updates = []
+
+        def hook(kind, name, value):
+            updates.append((kind, name, value))
+
+        metrics.add_hook(hook)
+        metrics.incr('retries')
+        metrics.observe('put_events_latency', 0.05)
+        metrics.remove_hook(hook)
+        metrics.incr('retries')
+        self.assertEqual(updates, [('counter', 'retries', 1),
+                                   ('histogram', 'put_events_latency', 0.05)])
@@ -0,0 +1,85 @@
+import unittest
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from eventbridge.analytics.consumer import Consumer
+from eventbridge.analytics.pool import ConsumerPool
+
+
+class TestConsumerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = Queue()
+
+        def factory():
+            return Consumer(self.queue, None, upload_interval=0.1)
+
+        self.factory = factory
+
+    def tearDown(self):
+        self.pool.join()
+
+    def test_starts_min_workers(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=3)
+        self.pool.start()
+        self.assertEqual(len(self.pool.consumers), 3)
+        self.assertEqual(len(self.pool.workers()), 3)
+        self.assertFalse(self.pool.autoscale)
+        self.assertIsNone(self.pool.supervisor)
+
+    def test_join_stops_all_workers(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=3)
+        self.pool.start()
+        self.pool.join()
+        for consumer in self.pool.consumers:
+            self.assertFalse(consumer.is_alive())
+
+    def test_join_without_start(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=2)
+        self.pool.join()
+
+    def test_invalid_bounds(self):
+        self.pool = ConsumerPool(self.queue, self.factory)
+        self.assertRaises(ValueError, ConsumerPool, self.queue, self.factory,
+                          min_workers=2, max_workers=1)
+
+    def test_scale_bounds(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=1,
+                                 max_workers=2, scale_interval=60)
+        self.pool.start()
+        self.assertTrue(self.pool.scale_up())
+        self.assertFalse(self.pool.scale_up())
+        self.assertEqual(len(self.pool.workers()), 2)
+        self.assertTrue(self.pool.scale_down())
+        self.assertFalse(self.pool.scale_down())
+        self.assertEqual(len(self.pool.workers()), 1)
+
+    def test_check_scales_on_backlog(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=1,
+                                 max_workers=3, target_drain_time=1.0,
+                                 idle_ticks=2)
+        consumer = self.pool.consumers[0]
+        # 100 queued items at 1s per batch of 10 take 10s to drain
+        consumer.latency = 1.0
+        for i in range(100):
+            self.queue.put(i)
+        self.pool.check()
+        self.assertEqual(len(self.pool.workers()), 2)
+
+        while not self.queue.empty():
+            self.queue.get()
+        self.pool.check()
+        self.assertEqual(len(self.pool.workers()), 2)
+        self.pool.check()
+        self.assertEqual(len(self.pool.workers()), 1)
+
+    def test_stats(self):
+        self.pool = ConsumerPool(self.queue, self.factory, min_workers=2)
+        stats = self.pool.stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(len(stats['consumers']), 2)
+        self.assertEqual(stats['consumers'][0]['messages'], 0)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from eventbridge.analytics.ratelimit import SharedTokenBucket
+
+
+class TestSharedTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'rate')
+        self.now = 100.0
+        patcher = mock.patch('monotonic.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bucket(self, rate=10, **kwargs):
+        bucket = SharedTokenBucket(self.path, rate, **kwargs)
+        self.addCleanup(bucket.close)
+        return bucket
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, SharedTokenBucket, self.path, 0)
+
+    def test_reserve(self):
+        bucket = self.bucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.now += 1
+        self.assertEqual(bucket.reserve(), 0)
+        stats = bucket.stats()
+        self.assertEqual(stats['rate'], 10)
+        self.assertEqual(stats['tokens'], 1)
+        self.assertEqual(stats['processes'], [{
+            'pid': os.getpid(), 'taken': 4, 'waited': 0.1, 'active': True}])
+
+    def test_shared(self):
+        # a second process sees the tokens the first one took
+        first = self.bucket(rate=10, burst=2)
+        with mock.patch('os.getpid', return_value=1):
+            second = self.bucket(rate=10, burst=2)
+            self.assertEqual(second.reserve(2), 0)
+        self.assertAlmostEqual(first.reserve(), 0.1)
+        pids = [p['pid'] for p in first.stats()['processes']]
+        self.assertEqual(sorted(pids), sorted([1, os.getpid()]))
+
+    def test_fair_share(self):
+        bucket = self.bucket(rate=10, burst=1)
+        with mock.patch('os.getpid', return_value=1):
+            other = self.bucket(rate=10, burst=1)
+            other.reserve()
+        # with another active process, this one is paced at half the rate
+        waits = [bucket.reserve() for _ in range(3)]
+        self.assertAlmostEqual(waits[-1], 0.3)
+        self.now += 10
+        # the other one has gone idle, so this one has the whole rate again
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+
+    def test_after_reboot(self):
+        before = self.bucket(rate=10, burst=1)
+        self.now = 86400.0
+        before.reserve(5)
+        # the file outlives a reboot, which restarts the clock, and the
+        # pid is reused
+        self.now = 1.0
+        after = self.bucket(rate=10, burst=1)
+        self.assertAlmostEqual(after.reserve(), 0.5)
+        self.now += 1
+        self.assertEqual(after.reserve(), 0)
+        self.assertEqual(after.stats()['tokens'], 0)
+
+    def test_reclaims_slots(self):
+        bucket = self.bucket(max_processes=2)
+        with mock.patch('os.getpid', return_value=2 ** 22 + 1):
+            self.bucket(max_processes=2)
+        # the slot of a process that has exited is reused
+        with mock.patch('os.getpid', return_value=2 ** 22 + 2), \
+                mock.patch('eventbridge.analytics.ratelimit._alive',
+                           lambda pid: pid != 2 ** 22 + 1):
+            third = self.bucket(max_processes=2)
+        self.assertEqual(third.slot, 1)
+        self.assertEqual(bucket.slot, 0)
+
+    def test_after_fork(self):
+        bucket = self.bucket()
+        bucket.reserve()
+        with mock.patch('os.getpid', return_value=1):
+            bucket.reserve()
+            self.assertEqual(bucket.pid, 1)
+        self.assertEqual(len(bucket.stats()['processes']), 2)
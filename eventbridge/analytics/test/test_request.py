@@ -1,10 +1,15 @@
 from datetime import datetime, date
+import subprocess
+import sys
 import unittest
 import json
+import mock
 import boto3
 from moto import mock_iam, mock_events
 
-from eventbridge.analytics.request import EventBridge, DatetimeSerializer
+from eventbridge.analytics.request import (
+    EventBridge, DatetimeSerializer, EncodedMessage, APIError,
+    PartialFailureError, boto_client, boto_config)
 
 
 @mock_iam
@@ -54,6 +59,54 @@ class TestRequests(unittest.TestCase):
             secret_access_key=user["SecretAccessKey"],
             region_name=self._region_name)
 
+    def test_boto_client_is_shared(self):
+        first = boto_client('eu-west-1', 'key', 'secret')
+        self.assertIs(boto_client('eu-west-1', 'key', 'secret'), first)
+        self.assertIsNot(boto_client('eu-west-1', 'other', 'secret'), first)
+        self.assertIsNot(boto_client('eu-west-1', 'key', 'secret',
+                                     max_pool_connections=50), first)
+
+    def test_boto_client_config(self):
+        client = boto_client('eu-west-1', 'key', 'secret',
+                             max_pool_connections=40, connect_timeout=2,
+                             read_timeout=7)
+        config = client.meta.config
+        self.assertEqual(config.max_pool_connections, 40)
+        self.assertEqual(config.connect_timeout, 2)
+        self.assertEqual(config.read_timeout, 7)
+        self.assertTrue(config.tcp_keepalive)
+        # the library retries by itself
+        self.assertEqual(config.retries['total_max_attempts'], 1)
+        self.assertEqual(client.meta.region_name, 'eu-west-1')
+
+    def test_boto_config_without_tcp_keepalive(self):
+        from botocore.config import Config
+        options = dict((name, default) for name, default
+                       in Config.OPTION_DEFAULTS.items()
+                       if name != 'tcp_keepalive')
+        # a botocore release that predates tcp_keepalive
+        with mock.patch.object(Config, 'OPTION_DEFAULTS', options):
+            with self.assertRaises(TypeError):
+                Config(tcp_keepalive=True)
+            config = boto_config(max_pool_connections=40)
+        self.assertEqual(config.max_pool_connections, 40)
+        self.assertEqual(config.retries['total_max_attempts'], 1)
+
+    def test_boto_client_is_created_on_first_use(self):
+        client = EventBridge(source_id=self._source_id,
+                             event_bus_name=self._bus_name,
+                             region_name=self._region_name)
+        self.assertIsNone(client._boto_client)
+        self.assertIs(client.boto_client, client.boto_client)
+        self.assertEqual(client.boto_client.meta.region_name,
+                         self._region_name)
+
+    def test_import_does_not_load_boto3(self):
+        code = ('import sys, eventbridge.analytics; '
+                'print("boto3" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'False')
+
     def test_valid_request(self):
         res = self._event_bridge_client.post(batch=[{
             'userId': 'userId',
@@ -62,6 +115,65 @@ class TestRequests(unittest.TestCase):
         }])
         self.assertEqual(res['FailedEntryCount'], 0)
 
+    def test_valid_request_with_encoded_msg(self):
+        res = self._event_bridge_client.post(batch=[EncodedMessage({
+            'userId': 'userId',
+            'event': 'python event',
+            'type': 'track'
+        })])
+        self.assertEqual(res['FailedEntryCount'], 0)
+
+    def test_encoded_msg(self):
+        msg = {'created': datetime(2012, 3, 4, 5, 6, 7, 891011), 'name': 'é'}
+        encoded = EncodedMessage(msg)
+        self.assertIs(encoded.msg, msg)
+        self.assertEqual(encoded.detail, json.dumps(msg, cls=DatetimeSerializer))
+        self.assertEqual(encoded.size, len(encoded.detail.encode()))
+
+    def test_released_encoded_msg(self):
+        encoded = EncodedMessage({'event': 'python event',
+                                  'created': date(2012, 3, 4)})
+        detail = encoded.detail
+        encoded.release()
+        self.assertEqual(encoded.msg, {'event': 'python event',
+                                       'created': '2012-03-04'})
+        self.assertEqual(encoded.detail, detail)
+
+    def test_partial_failure(self):
+        response = {
+            'FailedEntryCount': 2,
+            'Entries': [
+                {'ErrorCode': 'ThrottlingException', 'ErrorMessage': 'slow'},
+                {'EventId': '1'},
+                {'ErrorCode': 'MalformedDetail', 'ErrorMessage': 'bad'},
+            ],
+        }
+        batch = [{'event': 'a'}, {'event': 'b'}, {'event': 'c'}]
+        with mock.patch.object(self._event_bridge_client.boto_client,
+                               'put_events', return_value=response):
+            with self.assertRaises(PartialFailureError) as cm:
+                self._event_bridge_client.post(batch=batch)
+        self.assertEqual(cm.exception.failures, [
+            (0, 'ThrottlingException', 'slow'),
+            (2, 'MalformedDetail', 'bad'),
+        ])
+        self.assertEqual(cm.exception.entries, [batch[0], batch[2]])
+        self.assertEqual(cm.exception.failed_count, 2)
+
+    def test_entry_size(self):
+        msg = {'event': 'python event'}
+        size = self._event_bridge_client.entry_size(msg)
+        self.assertEqual(size, len(json.dumps(msg)) + len(self._source_id)
+                         + len('eventbridge_analytics_python')
+                         + len(self._bus_name))
+
+    def test_retryable(self):
+        self.assertTrue(APIError(1, 'ThrottlingException', '').retryable)
+        self.assertTrue(APIError(1, '500', '').retryable)
+        self.assertTrue(APIError(1, '429', '').retryable)
+        self.assertFalse(APIError(1, '400', '').retryable)
+        self.assertFalse(APIError(1, 'AccessDeniedException', '').retryable)
+
     def test_datetime_serialization(self):
         data = {'created': datetime(2012, 3, 4, 5, 6, 7, 891011)}
         result = json.dumps(data, cls=DatetimeSerializer)
@@ -0,0 +1,47 @@
+import unittest
+
+import mock
+
+from eventbridge.analytics.retry import RetryScheduler
+
+
+class TestRetryScheduler(unittest.TestCase):
+
+    def test_delay(self):
+        scheduler = RetryScheduler(base_delay=1.0, max_delay=10.0)
+        for _ in range(20):
+            self.assertTrue(0.5 <= scheduler.delay(1) <= 1.0)
+            self.assertTrue(4.0 <= scheduler.delay(4) <= 8.0)
+            self.assertTrue(5.0 <= scheduler.delay(10) <= 10.0)
+
+    def test_pop_due(self):
+        scheduler = RetryScheduler()
+        with mock.patch('monotonic.monotonic', return_value=100.0):
+            with mock.patch.object(scheduler, 'delay', side_effect=[2, 1]):
+                self.assertTrue(scheduler.schedule(['a'], 1))
+                self.assertTrue(scheduler.schedule(['b', 'c'], 2))
+            self.assertIsNone(scheduler.pop_due())
+            self.assertEqual(scheduler.next_due(), 1)
+        self.assertEqual(scheduler.stats(), {'batches': 2, 'items': 3})
+        with mock.patch('monotonic.monotonic', return_value=101.5):
+            self.assertEqual(scheduler.pop_due(), (['b', 'c'], 2))
+            self.assertIsNone(scheduler.pop_due())
+        with mock.patch('monotonic.monotonic', return_value=102.0):
+            self.assertEqual(scheduler.pop_due(), (['a'], 1))
+        self.assertIsNone(scheduler.next_due())
+        self.assertEqual(scheduler.metrics.counter('retries'), 2)
+
+    def test_max_items(self):
+        scheduler = RetryScheduler(max_items=3)
+        self.assertTrue(scheduler.schedule(['a', 'b'], 1))
+        self.assertFalse(scheduler.schedule(['c', 'd'], 1))
+        self.assertTrue(scheduler.schedule(['c'], 1))
+        self.assertEqual(scheduler.metrics.counter('retry_overflow'), 2)
+
+    def test_pending(self):
+        scheduler = RetryScheduler()
+        owner = object()
+        scheduler.schedule(['a'], 1, owner=owner)
+        scheduler.schedule(['b'], 1)
+        self.assertEqual(scheduler.pending(), 2)
+        self.assertEqual(scheduler.pending(owner), 1)
@@ -0,0 +1,68 @@
+import unittest
+
+from eventbridge.analytics.sampling import Rule, Sampler, user_hash
+
+
+def track(event, user='user'):
+    return {'type': 'track', 'event': event, 'userId': user}
+
+
+class TestSampler(unittest.TestCase):
+
+    def test_invalid_rules(self):
+        self.assertRaises(ValueError, Rule, rate=0.5)
+        self.assertRaises(ValueError, Rule, event='e', type='track')
+        self.assertRaises(ValueError, Rule, event='e', rate=2)
+        self.assertRaises(TypeError, Sampler, [{'event': 'e', 'rat': 0.5}])
+
+    def test_rule(self):
+        sampler = Sampler([{'event': 'Heartbeat', 'rate': 0},
+                           {'type': 'track', 'rate': 0.5},
+                           {'type': 'page', 'limit': 10}])
+        self.assertEqual(sampler.rule(track('Heartbeat')).event, 'Heartbeat')
+        self.assertEqual(sampler.rule(track('Clicked')).type, 'track')
+        self.assertEqual(sampler.rule({'type': 'page'}).type, 'page')
+        self.assertIsNone(sampler.rule({'type': 'identify'}))
+
+    def test_rate(self):
+        sampler = Sampler([{'event': 'Scrolled', 'rate': 0.1},
+                           {'event': 'Heartbeat', 'rate': 0}])
+        users = ['user-%d' % i for i in range(10000)]
+        kept = [user for user in users
+                if sampler.keep(track('Scrolled', user))]
+        self.assertAlmostEqual(len(kept) / 10000.0, 0.1, delta=0.02)
+        # the same users are kept every time
+        self.assertEqual(kept, [user for user in users
+                                if sampler.keep(track('Scrolled', user))])
+        self.assertFalse(sampler.keep(track('Heartbeat')))
+        self.assertTrue(sampler.keep(track('Clicked')))
+        self.assertEqual(sampler.metrics.counter('dropped_sampled'),
+                         2 * (10000 - len(kept)) + 1)
+
+    def test_user_hash(self):
+        self.assertEqual(user_hash({'userId': 'user'}),
+                         user_hash({'userId': 'user', 'anonymousId': 'a'}))
+        self.assertEqual(user_hash({'userId': None, 'anonymousId': 'a'}),
+                         user_hash({'anonymousId': 'a'}))
+        self.assertEqual(user_hash({'userId': 1}), user_hash({'userId': '1'}))
+        self.assertTrue(0 <= user_hash({'userId': 'user'}) < 1)
+
+    def test_limit(self):
+        sampler = Sampler([{'event': 'Heartbeat', 'limit': 10, 'burst': 3}])
+        kept = [sampler.keep(track('Heartbeat')) for _ in range(5)]
+        self.assertEqual(kept, [True, True, True, False, False])
+        self.assertEqual(sampler.metrics.counter('dropped_rate_limited'), 2)
+
+    def test_after_fork(self):
+        sampler = Sampler([{'event': 'Clicked', 'limit': 10},
+                           {'type': 'page', 'limit': 10}])
+        buckets = [sampler.events['Clicked'].bucket,
+                   sampler.types['page'].bucket]
+        # held by a thread that doesn't survive the fork
+        for bucket in buckets:
+            bucket.lock.acquire()
+        sampler.after_fork()
+        for bucket in buckets:
+            self.assertFalse(bucket.lock.locked())
+        self.assertTrue(sampler.keep(track('Clicked')))
+        self.assertTrue(sampler.keep({'type': 'page', 'userId': 'user'}))
@@ -0,0 +1,87 @@
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+import unittest
+import json
+
+import mock
+
+from eventbridge.analytics import serializers
+from eventbridge.analytics.serializers import (
+    JSONSerializer, OrjsonSerializer, UjsonSerializer, get_serializer)
+
+
+class Color(Enum):
+    RED = 'red'
+
+
+class TestSerializer(unittest.TestCase):
+
+    payload = {
+        'created': datetime(2012, 3, 4, 5, 6, 7, 891011),
+        'birthdate': date(1981, 2, 2),
+        'price': Decimal('0.5'),
+        'color': Color.RED,
+        'id': UUID('12345678-1234-5678-1234-567812345678'),
+        'tags': {'a'},
+    }
+
+    expected = {
+        'created': '2012-03-04T05:06:07.891011',
+        'birthdate': '1981-02-02',
+        'price': 0.5,
+        'color': 'red',
+        'id': '12345678-1234-5678-1234-567812345678',
+        'tags': ['a'],
+    }
+
+    def test_json(self):
+        result = JSONSerializer().dumps(self.payload)
+        self.assertEqual(json.loads(result), self.expected)
+
+    def test_json_unsupported(self):
+        self.assertRaises(TypeError, JSONSerializer().dumps,
+                          {'fn': lambda x: x})
+
+    @unittest.skipIf(serializers.orjson is None, 'orjson is not installed')
+    def test_orjson(self):
+        result = OrjsonSerializer().dumps(self.payload)
+        self.assertIsInstance(result, str)
+        self.assertEqual(json.loads(result), self.expected)
+
+    @unittest.skipIf(serializers.ujson is None, 'ujson is not installed')
+    def test_ujson(self):
+        result = UjsonSerializer().dumps(self.payload)
+        self.assertEqual(json.loads(result), self.expected)
+
+    @unittest.skipIf(serializers.ujson is None, 'ujson is not installed')
+    def test_ujson_nan_and_large_ints(self):
+        payload = {'nan': float('nan'), 'inf': float('inf'),
+                   'large': 2 ** 70, 'small': -2 ** 70}
+        serializer = UjsonSerializer()
+        expected = JSONSerializer().dumps(payload)
+        self.assertEqual(json.loads(serializer.dumps(payload))['large'],
+                         2 ** 70)
+        self.assertIn('NaN', serializer.dumps(payload))
+        self.assertIn('Infinity', serializer.dumps(payload))
+        # older ujson releases can't encode integers past 64 bits
+        with mock.patch.object(serializers.ujson, 'dumps',
+                               side_effect=OverflowError('int too big')):
+            self.assertEqual(serializer.dumps(payload), expected)
+
+    @unittest.skipIf(serializers.orjson is None, 'orjson is not installed')
+    def test_orjson_large_ints(self):
+        serializer = OrjsonSerializer()
+        self.assertEqual(json.loads(serializer.dumps({'large': 2 ** 70})),
+                         {'large': 2 ** 70})
+        self.assertRaises(TypeError, serializer.dumps, {'fn': lambda x: x})
+
+    def test_get_serializer(self):
+        self.assertIsInstance(get_serializer(), JSONSerializer)
+        self.assertIsInstance(get_serializer('json'), JSONSerializer)
+        self.assertEqual(get_serializer('auto').name,
+                         serializers.available()[0])
+        custom = JSONSerializer()
+        self.assertIs(get_serializer(custom), custom)
+        self.assertRaises(ValueError, get_serializer, 'unknown')
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from eventbridge.analytics.request import EncodedMessage
+from eventbridge.analytics.spool import Spool, SpoolFeeder
+
+
+def message(i):
+    return EncodedMessage({'type': 'track', 'event': 'python event %d' % i})
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def events(self, items):
+        return [item.msg['event'] for item in items]
+
+    def test_append_read(self):
+        spool = Spool(self.path)
+        self.assertTrue(spool.empty())
+        for i in range(3):
+            self.assertTrue(spool.append(message(i)))
+        self.assertFalse(spool.empty())
+        items = spool.read(2)
+        self.assertEqual(self.events(items),
+                         ['python event 0', 'python event 1'])
+        self.assertEqual(items[0].detail, message(0).detail)
+        self.assertEqual(self.events(spool.read(10)), ['python event 2'])
+        self.assertEqual(spool.read(10), [])
+        spool.commit()
+        self.assertTrue(spool.empty())
+
+    def test_replay_after_restart(self):
+        spool = Spool(self.path)
+        for i in range(3):
+            spool.append(message(i))
+        spool.read(1)
+        spool.commit()
+        # read but not committed
+        spool.read(1)
+        spool.close()
+
+        spool = Spool(self.path)
+        self.assertEqual(self.events(spool.read(10)),
+                         ['python event 1', 'python event 2'])
+
+    def test_partial_commit(self):
+        spool = Spool(self.path)
+        for i in range(3):
+            spool.append(message(i))
+        spool.read(3)
+        spool.commit(1)
+        self.assertEqual(self.events(spool.read(10)),
+                         ['python event 1', 'python event 2'])
+
+    def test_max_bytes(self):
+        size = len(message(0).detail) + 4
+        spool = Spool(self.path, max_bytes=size * 2)
+        self.assertTrue(spool.append(message(0)))
+        self.assertTrue(spool.append(message(1)))
+        self.assertFalse(spool.append(message(2)))
+        spool.read(1)
+        spool.commit()
+        self.assertTrue(spool.append(message(2)))
+
+    def test_segments_are_removed(self):
+        spool = Spool(self.path, segment_bytes=100)
+        for i in range(10):
+            spool.append(message(i))
+        segments = [name for name in os.listdir(self.path)
+                    if name.endswith('.seg')]
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(len(self.events(spool.read(100))), 10)
+        spool.commit()
+        segments = [name for name in os.listdir(self.path)
+                    if name.endswith('.seg')]
+        self.assertEqual(len(segments), 1)
+        self.assertTrue(spool.empty())
+        spool.append(message(10))
+        self.assertEqual(self.events(spool.read(10)), ['python event 10'])
+
+    def test_partly_written_record(self):
+        spool = Spool(self.path)
+        spool.append(message(0))
+        spool.close()
+        with open(os.path.join(self.path, '0000000000.seg'), 'ab') as f:
+            f.write(b'\x00\x00\x01\x00{"trunc')
+        spool = Spool(self.path)
+        self.assertEqual(self.events(spool.read(10)), ['python event 0'])
+
+    def test_fsync_policy(self):
+        self.assertRaises(ValueError, Spool, self.path, fsync='sometimes')
+        spool = Spool(self.path, fsync='always')
+        self.assertTrue(spool.append(message(0)))
+
+    def test_feeder(self):
+        spool = Spool(self.path)
+        for i in range(5):
+            spool.append(message(i))
+        queue = Queue(3)
+        feeder = SpoolFeeder(spool, queue)
+        self.assertEqual(feeder.feed(), 3)
+        self.assertEqual(feeder.feed(), 0)
+        queue.get()
+        self.assertEqual(feeder.feed(), 1)
+        self.assertEqual(self.events(spool.read(10)), ['python event 4'])
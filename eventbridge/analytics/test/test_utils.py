@@ -1,5 +1,6 @@
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+import logging
 import unittest
 
 from dateutil.tz import tzutc
@@ -71,3 +72,46 @@ class TestUtils(unittest.TestCase):
                          utils.remove_trailing_slash('http://segment.io/'))
         self.assertEqual('http://segment.io',
                          utils.remove_trailing_slash('http://segment.io'))
+
+    def test_truncate(self):
+        self.assertEqual(utils.truncate('abc', None), 'abc')
+        self.assertEqual(utils.truncate('abc', 3), 'abc')
+        self.assertEqual(utils.truncate('abcdef', 2), 'ab...(4 more)')
+
+    def test_payload_log(self):
+        logger = logging.getLogger('eventbridge.analytics.test')
+
+        class Payload(object):
+            formatted = 0
+
+            def __str__(self):
+                Payload.formatted += 1
+                return 'x' * 100
+
+        logger.setLevel(logging.INFO)
+        utils.PayloadLog(logger).debug('payload: %s', Payload())
+        self.assertEqual(Payload.formatted, 0)
+
+        logger.setLevel(logging.DEBUG)
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            utils.PayloadLog(logger, sample_rate=0).debug(
+                'payload: %s', Payload())
+            utils.PayloadLog(logger, max_length=10).debug(
+                'payload: %s', Payload())
+        self.assertEqual(Payload.formatted, 1)
+        self.assertEqual(logs.output, [
+            'DEBUG:eventbridge.analytics.test:payload: xxxxxxxxxx...(90 more)'
+        ])
+
+    def test_token_bucket(self):
+        self.assertRaises(ValueError, utils.TokenBucket, 0)
+        bucket = utils.TokenBucket(10, burst=5)
+        self.assertEqual(bucket.reserve(5), 0)
+        # in debt for 5 tokens, half a second's worth
+        self.assertAlmostEqual(bucket.reserve(5), 0.5, places=2)
+
+    def test_token_bucket_take(self):
+        bucket = utils.TokenBucket(10, burst=2)
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
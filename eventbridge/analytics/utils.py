@@ -1,10 +1,13 @@
 from enum import Enum
 import logging
 import numbers
+import random
+from threading import Lock
 
 from decimal import Decimal
 from datetime import date, datetime
 from dateutil.tz import tzlocal, tzutc
+import monotonic
 
 log = logging.getLogger('eventbridge.analytics')
 
@@ -86,3 +89,79 @@ def _coerce_unicode(cmplx):
         log.warning('Error decoding: %s', item)
         return None
     return item
+
+
+def truncate(text, max_length):
+    """Shorten `text` to `max_length` characters, noting how much was cut."""
+    if max_length is None or len(text) <= max_length:
+        return text
+    return '%s...(%d more)' % (text[:max_length], len(text) - max_length)
+
+
+class PayloadLog(object):
+    """Logs message payloads at DEBUG level.
+
+    Nothing is formatted unless DEBUG is enabled for `logger`. Only a
+    `sample_rate` fraction of the calls is logged, and payloads are
+    truncated to `max_length` characters, so that debug logging can stay on
+    for busy clients.
+    """
+
+    def __init__(self, logger=log, sample_rate=1.0, max_length=None):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.max_length = max_length
+
+    def enabled(self):
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+    def debug(self, msg, *args):
+        """Log `msg % args` where the last of `args` is the payload."""
+        if not self.enabled():
+            return
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        payload = truncate(str(args[-1]), self.max_length)
+        self.logger.debug(msg, *(args[:-1] + (payload,)))
+
+
+class TokenBucket(object):
+    """Paces work to `rate` tokens per second, with bursts of up to `burst`
+    tokens (one second's worth by default).
+
+    `reserve(n)` takes `n` tokens, going into debt if there aren't enough,
+    and returns how many seconds the caller should wait before going ahead.
+    `take(n)` only takes them if there are enough, and returns whether it
+    did.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.last = monotonic.monotonic()
+        self.lock = Lock()
+
+    def _refill(self):
+        now = monotonic.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self, n=1):
+        with self.lock:
+            self._refill()
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def take(self, n=1):
+        with self.lock:
+            self._refill()
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
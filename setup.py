@@ -45,7 +45,9 @@ setup(
     license='MIT License',
     install_requires=install_requires,
     extras_require={
-        'test': tests_require
+        'test': tests_require,
+        'orjson': ['orjson>=3.0'],
+        'ujson': ['ujson>=5.5'],
     },
     description='A way to integrate analytics into AWS EventBridge.',
     long_description=long_description,